@@ -1,6 +1,8 @@
 ## ============================================
 ## file: app.py — ANALYSTIC.A PRO ULTRA SECURE
 ## ============================================
+import json
+import os
 import sys
 from pathlib import Path
 from dotenv import load_dotenv
@@ -15,7 +17,7 @@ if str(BASE_DIR) not in sys.path:
 load_dotenv()
 
 from fastapi import FastAPI, Request, Depends, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -25,17 +27,26 @@ from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 # Imports locais (relativos ao pacote analytica)
-from security.auth import get_current_user_or_redirect, login_user
-from etl.etl_engine import process_excel
-from charts.chart_engine import generate_chart
+from security.auth import get_current_user, get_current_user_or_redirect, login_user_async, revoke_token
+from security import crypto_service
+from etl.streaming import spool_upload
+from etl.jobs import create_job, submit_ingest_job, get_job, shutdown_executor
+from db.database import pool_stats, close_pools
+from charts.chart_engine import generate_chart_cached, MAX_POINTS
+from stats.forecast import shutdown_executor as shutdown_forecast_executor
 from gpt.gpt_engine import generate_insights
+from gpt import ai_engine
 
 # Prometheus (opcional, apenas se instalado)
 try:
-    from prometheus_client import Counter, Histogram, generate_latest
+    from prometheus_client import Counter, Gauge, Histogram, generate_latest
     PROMETHEUS_ENABLED = True
     REQUEST_COUNT = Counter("requests_total", "Total Requests")
     LATENCY = Histogram("request_latency_seconds", "Request latency")
+    DB_POOL_GAUGES = {
+        key: Gauge(f"db_pool_{key}", f"DB pool: {key}", ["pool"])
+        for key in ("size", "in_use", "idle", "waiting", "created", "closed", "max")
+    }
 except ImportError:
     PROMETHEUS_ENABLED = False
 
@@ -131,6 +142,9 @@ async def general_exception_handler(request: Request, exc: Exception):
 @app.get("/metrics")
 def metrics():
     if PROMETHEUS_ENABLED:
+        for pool_name, stats in pool_stats().items():
+            for key, value in stats.items():
+                DB_POOL_GAUGES[key].labels(pool=pool_name).set(value)
         return Response(generate_latest(), media_type="text/plain")
     return {"status": "prometheus not installed"}
 
@@ -144,6 +158,23 @@ def health():
     return {"status": "ok"}
 
 
+# ======================================================
+# CICLO DE VIDA (POOLS)
+# ======================================================
+@app.on_event("startup")
+async def start_pools():
+    await ai_engine.start_ai_clients()
+
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    shutdown_executor()
+    shutdown_forecast_executor()
+    crypto_service.shutdown()
+    await ai_engine.close_ai_clients()
+    await close_pools()
+
+
 # ======================================================
 # 🏠 LANDING PAGE PÚBLICA
 # ======================================================
@@ -151,11 +182,9 @@ def health():
 def landing_page(request: Request):
     """Landing page pública - primeira impressão"""
     # Verificar se usuário já está logado
-    token = request.cookies.get("access_token")
-    if token:
+    if request.cookies.get("access_token"):
         try:
-            from security.auth import verify_token
-            user = verify_token(token)
+            user = get_current_user(request)
             if user:
                 return RedirectResponse("/dashboard", status_code=302)
         except Exception:
@@ -187,8 +216,9 @@ def login_page(request: Request):
 
 
 @app.post("/login")
-def login(request: Request, email: str = Form(...), password: str = Form(...)):
-    token = login_user(email, password)
+async def login(request: Request, email: str = Form(...), password: str = Form(...)):
+    # Verificação da senha (KDF lento) roda no pool de criptografia
+    token = await login_user_async(email, password)
     if not token:
         return templates.TemplateResponse("login.html", {
             "request": request, 
@@ -205,8 +235,11 @@ def login(request: Request, email: str = Form(...), password: str = Form(...)):
 # LOGOUT
 # ======================================================
 @app.get("/logout")
-def logout():
+def logout(request: Request):
     """Faz logout do usuário"""
+    token = request.cookies.get("access_token")
+    if token:
+        revoke_token(token)
     response = RedirectResponse("/", status_code=302)
     response.delete_cookie("access_token")
     return response
@@ -246,19 +279,159 @@ def upload_page(request: Request, user=Depends(get_current_user_or_redirect)):
 async def upload_file(request: Request, file: UploadFile = File(...), user=Depends(get_current_user_or_redirect)):
     if isinstance(user, RedirectResponse):
         return user
-    await process_excel(file)
-    return {"status": "ok", "message": "Arquivo processado com sucesso"}
+    # Spool em disco e carga em background: a resposta sai antes do ETL
+    table_name = os.path.splitext(file.filename)[0].lower()
+    path = await spool_upload(file)
+    job = submit_ingest_job(create_job(file.filename, table_name, path, user=user))
+    return {
+        "status": "queued",
+        "message": "Arquivo recebido, processamento em andamento",
+        "job_id": job["id"],
+        "job_url": f"/api/jobs/{job['id']}",
+    }
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str, user=Depends(get_current_user_or_redirect)):
+    """Progresso do job de ingestão (linhas, throughput, erros)"""
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    job = get_job(job_id)
+    # Job de outro usuário: mesma resposta de inexistente (não revela o id)
+    if not job or job.get("user") != user:
+        return {"error": "Job não encontrado"}
+    job.pop("path", None)
+    return job
 
 
 # ======================================================
 # GERAR GRÁFICO DINÂMICO
 # ======================================================
+def _parse_filters(filters: str):
+    """filters da query: objeto JSON plano {coluna: valor escalar}"""
+    if not filters:
+        return None
+    parsed = json.loads(filters)
+    if not isinstance(parsed, dict):
+        raise ValueError("filters deve ser um objeto JSON {coluna: valor}")
+    for col, value in parsed.items():
+        if not isinstance(value, (str, int, float, bool)):
+            raise ValueError(f"Filtro inválido para {col}: use texto, número ou booleano")
+    return parsed
+
+
 @app.get("/chart")
-def chart(request: Request, table: str, x: str, y: str, user=Depends(get_current_user_or_redirect)):
+def chart(request: Request, table: str, x: str, y: str, agg: str = None, bucket: str = None,
+          filters: str = None, max_points: int = MAX_POINTS, downsample: str = "lttb",
+          chart_type: str = "line", user=Depends(get_current_user_or_redirect)):
     if isinstance(user, RedirectResponse):
         return user
-    graph_json = generate_chart(table, x, y)
-    return templates.TemplateResponse("chart.html", {"request": request, "graph_json": graph_json})
+    # filters: JSON com igualdades, ex.: {"regiao": "Sul"}
+    try:
+        etag, graph_json = generate_chart_cached(
+            table, x, y, agg=agg, bucket=bucket,
+            filters=_parse_filters(filters),
+            max_points=max(3, min(max_points, MAX_POINTS)),
+            downsample=downsample, chart_type=chart_type,
+            if_none_match=request.headers.get("if-none-match"),
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+    # Revalidação obrigatória: o navegador reaproveita a cópia enquanto o ETag valer
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if graph_json is None:
+        return Response(status_code=304, headers=cache_headers)
+    return templates.TemplateResponse("chart.html", {"request": request, "graph_json": graph_json},
+                                      headers=cache_headers)
+
+
+# ======================================================
+# ROLLUPS (AGREGAÇÕES PRÉ-CALCULADAS DOS TILES)
+# ======================================================
+@app.get("/api/rollups")
+def rollups_list(table: str, user=Depends(get_current_user_or_redirect)):
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    from dataclasses import asdict
+    from db.rollups import list_rollups
+    return {"rollups": [asdict(s) for s in list_rollups(table.lower())]}
+
+
+def _can_manage_rollups(user: str, table: str) -> bool:
+    """Rollups materializam (varredura completa) e apagam tabelas: admin ou owner do dataset"""
+    from security.auth import get_user_info
+    from models.workspace import owns_dataset
+    info = get_user_info(user) or {}
+    return info.get("role") == "admin" or owns_dataset(user, str(table))
+
+
+@app.post("/api/rollups")
+def rollups_define(data: dict, user=Depends(get_current_user_or_redirect)):
+    """
+    Declara e materializa rollups: {"table", "name", "dimensions", "measures",
+    "time_column", "grain"} ou {"layout": Dashboard.layout} (um por tabela dos tiles)
+    """
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    import psycopg2
+    from dataclasses import asdict
+    from db.rollups import define_rollup, rollups_from_layout
+
+    specs = rollups_from_layout(data["layout"]) if "layout" in data else [data]
+    specs = [spec if isinstance(spec, dict) else asdict(spec) for spec in specs]
+    denied = sorted({str(s.get("table")) for s in specs if not _can_manage_rollups(user, s.get("table") or "")})
+    if denied:
+        return {"error": f"Sem permissão para rollups de: {', '.join(denied)}", "rollups": []}
+
+    created = []
+    try:
+        for spec in specs:
+            created.append(asdict(define_rollup(
+                spec["table"], spec["name"], spec.get("dimensions", []), spec.get("measures", []),
+                time_column=spec.get("time_column"), grain=spec.get("grain"),
+            )))
+    except (KeyError, ValueError) as e:
+        return {"error": str(e), "rollups": created}
+    except psycopg2.Error as e:
+        # Coluna ou tabela inexistente etc.: erro do banco, não 500
+        print(f"Erro ao criar rollup: {e}")
+        return {"error": "Não foi possível criar o rollup (verifique tabela e colunas)", "rollups": created}
+    return {"status": "ok", "rollups": created}
+
+
+@app.delete("/api/rollups/{table}/{name}")
+def rollups_drop(table: str, name: str, user=Depends(get_current_user_or_redirect)):
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    import psycopg2
+    from db.rollups import drop_rollup
+    if not _can_manage_rollups(user, table):
+        return {"error": "Sem permissão"}
+    try:
+        dropped = drop_rollup(table, name)
+    except psycopg2.Error as e:
+        print(f"Erro ao remover rollup: {e}")
+        return {"error": "Não foi possível remover o rollup"}
+    return {"status": "ok" if dropped else "not_found"}
+
+
+# ======================================================
+# ANOMALIAS (SOBREPOSIÇÃO NOS GRÁFICOS)
+# ======================================================
+@app.get("/api/anomalies")
+def anomalies_list(table: str, column: str = None, kind: str = None, limit: int = 1000,
+                   user=Depends(get_current_user_or_redirect)):
+    """Pontos marcados na ingestão: kind = "rolling" (por lote) ou "seasonal" """
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    from stats.anomaly import list_anomalies
+    try:
+        points = list_anomalies(table, column=column, kind=kind, limit=min(limit, 10000))
+    except Exception as e:
+        print(f"Erro ao listar anomalias: {e}")
+        return {"error": "Não foi possível listar as anomalias", "anomalies": []}
+    return {"table": table.lower(), "anomalies": points}
 
 
 # ======================================================
@@ -281,7 +454,7 @@ async def ai_chat_endpoint(request: Request, user=Depends(get_current_user_or_re
     if isinstance(user, RedirectResponse):
         return {"error": "Não autenticado"}
     
-    from gpt.ai_engine import generate_ai_response
+    from gpt.ai_engine import get_chat
     
     data = await request.json()
     message = data.get("message", "")
@@ -290,10 +463,48 @@ async def ai_chat_endpoint(request: Request, user=Depends(get_current_user_or_re
     if not message:
         return {"error": "Mensagem vazia"}
     
-    result = await generate_ai_response(message, prefer_local)
+    # Histórico por usuário + sessão (aba/conversa do cliente)
+    chat = get_chat(user, data.get("session_id", "default"))
+    
+    # Streaming (SSE): {"stream": true} ou Accept: text/event-stream
+    if data.get("stream") or "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _sse_events(request, chat.stream_message(message, prefer_local)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    
+    result = await chat.send_message(message, prefer_local)
     return result
 
 
+@app.post("/api/ai/chat/clear")
+async def ai_chat_clear(request: Request, user=Depends(get_current_user_or_redirect)):
+    """Apaga o histórico da conversa"""
+    if isinstance(user, RedirectResponse):
+        return {"error": "Não autenticado"}
+    
+    from gpt.ai_engine import get_chat
+    
+    data = await request.json()
+    get_chat(user, data.get("session_id", "default")).clear_history()
+    return {"success": True}
+
+
+async def _sse_events(request: Request, events):
+    """
+    Repassa eventos como SSE. Se o cliente desconectar, fecha o gerador
+    de eventos, o que fecha a conexão com o provedor e para a geração.
+    """
+    try:
+        async for event in events:
+            if await request.is_disconnected():
+                break
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+        await events.aclose()
+
+
 @app.post("/api/ai/analyze")
 async def ai_analyze_endpoint(request: Request, user=Depends(get_current_user_or_redirect)):
     """Análise de dados com IA"""
@@ -304,8 +515,10 @@ async def ai_analyze_endpoint(request: Request, user=Depends(get_current_user_or
     
     data = await request.json()
     description = data.get("data", "")
+    table = data.get("table")
     
-    result = await analyze_data(description)
+    # Com "table": perfil estatístico calculado no servidor
+    result = await analyze_data(description, table=table)
     return result
 
 
@@ -320,42 +533,32 @@ async def ai_predict_endpoint(request: Request, user=Depends(get_current_user_or
     data = await request.json()
     historical = data.get("data", "")
     
+    # Com "table": previsão estatística no servidor; a IA só narra
+    if data.get("table"):
+        if not data.get("date_column") or not data.get("value_column"):
+            return {"error": "Informe date_column e value_column"}
+        try:
+            horizon = int(data.get("horizon", 3))
+        except (TypeError, ValueError):
+            return {"error": "horizon deve ser um número inteiro"}
+        return await predict_trend(
+            table=data["table"],
+            date_column=data["date_column"],
+            value_column=data["value_column"],
+            group_by=data.get("group_by"),
+            horizon=horizon,
+            freq=data.get("freq", "month"),
+            narrate=data.get("narrate", True),
+        )
+    
     result = await predict_trend(historical)
     return result
 
 
 @app.get("/api/ai/status")
 async def ai_status():
-    """Verifica status das IAs disponíveis"""
-    import httpx
-    import os
-    
-    status = {
-        "ollama": {"available": False, "model": None},
-        "gemini": {"available": False}
-    }
-    
-    # Verifica Ollama
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get("http://localhost:11434/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                models = [m["name"] for m in data.get("models", [])]
-                status["ollama"] = {
-                    "available": True,
-                    "models": models,
-                    "active_model": "gemma:2b" if "gemma:2b" in models else models[0] if models else None
-                }
-    except Exception:
-        pass
-    
-    # Verifica Gemini
-    gemini_key = os.getenv("GEMINI_API_KEY", "")
-    if gemini_key:
-        status["gemini"] = {"available": True, "model": "gemini-pro"}
-    
-    return status
+    """Verifica status das IAs disponíveis (cacheado, sem esperar a rede)"""
+    return await ai_engine.ai_status()
 
 
 # ======================================================
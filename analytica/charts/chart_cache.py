@@ -0,0 +1,66 @@
+# ============================================
+# ANALYSTIC.A — CACHE DE GRÁFICOS
+# LRU em memória + Redis, chave = parâmetros + versão dos dados
+# ============================================
+import hashlib
+import json
+import os
+import sys
+from typing import Dict, Optional
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from db.data_version import get_table_version
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+CHART_CACHE_TTL = int(os.getenv("CHART_CACHE_TTL", "3600"))
+CHART_CACHE_ENTRIES = int(os.getenv("CHART_CACHE_ENTRIES", "256"))
+# Figuras Plotly grandes: limita também o total em memória
+CHART_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_local = LRUCache(max_entries=CHART_CACHE_ENTRIES, ttl=CHART_CACHE_TTL, max_bytes=CHART_CACHE_MAX_BYTES)
+
+
+def chart_key(table: str, params: Dict) -> tuple:
+    """
+    Retorna (chave_cache, etag) para os parâmetros do gráfico na versão
+    atual da tabela. Nova ingestão → nova versão → nova chave.
+    """
+    version = get_table_version(table)
+    digest = hashlib.sha256(
+        json.dumps({"table": table, **params}, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"analytica:chart:{table}:{version}:{digest}", f'"{version}-{digest[:20]}"'
+
+
+def get_cached_chart(key: str) -> Optional[str]:
+    """Busca no LRU local e depois no Redis (promovendo para o local)"""
+    graph_json = _local.get(key)
+    if graph_json is not None:
+        return graph_json
+
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(key)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            return None
+        if raw is not None:
+            graph_json = raw.decode()
+            _local.set(key, graph_json)
+            return graph_json
+    return None
+
+
+def set_cached_chart(key: str, graph_json: str):
+    _local.set(key, graph_json)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(key, graph_json, ex=CHART_CACHE_TTL)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
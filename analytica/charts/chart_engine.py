@@ -1,39 +1,206 @@
 import plotly.graph_objects as go
-import sys
 import os
+import sys
+from typing import Dict, Optional
 
 # Adiciona o diretório raiz de analytica ao path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from db.database import get_db
+from db.database import db_connection, quote_ident
+from db.rollups import query_rollup
+from charts.downsample import lttb
+from charts.chart_cache import chart_key, get_cached_chart, set_cached_chart
+
+# Orçamento de pontos por gráfico (≈ largura em pixels de um gráfico grande)
+MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+
+# Limite de grupos lidos do banco em consultas agregadas
+MAX_GROUPS = 50000
+
+AGGREGATIONS = {
+    "sum": "SUM",
+    "avg": "AVG",
+    "count": "COUNT",
+    "min": "MIN",
+    "max": "MAX",
+}
+
+TIME_BUCKETS = ("minute", "hour", "day", "week", "month", "quarter", "year")
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def _ident(name: str) -> str:
+    """Identificador sem aspas é normalizado para minúsculas, como no Postgres"""
+    return quote_ident(name.strip().lower())
+
+
+def _where(filters: Optional[Dict]) -> tuple:
+    """Monta WHERE com filtros de igualdade parametrizados"""
+    if not filters:
+        return "", []
+    clauses = [f"{_ident(col)} = %s" for col in filters]
+    return " WHERE " + " AND ".join(clauses), list(filters.values())
+
+
+def _estimated_rows(cur, table: str) -> int:
+    """Estimativa de linhas pelo catálogo (não varre a tabela)"""
+    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", (_ident(table),))
+    row = cur.fetchone()
+    return int(row[0]) if row and row[0] and row[0] > 0 else 0
+
+
+# ============================================
+# CONSULTAS
+# ============================================
+def _query_aggregated(cur, table, x, y, agg, bucket, filters):
+    """GROUP BY no banco (com bucket de tempo opcional no eixo x)"""
+    x_expr = f"date_trunc('{bucket}', {_ident(x)})" if bucket else _ident(x)
+    y_expr = f"{AGGREGATIONS[agg]}({_ident(y)})"
+    where, params = _where(filters)
+    cur.execute(
+        f"SELECT {x_expr} AS x, {y_expr} AS y FROM {_ident(table)}{where} "
+        f"GROUP BY 1 ORDER BY 1 LIMIT %s",
+        params + [MAX_GROUPS],
+    )
+    return cur.fetchall()
+
+
+def _query_minmax(cur, table, x, y, n_buckets, filters):
+    """
+    Para cada um de `n_buckets` intervalos (ordenados por x) retorna só os
+    pontos de mínimo e máximo de y: no máximo 2 * n_buckets linhas.
+    """
+    where, params = _where(filters)
+    null_filter = f"{_ident(y)} IS NOT NULL"
+    where = f"{where} AND {null_filter}" if where else f" WHERE {null_filter}"
+    cur.execute(
+        f"""
+        WITH b AS (
+            SELECT {_ident(x)} AS x, {_ident(y)} AS y,
+                   ntile(%s) OVER (ORDER BY {_ident(x)}) AS bk
+            FROM {_ident(table)}{where}
+        ), r AS (
+            SELECT x, y,
+                   row_number() OVER (PARTITION BY bk ORDER BY y ASC, x) AS lo,
+                   row_number() OVER (PARTITION BY bk ORDER BY y DESC, x) AS hi
+            FROM b
+        )
+        SELECT x, y FROM r WHERE lo = 1 OR hi = 1 ORDER BY x
+        """,
+        [n_buckets] + params,
+    )
+    return cur.fetchall()
 
 
-def generate_chart(table, x, y):
-    conn = get_db()
-    cur = conn.cursor()
+def _query_raw(cur, table, x, y, filters, limit):
+    where, params = _where(filters)
+    cur.execute(
+        f"SELECT {_ident(x)}, {_ident(y)} FROM {_ident(table)}{where} ORDER BY {_ident(x)} LIMIT %s",
+        params + [limit],
+    )
+    return cur.fetchall()
+
 
-    q = f"SELECT {x}, {y} FROM {table} ORDER BY {x}"
-    cur.execute(q)
-    rows = cur.fetchall()
+def fetch_series(table: str, x: str, y: str, agg: Optional[str] = None, bucket: Optional[str] = None,
+                 filters: Optional[Dict] = None, max_points: int = MAX_POINTS,
+                 downsample: str = "lttb") -> tuple:
+    """
+    Retorna (x_vals, y_vals) com no máximo `max_points` pontos.
+    Agregação e bucketização rodam no Postgres (num rollup materializado
+    quando algum cobre a consulta); tabelas grandes sem agregação são
+    reduzidas por min/max por bucket no banco (+ LTTB).
+    """
+    if agg is not None and agg not in AGGREGATIONS:
+        raise ValueError(f"Agregação inválida: {agg}")
+    if bucket is not None and bucket not in TIME_BUCKETS:
+        raise ValueError(f"Bucket de tempo inválido: {bucket}")
+    if downsample not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Método de downsampling inválido: {downsample}")
+    if bucket and not agg:
+        agg = "sum"
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        if agg:
+            rows = query_rollup(cur, table, x, y, agg, bucket, filters, limit=MAX_GROUPS)
+            if rows is None:
+                rows = _query_aggregated(cur, table, x, y, agg, bucket, filters)
+        else:
+            rows = None
+            # Estatística do catálogo pode estar desatualizada: confirma com LIMIT n+1
+            if _estimated_rows(cur, table) <= max_points:
+                rows = _query_raw(cur, table, x, y, filters, max_points + 1)
+                if len(rows) > max_points:
+                    rows = None
+            if rows is None:
+                n_buckets = max_points // 2 if downsample == "minmax" else max_points
+                rows = _query_minmax(cur, table, x, y, n_buckets, filters)
+        cur.close()
 
     x_vals = [row[0] for row in rows]
     y_vals = [row[1] for row in rows]
 
+    if len(x_vals) > max_points:
+        x_vals, y_vals = lttb(x_vals, y_vals, max_points)
+
+    return x_vals, y_vals
+
+
+def generate_chart(table, x, y, agg=None, bucket=None, filters=None, max_points=MAX_POINTS,
+                   downsample="lttb", chart_type="line"):
+    if bucket and not agg:
+        agg = "sum"
+    x_vals, y_vals = fetch_series(table, x, y, agg, bucket, filters, max_points, downsample)
+
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=x_vals,
-        y=y_vals,
-        mode="lines+markers",
-        line=dict(width=4),
-        marker=dict(size=10)
-    ))
+    if chart_type == "bar":
+        fig.add_trace(go.Bar(x=x_vals, y=y_vals))
+    else:
+        # Muitos pontos: sem marcadores para manter o payload e o render leves
+        dense = len(x_vals) > 200
+        trace = go.Scattergl if dense else go.Scatter
+        fig.add_trace(trace(
+            x=x_vals,
+            y=y_vals,
+            mode="lines" if dense else "lines+markers",
+            line=dict(width=2 if dense else 4),
+            marker=dict(size=10)
+        ))
 
+    y_title = f"{agg.upper()}({y})" if agg else y
     fig.update_layout(
         template="plotly_dark",
-        title=f"{table.upper()} — {y} por {x}",
+        title=f"{table.upper()} — {y_title} por {x}",
         xaxis_title=x,
-        yaxis_title=y,
+        yaxis_title=y_title,
         height=600
     )
 
     return fig.to_json()
+
+
+def generate_chart_cached(table, x, y, agg=None, bucket=None, filters=None, max_points=MAX_POINTS,
+                          downsample="lttb", chart_type="line", if_none_match: Optional[str] = None):
+    """
+    Gráfico com cache por (parâmetros, versão da tabela).
+
+    Returns:
+        tuple: (etag, graph_json) — graph_json é None quando o ETag do
+        cliente (`if_none_match`) ainda é válido (responder 304).
+    """
+    # Mesmo nome que a ingestão versiona (e que o SQL usa): minúsculo
+    table = table.strip().lower()
+    params = {
+        "x": x, "y": y, "agg": agg, "bucket": bucket, "filters": filters,
+        "max_points": max_points, "downsample": downsample, "chart_type": chart_type,
+    }
+    key, etag = chart_key(table, params)
+    if if_none_match and etag in {t.strip() for t in if_none_match.split(",")}:
+        return etag, None
+
+    graph_json = get_cached_chart(key)
+    if graph_json is None:
+        graph_json = generate_chart(table, **params)
+        set_cached_chart(key, graph_json)
+    return etag, graph_json
@@ -0,0 +1,73 @@
+# ============================================
+# ANALYSTIC.A — DOWNSAMPLING DE SÉRIES
+# LTTB (Largest-Triangle-Three-Buckets) e min/max por bucket
+# ============================================
+import numpy as np
+
+
+def _as_float(values) -> np.ndarray:
+    """
+    Converte eixo x para float64 para cálculo de áreas: números (inclusive
+    Decimal do NUMERIC), datas, e qualquer outra coisa (texto, categoria)
+    pela posição.
+    """
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.number):
+        return arr.astype(np.float64)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return arr.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    try:
+        return arr.astype(np.float64)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return np.asarray(arr, dtype="datetime64[ns]").astype(np.int64).astype(np.float64)
+    except (TypeError, ValueError):
+        return np.arange(len(arr), dtype=np.float64)
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """
+    Índices dos pontos mantidos pelo LTTB.
+    Preserva picos e vales visuais com no máximo `n_out` pontos.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    xf = _as_float(x)
+    yf = np.asarray(y, dtype=np.float64)
+
+    # Buckets internos (primeiro e último ponto são sempre mantidos)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+
+        # Média do próximo bucket (ou o último ponto)
+        if i + 2 < len(edges):
+            nxt_start, nxt_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_x = xf[nxt_start:nxt_end].mean()
+            avg_y = yf[nxt_start:nxt_end].mean()
+        else:
+            avg_x, avg_y = xf[-1], yf[-1]
+
+        # Área do triângulo (prev, candidato, média do próximo) — vetorizada no bucket
+        area = np.abs(
+            (xf[prev] - avg_x) * (yf[start:end] - yf[prev])
+            - (xf[prev] - xf[start:end]) * (avg_y - yf[prev])
+        )
+        prev = start + int(np.argmax(area))
+        out[i + 1] = prev
+
+    return out
+
+
+def lttb(x, y, n_out: int):
+    """Aplica LTTB e retorna (x, y) reduzidos"""
+    idx = lttb_indices(x, y, n_out)
+    return [x[i] for i in idx], [y[i] for i in idx]
@@ -1,7 +1,26 @@
-import redis
 import json
+import os
+import sys
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+REALTIME_CHANNEL = "realtime_channel"
+
+
+def _publish(payload: dict):
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.publish(REALTIME_CHANNEL, json.dumps(payload, default=str))
+    except REDIS_ERRORS as e:
+        redis_failed(e)
+    except Exception as e:
+        print(f"Erro ao publicar no realtime: {e}")
 
-r = redis.Redis(host="redis", port=6379)
 
 def publish_realtime(table, x, y):
     payload = {
@@ -9,4 +28,15 @@ def publish_realtime(table, x, y):
         "x": x,
         "y": y
     }
-    r.publish("realtime_channel", json.dumps(payload))
+    _publish(payload)
+
+
+def publish_anomalies(table, points):
+    """Pontos anômalos recém-marcados (sobreposição nos gráficos ao vivo)"""
+    if not points:
+        return
+    _publish({
+        "type": "anomaly",
+        "table": table,
+        "points": points
+    })
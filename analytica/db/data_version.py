@@ -0,0 +1,62 @@
+import os
+import re
+
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+# Versão de dados por tabela: incrementada a cada ingestão.
+# Caches (gráficos, índices, modelos) incluem a versão na chave e
+# ficam obsoletos automaticamente quando ela muda.
+# Sem Redis, contadores em arquivo (compartilhados entre workers do mesmo host).
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "versions")
+os.makedirs(VERSIONS_DIR, exist_ok=True)
+
+
+def _key(table: str) -> str:
+    return f"analytica:table_version:{table}"
+
+
+def _path(table: str) -> str:
+    safe = re.sub(r"[^a-zA-Z0-9_.-]", "_", table)
+    return os.path.join(VERSIONS_DIR, safe)
+
+
+def get_table_version(table: str) -> int:
+    """Versão atual dos dados da tabela (0 se nunca ingerida)"""
+    r = get_redis()
+    if r is not None:
+        try:
+            value = r.get(_key(table))
+            return int(value) if value else 0
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+    try:
+        with open(_path(table), "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_table_version(table: str) -> int:
+    """Incrementa a versão (chamado após cada carga de dados)"""
+    r = get_redis()
+    if r is not None:
+        try:
+            version = int(r.incr(_key(table)))
+            # Espelha no arquivo: se o Redis cair, o fallback continua daqui
+            # (versões repetidas reaproveitariam caches antigos)
+            _write_version(table, version)
+            return version
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+    version = get_table_version(table) + 1
+    _write_version(table, version)
+    return version
+
+
+def _write_version(table: str, version: int):
+    tmp = f"{_path(table)}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(version))
+    os.replace(tmp, _path(table))
@@ -1,33 +1,317 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from urllib.parse import urlparse, parse_qs
 import psycopg2
+import psycopg2.extensions
 
+# Pool assíncrono (psycopg 3) é opcional: só usado por endpoints async
+try:
+    from psycopg_pool import AsyncConnectionPool
+    ASYNC_POOL_ENABLED = True
+except ImportError:
+    ASYNC_POOL_ENABLED = False
 
-def _conn_from_url(db_url: str):
-    parsed = urlparse(db_url)
-    query = parse_qs(parsed.query)
-    sslmode = query.get("sslmode", ["prefer"])[0]
-    return psycopg2.connect(
-        host=parsed.hostname,
-        port=parsed.port or 5432,
-        database=parsed.path.lstrip("/"),
-        user=parsed.username,
-        password=parsed.password,
-        sslmode=sslmode,
-    )
+# ============================================
+# CONFIGURAÇÕES DO POOL
+# ============================================
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))            # espera máx. por conexão (s)
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recicla conexões antigas (s)
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))      # health check se ociosa há mais (s)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
 
 
-def get_db():
+def _conn_params() -> dict:
     """
-    Retorna conexão com prioridade para DATABASE_URL (Fly Postgres attach).
+    Parâmetros de conexão com prioridade para DATABASE_URL (Fly Postgres attach).
     Fallback para variáveis separadas DB_HOST/DB_NAME/DB_USER/DB_PASS.
     """
     db_url = os.getenv("DATABASE_URL")
     if db_url:
-        return _conn_from_url(db_url)
+        parsed = urlparse(db_url)
+        query = parse_qs(parsed.query)
+        return {
+            "host": parsed.hostname,
+            "port": parsed.port or 5432,
+            "dbname": parsed.path.lstrip("/"),
+            "user": parsed.username,
+            "password": parsed.password,
+            "sslmode": query.get("sslmode", ["prefer"])[0],
+        }
+
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "dbname": os.getenv("DB_NAME", "analystic_a"),
+        "user": os.getenv("DB_USER", "analystic_a"),
+        "password": os.getenv("DB_PASS", "analystic_a_secret"),
+    }
+
+
+def get_db():
+    """
+    Abre uma conexão dedicada (sem pool e sem statement timeout).
+    Use para cargas longas (ETL); no caminho das requisições use db_connection().
+    """
+    return psycopg2.connect(**_conn_params())
+
+
+def quote_ident(name: str) -> str:
+    """Escapa um identificador SQL (tabela/coluna) entre aspas duplas"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# ============================================
+# POOL SÍNCRONO (psycopg2)
+# ============================================
+class PoolTimeout(Exception):
+    """Nenhuma conexão liberada dentro de DB_POOL_TIMEOUT"""
+
+
+class ConnectionPool:
+    """
+    Pool limitado de conexões psycopg2, thread-safe.
+    - health check (SELECT 1) em conexões ociosas há mais de `check_idle`
+    - reciclagem de conexões com mais de `max_lifetime`
+    - statement_timeout aplicado na abertura da conexão
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, max_lifetime: float,
+                 check_idle: float, statement_timeout_ms: int):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self.statement_timeout_ms = statement_timeout_ms
+
+        self._cond = threading.Condition()
+        self._idle = deque()        # (conn, created_at, last_used)
+        self._created_at = {}       # id(conn) → timestamp de criação
+        self._size = 0              # conexões abertas (ociosas + em uso)
+        self._in_use = 0
+        self._waiting = 0
+        self._created_total = 0
+        self._closed_total = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.time(), time.time()))
+            self._size += 1
+
+    def _open(self):
+        conn = psycopg2.connect(
+            options=f"-c statement_timeout={self.statement_timeout_ms}",
+            **_conn_params(),
+        )
+        self._created_at[id(conn)] = time.time()
+        self._created_total += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._closed_total += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created_at: float, last_used: float) -> bool:
+        now = time.time()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - last_used > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"Pool esgotado ({self.maxconn} conexões em uso)")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    conn, created_at, last_used = None, 0.0, 0.0
+                    self._size += 1
+                self._in_use += 1
+            finally:
+                self._waiting -= 1
+
+        # Abertura e health check fora do lock
+        try:
+            if conn is not None and not self._healthy(conn, created_at, last_used):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                created_at = self._created_at.get(id(conn), time.time())
+                self._idle.append((conn, created_at, time.time()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._size -= 1
+                self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created_total,
+                "closed": self._closed_total,
+                "max": self.maxconn,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Pool do processo atual (recriado após fork, ex.: workers de ingestão)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                    DB_POOL_MAX_LIFETIME, DB_POOL_CHECK_IDLE, DB_STATEMENT_TIMEOUT_MS,
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Empresta uma conexão do pool e devolve ao final (rollback se houver erro)"""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except psycopg2.InterfaceError:
+        broken = True
+        raise
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, discard=broken)
+
+
+def get_db_conn():
+    """Dependência FastAPI: conexão do pool síncrono"""
+    with db_connection() as conn:
+        yield conn
+
+
+# ============================================
+# POOL ASSÍNCRONO (psycopg 3)
+# ============================================
+_async_pool = None
+
+
+async def get_async_pool():
+    """Pool assíncrono do processo (aberto na primeira utilização)"""
+    global _async_pool
+    if not ASYNC_POOL_ENABLED:
+        raise RuntimeError("psycopg_pool não instalado: pool assíncrono indisponível")
+
+    if _async_pool is None:
+        params = _conn_params()
+        params["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+        pool = AsyncConnectionPool(
+            kwargs=params,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            max_idle=DB_POOL_CHECK_IDLE * 10,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await pool.open()
+        _async_pool = pool
+    return _async_pool
+
+
+async def get_async_db_conn():
+    """Dependência FastAPI: conexão do pool assíncrono"""
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def close_pools():
+    """Fecha os pools (shutdown da aplicação)"""
+    global _async_pool
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
 
-    host = os.getenv("DB_HOST", "localhost")
-    name = os.getenv("DB_NAME", "analystic_a")
-    user = os.getenv("DB_USER", "analystic_a")
-    pw = os.getenv("DB_PASS", "analystic_a_secret")
-    return psycopg2.connect(host=host, database=name, user=user, password=pw)
+def pool_stats() -> dict:
+    """Estatísticas dos pools para /metrics"""
+    stats = {}
+    if _pool is not None and _pool_pid == os.getpid():
+        stats["sync"] = _pool.stats()
+    if _async_pool is not None:
+        raw = _async_pool.get_stats()
+        size = raw.get("pool_size", 0)
+        stats["async"] = {
+            "size": size,
+            "in_use": size - raw.get("pool_available", 0),
+            "idle": raw.get("pool_available", 0),
+            "waiting": raw.get("requests_waiting", 0),
+            "created": raw.get("connections_num", 0),
+            "closed": raw.get("connections_lost", 0),
+            "max": raw.get("pool_max", DB_POOL_MAX),
+        }
+    return stats
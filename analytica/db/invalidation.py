@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from db.redis_client import REDIS_ENABLED, REDIS_ERRORS, get_redis, redis_failed
+
+# Invalidação de caches em memória entre workers/réplicas via Redis pub/sub.
+# Cada processo mantém uma única thread ouvindo "analytica:invalidate:*";
+# handlers recebem a chave invalidada, ou None para "descartar tudo"
+# (ao (re)conectar, pois mensagens podem ter sido perdidas).
+CHANNEL_PREFIX = "analytica:invalidate:"
+_RETRY_SECONDS = 5
+
+_handlers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+_lock = threading.Lock()
+_listener_pid = None
+
+
+def on_invalidate(name: str, handler: Callable[[Optional[str]], None]):
+    """Registra handler para invalidações publicadas no canal `name`"""
+    with _lock:
+        _handlers.setdefault(name, []).append(handler)
+    _ensure_listener()
+
+
+def publish_invalidation(name: str, key: str):
+    """
+    Avisa os outros processos. O processo local deve invalidar o próprio
+    cache diretamente (a mensagem também volta para ele, sem efeito).
+    """
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.publish(CHANNEL_PREFIX + name, key)
+    except REDIS_ERRORS as e:
+        redis_failed(e)
+    except Exception as e:
+        print(f"Error publishing invalidation: {e}")
+
+
+def _dispatch(name: str, key: Optional[str]):
+    for handler in list(_handlers.get(name, [])):
+        try:
+            handler(key)
+        except Exception as e:
+            print(f"Error in invalidation handler: {e}")
+
+
+def _listen():
+    while True:
+        r = get_redis()
+        if r is None:
+            time.sleep(_RETRY_SECONDS)
+            continue
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(CHANNEL_PREFIX + "*")
+            for name in list(_handlers):
+                _dispatch(name, None)
+            for message in pubsub.listen():
+                channel = message["channel"].decode()
+                data = message["data"]
+                _dispatch(channel[len(CHANNEL_PREFIX):], data.decode() if isinstance(data, bytes) else data)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            time.sleep(_RETRY_SECONDS)
+        except Exception as e:
+            print(f"Invalidation listener desconectado: {e}")
+            time.sleep(_RETRY_SECONDS)
+
+
+def _ensure_listener():
+    """Uma thread por processo (refeita após fork)"""
+    global _listener_pid
+    if not REDIS_ENABLED or _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        threading.Thread(target=_listen, name="cache-invalidation", daemon=True).start()
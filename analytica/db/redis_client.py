@@ -0,0 +1,63 @@
+import os
+import time
+
+# Redis é opcional: sem o pacote ou sem servidor, os chamadores usam fallback local
+try:
+    import redis
+    REDIS_ENABLED = True
+except ImportError:
+    REDIS_ENABLED = False
+
+# Erros do Redis que levam os chamadores ao fallback (nada sem o pacote)
+REDIS_ERRORS = (redis.RedisError,) if REDIS_ENABLED else ()
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+# Após uma falha de conexão, espera este intervalo antes de tentar de novo
+_RETRY_SECONDS = 30
+
+_client = None
+_last_failure = 0.0
+
+
+def get_redis():
+    """
+    Retorna cliente Redis compartilhado (pool interno do redis-py)
+    ou None se o Redis não estiver disponível.
+    """
+    global _client, _last_failure
+
+    if not REDIS_ENABLED:
+        return None
+    if _client is not None:
+        return _client
+    if time.time() - _last_failure < _RETRY_SECONDS:
+        return None
+
+    try:
+        if REDIS_URL:
+            client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=2)
+        else:
+            client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=2)
+        client.ping()
+        _client = client
+        return _client
+    except Exception as e:
+        print(f"Redis indisponível: {e}")
+        _last_failure = time.time()
+        return None
+
+
+def redis_failed(error: Exception):
+    """
+    Um comando falhou com o cliente já conectado (servidor caiu): descarta
+    o cliente e get_redis() devolve None até a próxima tentativa, para os
+    chamadores seguirem no fallback local.
+    """
+    global _client, _last_failure
+    if _client is not None:
+        print(f"Redis indisponível: {error}")
+    _client = None
+    _last_failure = time.time()
@@ -0,0 +1,376 @@
+# ============================================
+# ANALYSTIC.A — ROLLUPS MATERIALIZADOS
+# Agregações pré-calculadas por dataset (tiles de dashboard)
+# ============================================
+import json
+import os
+import re
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+import psycopg2.extras
+
+from db.database import db_connection, quote_ident
+
+# Especificações dos rollups: um JSON por tabela base
+ROLLUPS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "rollups")
+os.makedirs(ROLLUPS_DIR, exist_ok=True)
+
+# Granularidades de tempo, da mais fina para a mais grossa
+GRAINS = ("minute", "hour", "day", "week", "month", "quarter", "year")
+
+# Agregados aditivos guardados por coluna de medida
+PARTIALS = ("sum", "count", "min", "max")
+
+# Coluna do rollup com o início do período (date_trunc da coluna de tempo)
+BUCKET_COLUMN = "_bucket"
+
+# Agregação da consulta → expressão sobre as colunas parciais
+_REAGGREGATE = {
+    "sum": "SUM({sum})",
+    "count": "COALESCE(SUM({count}), 0)",
+    "avg": "SUM({sum}) / NULLIF(SUM({count}), 0)",
+    "min": "MIN({min})",
+    "max": "MAX({max})",
+}
+
+# date_trunc do Postgres em pandas (semana começa na segunda, como no Postgres)
+_PANDAS_PERIODS = {"week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+_PANDAS_FLOOR = {"minute": "min", "hour": "h", "day": "D"}
+
+
+@dataclass
+class RollupSpec:
+    name: str
+    table: str
+    dimensions: List[str] = field(default_factory=list)
+    measures: List[str] = field(default_factory=list)
+    time_column: Optional[str] = None
+    grain: Optional[str] = None
+
+    @property
+    def rollup_table(self) -> str:
+        # Identificadores do Postgres: máximo de 63 bytes
+        return f"rollup_{self.table}_{self.name}"[:63]
+
+    @property
+    def keys(self) -> List[str]:
+        return ([BUCKET_COLUMN] if self.time_column else []) + list(self.dimensions)
+
+
+def _normalize(name: str) -> str:
+    return str(name).strip().lower()
+
+
+def _partial(column: str, part: str) -> str:
+    return f"{column}__{part}"
+
+
+def _validate(spec: RollupSpec):
+    if not re.fullmatch(r"[a-z0-9_]+", spec.name):
+        raise ValueError(f"Nome de rollup inválido: {spec.name}")
+    if not spec.measures:
+        raise ValueError("Rollup precisa de ao menos uma medida")
+    if spec.time_column and spec.grain not in GRAINS:
+        raise ValueError(f"Granularidade inválida: {spec.grain}")
+    if not spec.keys:
+        raise ValueError("Rollup precisa de dimensões ou coluna de tempo")
+
+
+# ============================================
+# DECLARAÇÃO (JSON por tabela)
+# ============================================
+_specs_cache: Dict[str, tuple] = {}   # tabela → (mtime, [RollupSpec])
+
+
+def _specs_path(table: str) -> str:
+    safe = re.sub(r"[^a-zA-Z0-9_.-]", "_", table)
+    return os.path.join(ROLLUPS_DIR, f"{safe}.json")
+
+
+def list_rollups(table: str) -> List[RollupSpec]:
+    """Rollups declarados para a tabela (lidos de novo só se o arquivo mudar)"""
+    path = _specs_path(table)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return []
+
+    cached = _specs_cache.get(table)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            specs = [RollupSpec(**s) for s in json.load(f)]
+    except Exception as e:
+        print(f"Error loading rollups: {e}")
+        return []
+    _specs_cache[table] = (mtime, specs)
+    return specs
+
+
+def _save_specs(table: str, specs: List[RollupSpec]):
+    path = _specs_path(table)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump([asdict(s) for s in specs], f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+    _specs_cache.pop(table, None)
+
+
+def define_rollup(table: str, name: str, dimensions: List[str], measures: List[str],
+                  time_column: Optional[str] = None, grain: Optional[str] = None,
+                  build: bool = True) -> RollupSpec:
+    """
+    Declara (ou substitui) um rollup da tabela e o materializa.
+    Cargas seguintes atualizam o rollup de forma incremental.
+    """
+    spec = RollupSpec(
+        name=_normalize(name),
+        table=_normalize(table),
+        dimensions=[_normalize(d) for d in dimensions],
+        measures=[_normalize(m) for m in measures],
+        time_column=_normalize(time_column) if time_column else None,
+        grain=grain if time_column else None,
+    )
+    _validate(spec)
+
+    specs = [s for s in list_rollups(spec.table) if s.name != spec.name] + [spec]
+    if build:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            build_rollup(cur, spec)
+            conn.commit()
+            cur.close()
+    _save_specs(spec.table, specs)
+    return spec
+
+
+def drop_rollup(table: str, name: str) -> bool:
+    table, name = _normalize(table), _normalize(name)
+    specs = list_rollups(table)
+    spec = next((s for s in specs if s.name == name), None)
+    if spec is None:
+        return False
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {quote_ident(spec.rollup_table)}")
+        conn.commit()
+        cur.close()
+    _save_specs(table, [s for s in specs if s.name != name])
+    return True
+
+
+def rollups_from_layout(layout: Dict) -> List[RollupSpec]:
+    """
+    Sugere um rollup por tabela a partir dos tiles de um Dashboard.layout
+    ({"tiles": [{"table", "x", "y", "agg", "bucket", "filters"}, ...]}).
+    """
+    by_table: Dict[str, RollupSpec] = {}
+    for tile in (layout or {}).get("tiles", []):
+        if not tile.get("table") or not tile.get("x") or not tile.get("y") or not tile.get("agg"):
+            continue
+        table = _normalize(tile["table"])
+        spec = by_table.setdefault(table, RollupSpec(name="dashboard", table=table))
+        x = _normalize(tile["x"])
+
+        if tile.get("bucket") in GRAINS:
+            # Uma coluna de tempo por rollup: mantém a menor granularidade pedida
+            if spec.time_column in (None, x):
+                spec.time_column = x
+                if spec.grain is None or GRAINS.index(tile["bucket"]) < GRAINS.index(spec.grain):
+                    spec.grain = tile["bucket"]
+        elif x not in spec.dimensions:
+            spec.dimensions.append(x)
+
+        for col in tile.get("filters") or {}:
+            if _normalize(col) not in spec.dimensions:
+                spec.dimensions.append(_normalize(col))
+        if _normalize(tile["y"]) not in spec.measures:
+            spec.measures.append(_normalize(tile["y"]))
+    return list(by_table.values())
+
+
+# ============================================
+# MATERIALIZAÇÃO
+# ============================================
+def _select_list(spec: RollupSpec) -> List[str]:
+    cols = []
+    if spec.time_column:
+        cols.append(f"date_trunc('{spec.grain}', {quote_ident(spec.time_column)}) AS {quote_ident(BUCKET_COLUMN)}")
+    cols += [quote_ident(d) for d in spec.dimensions]
+    for m in spec.measures:
+        cols += [f"{part.upper()}({quote_ident(m)}) AS {quote_ident(_partial(m, part))}" for part in PARTIALS]
+    return cols
+
+
+def build_rollup(cur, spec: RollupSpec):
+    """(Re)cria o rollup com um GROUP BY completo da tabela base"""
+    target = quote_ident(spec.rollup_table)
+    group_by = ", ".join(str(i + 1) for i in range(len(spec.keys)))
+    cur.execute(f"DROP TABLE IF EXISTS {target}")
+    cur.execute(
+        f"CREATE TABLE {target} AS SELECT {', '.join(_select_list(spec))} "
+        f"FROM {quote_ident(spec.table)} GROUP BY {group_by}"
+    )
+    # Índice único: alvo do upsert incremental e busca por chave nos tiles
+    cur.execute(f"CREATE UNIQUE INDEX ON {target} ({', '.join(quote_ident(k) for k in spec.keys)})")
+
+
+def _aggregate_batch(spec: RollupSpec, batch: pd.DataFrame) -> pd.DataFrame:
+    """Mesmo GROUP BY do rollup, aplicado só ao lote recém-carregado"""
+    frame = pd.DataFrame(index=batch.index)
+    if spec.time_column:
+        ts = pd.to_datetime(batch[spec.time_column], errors="coerce") if spec.time_column in batch else pd.NaT
+        ts = pd.Series(ts, index=batch.index)
+        if spec.grain in _PANDAS_FLOOR:
+            frame[BUCKET_COLUMN] = ts.dt.floor(_PANDAS_FLOOR[spec.grain])
+        else:
+            frame[BUCKET_COLUMN] = ts.dt.to_period(_PANDAS_PERIODS[spec.grain]).dt.start_time
+    for d in spec.dimensions:
+        frame[d] = batch[d] if d in batch else None
+    for m in spec.measures:
+        frame[m] = pd.to_numeric(batch[m], errors="coerce") if m in batch else float("nan")
+
+    grouped = frame.groupby(spec.keys, dropna=False, sort=False)
+    result = grouped.agg(**{
+        _partial(m, part): (m, part) for m in spec.measures for part in PARTIALS
+    }).reset_index()
+
+    # SUM de grupo sem valores é NULL no Postgres (pandas devolve 0)
+    for m in spec.measures:
+        result.loc[result[_partial(m, "count")] == 0, _partial(m, "sum")] = None
+    return result
+
+
+def _upsert_batch(cur, spec: RollupSpec, delta: pd.DataFrame):
+    target = quote_ident(spec.rollup_table)
+    columns = list(delta.columns)
+    updates = []
+    for m in spec.measures:
+        s, c, lo, hi = (quote_ident(_partial(m, p)) for p in PARTIALS)
+        updates += [
+            f"{s} = CASE WHEN {target}.{s} IS NULL THEN EXCLUDED.{s} ELSE {target}.{s} + COALESCE(EXCLUDED.{s}, 0) END",
+            f"{c} = {target}.{c} + EXCLUDED.{c}",
+            f"{lo} = LEAST({target}.{lo}, EXCLUDED.{lo})",
+            f"{hi} = GREATEST({target}.{hi}, EXCLUDED.{hi})",
+        ]
+
+    rows = delta.astype(object).where(delta.notna(), None).itertuples(index=False, name=None)
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {target} ({', '.join(quote_ident(c) for c in columns)}) VALUES %s "
+        f"ON CONFLICT ({', '.join(quote_ident(k) for k in spec.keys)}) DO UPDATE SET {', '.join(updates)}",
+        list(rows),
+        page_size=1000,
+    )
+
+
+def _exists(cur, relation: str) -> bool:
+    cur.execute("SELECT to_regclass(%s)", (quote_ident(relation),))
+    return cur.fetchone()[0] is not None
+
+
+def refresh_rollups(cur, table: str, batch: pd.DataFrame):
+    """
+    Atualiza os rollups da tabela com o lote recém-copiado, na mesma
+    transação do COPY (rollup e tabela base ficam sempre consistentes).
+    Rollup ainda inexistente é construído por completo; se o upsert falhar
+    (ex.: tipo de coluna alargado), o rollup é reconstruído ou descartado.
+    """
+    for spec in list_rollups(table):
+        cur.execute("SAVEPOINT rollup_refresh")
+        try:
+            if _exists(cur, spec.rollup_table):
+                _upsert_batch(cur, spec, _aggregate_batch(spec, batch))
+            else:
+                build_rollup(cur, spec)
+            cur.execute("RELEASE SAVEPOINT rollup_refresh")
+            continue
+        except Exception as e:
+            print(f"Rollup {spec.rollup_table}: atualização incremental falhou ({e}), reconstruindo")
+            cur.execute("ROLLBACK TO SAVEPOINT rollup_refresh")
+
+        try:
+            build_rollup(cur, spec)
+            cur.execute("RELEASE SAVEPOINT rollup_refresh")
+        except Exception as e:
+            # Sem rollup as consultas voltam para a tabela base
+            print(f"Rollup {spec.rollup_table}: reconstrução falhou ({e})")
+            cur.execute("ROLLBACK TO SAVEPOINT rollup_refresh")
+            cur.execute(f"DROP TABLE IF EXISTS {quote_ident(spec.rollup_table)}")
+
+
+# ============================================
+# ROTEAMENTO DE CONSULTAS
+# ============================================
+def _grain_covers(grain: str, bucket: str) -> bool:
+    """Período do rollup compõe o bucket pedido (semana não compõe mês)"""
+    if GRAINS.index(grain) > GRAINS.index(bucket):
+        return False
+    if bucket == "week":
+        return grain in ("minute", "hour", "day", "week")
+    return grain != "week"
+
+
+def find_rollup(table: str, x: Optional[str], y: str, agg: str, bucket: Optional[str] = None,
+                filters: Optional[Dict] = None) -> Optional[RollupSpec]:
+    """
+    Rollup cuja granularidade cobre a consulta (x / bucket, medida e
+    colunas de filtro); entre os candidatos, o de menos linhas prováveis.
+    """
+    if agg not in _REAGGREGATE:
+        return None
+    y = _normalize(y)
+    x = _normalize(x) if x else None
+    filter_cols = {_normalize(c) for c in (filters or {})}
+
+    candidates = []
+    for spec in list_rollups(_normalize(table)):
+        if y not in spec.measures or not filter_cols <= set(spec.dimensions):
+            continue
+        if bucket:
+            if x != spec.time_column or not _grain_covers(spec.grain, bucket):
+                continue
+        elif x is not None and x not in spec.dimensions:
+            continue
+        candidates.append(spec)
+
+    if not candidates:
+        return None
+    return min(candidates, key=lambda s: (len(s.dimensions), -GRAINS.index(s.grain) if s.grain else 0))
+
+
+def query_rollup(cur, table: str, x: Optional[str], y: str, agg: str, bucket: Optional[str] = None,
+                 filters: Optional[Dict] = None, limit: Optional[int] = None) -> Optional[list]:
+    """
+    Responde a agregação pelo rollup: [(x, y), ...] agrupado por x, ou
+    [(valor,)] quando x é None. Retorna None se nenhum rollup materializado
+    cobre a consulta (o chamador consulta a tabela base).
+    """
+    spec = find_rollup(table, x, y, agg, bucket, filters)
+    if spec is None or not _exists(cur, spec.rollup_table):
+        return None
+
+    y = _normalize(y)
+    y_expr = _REAGGREGATE[agg].format(**{p: quote_ident(_partial(y, p)) for p in PARTIALS})
+
+    params = []
+    where = ""
+    if filters:
+        where = " WHERE " + " AND ".join(f"{quote_ident(_normalize(c))} = %s" for c in filters)
+        params = list(filters.values())
+
+    if x is None:
+        cur.execute(f"SELECT {y_expr} FROM {quote_ident(spec.rollup_table)}{where}", params)
+        return cur.fetchall()
+
+    x_expr = f"date_trunc('{bucket}', {quote_ident(BUCKET_COLUMN)})" if bucket else quote_ident(_normalize(x))
+    sql = f"SELECT {x_expr} AS x, {y_expr} AS y FROM {quote_ident(spec.rollup_table)}{where} GROUP BY 1 ORDER BY 1"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    cur.execute(sql, params)
+    return cur.fetchall()
@@ -1,26 +1,218 @@
 import pandas as pd
+import io
 import os
 import sys
+import time
 
 # Adiciona o diretório raiz de analytica ao path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from db.database import get_db
+from db.database import get_db, quote_ident
+from db.data_version import bump_table_version
+from db.rollups import refresh_rollups
+from charts.realtime_publisher import publish_anomalies
+from stats.anomaly import detect_batch, detect_seasonal, reset_if_new, save_state
 
+# Tamanho padrão de cada lote do COPY (linhas por commit)
+COPY_CHUNK_SIZE = int(os.getenv("ETL_COPY_CHUNK_SIZE", "50000"))
 
-async def process_excel(file):
-    df = pd.read_excel(await file.read())
 
-    conn = get_db()
-    cur = conn.cursor()
+# ============================================
+# INFERÊNCIA DE TIPOS (pandas → Postgres)
+# ============================================
+def _pg_type(dtype) -> str:
+    """Mapeia dtype do pandas para tipo Postgres"""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normaliza nomes de colunas para minúsculas (mesmo comportamento do
+    Postgres com identificadores sem aspas usado nas cargas antigas).
+    """
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def infer_schema(df: pd.DataFrame) -> dict:
+    """Retorna {coluna: tipo_postgres} a partir dos dtypes do DataFrame"""
+    return {str(col): _pg_type(dtype) for col, dtype in df.dtypes.items()}
+
+
+# Nomes retornados pelo information_schema para os tipos acima
+_INFO_SCHEMA_TYPES = {
+    "boolean": "BOOLEAN",
+    "bigint": "BIGINT",
+    "integer": "BIGINT",
+    "double precision": "DOUBLE PRECISION",
+    "timestamp without time zone": "TIMESTAMP",
+    "text": "TEXT",
+}
+
+
+def _widen(current: str, incoming: str) -> str:
+    """Retorna o tipo que comporta os dois (numéricos alargam, o resto vira TEXT)"""
+    if current == incoming or current == "TEXT":
+        return current
+    numeric = {"BIGINT", "DOUBLE PRECISION"}
+    if current in numeric and incoming in numeric:
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def _existing_columns(cur, table_name: str) -> dict:
+    cur.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s",
+        (table_name,),
+    )
+    return {name: _INFO_SCHEMA_TYPES.get(dtype, "TEXT") for name, dtype in cur.fetchall()}
+
+
+def ensure_table(cur, table_name: str, schema: dict):
+    """
+    Cria a tabela se não existir ou evolui o schema:
+    adiciona colunas novas e alarga tipos incompatíveis (ex.: BIGINT → DOUBLE PRECISION).
+    Tipo None = coluna sem valores no lote (criada como TEXT, nunca alarga).
+    """
+    cols_sql = ", ".join(f"{quote_ident(c)} {t or 'TEXT'}" for c, t in schema.items())
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {quote_ident(table_name)} ({cols_sql})")
+
+    existing = _existing_columns(cur, table_name)
+    for col, pg_type in schema.items():
+        if col not in existing:
+            cur.execute(
+                f"ALTER TABLE {quote_ident(table_name)} "
+                f"ADD COLUMN IF NOT EXISTS {quote_ident(col)} {pg_type or 'TEXT'}"
+            )
+            continue
+        if pg_type is None:
+            continue
+
+        widened = _widen(existing[col], pg_type)
+        if widened != existing[col]:
+            cur.execute(
+                f"ALTER TABLE {quote_ident(table_name)} ALTER COLUMN {quote_ident(col)} "
+                f"TYPE {widened} USING {quote_ident(col)}::{widened}"
+            )
+
+
+# ============================================
+# CARGA EM MASSA (COPY FROM STDIN)
+# ============================================
+def _chunk_to_csv(chunk: pd.DataFrame) -> io.StringIO:
+    """Serializa um lote em CSV (nulos como campo vazio sem aspas)"""
+    buf = io.StringIO()
+    chunk.to_csv(buf, index=False, header=False, na_rep="", date_format="%Y-%m-%d %H:%M:%S")
+    buf.seek(0)
+    return buf
 
-    table_name = os.path.splitext(file.filename)[0].lower()
 
-    cols = ", ".join(df.columns)
+def _reset_anomalies(cur, table_name: str):
+    """Tabela nova: descarta cauda/anomalias de uma tabela anterior de mesmo nome"""
+    cur.execute("SAVEPOINT anomaly_reset")
+    try:
+        reset_if_new(cur, table_name)
+        cur.execute("RELEASE SAVEPOINT anomaly_reset")
+    except Exception as e:
+        print(f"Erro ao reiniciar anomalias ({table_name}): {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT anomaly_reset")
 
-    for _, row in df.iterrows():
-        values = "', '".join(str(v) for v in row.values)
-        q = f"INSERT INTO {table_name} ({cols}) VALUES ('{values}')"
-        cur.execute(q)
 
+def _anomalies_in_batch(cur, table_name: str, batch: pd.DataFrame) -> tuple:
+    """(pontos, cauda) do lote (z robusto móvel); falha aqui não derruba a carga"""
+    try:
+        return detect_batch(cur, table_name, batch)
+    except Exception as e:
+        print(f"Erro na detecção de anomalias ({table_name}): {e}")
+        return [], None
+
+
+def _publish_batch_anomalies(table_name: str, flagged: tuple):
+    """Após o commit do lote: avança a cauda e publica os pontos"""
+    points, state = flagged
+    try:
+        save_state(table_name, state)
+    except Exception as e:
+        print(f"Erro ao gravar estado de anomalias ({table_name}): {e}")
+    publish_anomalies(table_name, points)
+
+
+def _seasonal_anomalies(table_name: str):
+    """Decomposição sazonal da tabela inteira ao fim da carga"""
+    try:
+        publish_anomalies(table_name, detect_seasonal(table_name))
+    except Exception as e:
+        print(f"Erro na detecção sazonal de anomalias ({table_name}): {e}")
+
+
+def bulk_load_dataframe(conn, df: pd.DataFrame, table_name: str, chunk_size: int = None) -> dict:
+    """
+    Carrega um DataFrame via COPY FROM STDIN (CSV), com commit por lote.
+
+    Returns:
+        dict: {"table", "rows", "chunks", "seconds", "rows_per_sec"}
+    """
+    chunk_size = chunk_size or COPY_CHUNK_SIZE
+    start = time.perf_counter()
+
+    cur = conn.cursor()
+    _reset_anomalies(cur, table_name)
+    ensure_table(cur, table_name, infer_schema(df))
     conn.commit()
+
+    cols = ", ".join(quote_ident(str(c)) for c in df.columns)
+    copy_sql = f"COPY {quote_ident(table_name)} ({cols}) FROM STDIN WITH (FORMAT csv)"
+
+    rows = 0
+    chunks = 0
+    try:
+        for offset in range(0, len(df), chunk_size):
+            chunk = df.iloc[offset:offset + chunk_size]
+            cur.copy_expert(copy_sql, _chunk_to_csv(chunk))
+            refresh_rollups(cur, table_name, chunk)
+            flagged = _anomalies_in_batch(cur, table_name, chunk)
+            conn.commit()
+            _publish_batch_anomalies(table_name, flagged)
+            rows += len(chunk)
+            chunks += 1
+        cur.close()
+    finally:
+        if chunks:
+            # Nova versão dos dados (mesmo se um lote seguinte falhar: os
+            # anteriores já foram commitados): invalida caches da tabela
+            bump_table_version(table_name)
+    if chunks:
+        _seasonal_anomalies(table_name)
+
+    seconds = time.perf_counter() - start
+    return {
+        "table": table_name,
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": int(rows / seconds) if seconds > 0 else rows,
+    }
+
+
+async def process_excel(file):
+    df = normalize_columns(pd.read_excel(await file.read()))
+
+    table_name = os.path.splitext(file.filename)[0].lower()
+
+    conn = get_db()
+    try:
+        stats = bulk_load_dataframe(conn, df, table_name)
+    finally:
+        conn.close()
+
+    print(f"ETL {table_name}: {stats['rows']} linhas em {stats['seconds']}s ({stats['rows_per_sec']} linhas/s)")
+    return stats
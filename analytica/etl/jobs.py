@@ -0,0 +1,192 @@
+# ============================================
+# ANALYSTIC.A — JOBS DE INGESTÃO
+# Upload → job id imediato; carga em process pool ou worker Redis Stream
+# ============================================
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+# "pool" = ProcessPoolExecutor local | "stream" = worker em events/consumer_etl.py
+# (modo stream exige UPLOAD_SPOOL_DIR em volume compartilhado com o worker)
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "pool")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Stream e evento consumidos por events/consumer_etl.py
+EVENTS_STREAM = "analystic_a_stream"
+UPLOAD_EVENT = "UPLOAD_COMPLETED"
+
+# Jobs expiram do Redis após 1 dia
+JOB_TTL_SECONDS = 86400
+
+JOBS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "jobs")
+os.makedirs(JOBS_DIR, exist_ok=True)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+# ============================================
+# STORAGE DE JOBS (Redis com fallback em disco)
+# ============================================
+def _job_key(job_id: str) -> str:
+    return f"analytica:job:{job_id}"
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _save_job(job: Dict):
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_job_key(job["id"]), json.dumps(job), ex=JOB_TTL_SECONDS)
+            return
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+    # Escrita atômica: leitores nunca veem arquivo pela metade
+    tmp = _job_path(job["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, _job_path(job["id"]))
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Retorna o estado do job (ou None se não existir)"""
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(_job_key(job_id))
+            if raw:
+                return json.loads(raw)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def update_job(job_id: str, **fields) -> Optional[Dict]:
+    """Atualiza campos do job (progresso, status, erro)"""
+    job = get_job(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    _save_job(job)
+    return job
+
+
+def create_job(filename: str, table: str, path: str, user: str = "") -> Dict:
+    """Registra job de ingestão com status 'queued'"""
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "status": "queued",
+        "filename": filename,
+        "table": table,
+        "path": path,
+        "user": user,
+        "rows": 0,
+        "rows_per_sec": 0,
+        "seconds": 0,
+        "error": None,
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    _save_job(job)
+    return job
+
+
+# ============================================
+# EXECUÇÃO (roda no processo filho ou no worker)
+# ============================================
+def run_ingest_job(job_id: str, path: str, filename: str, table: str) -> Dict:
+    """Executa a carga em streaming reportando progresso no job"""
+    from etl.streaming import stream_load_file
+
+    started = time.perf_counter()
+    update_job(job_id, status="running", started_at=datetime.now().isoformat())
+
+    def on_batch(rows: int):
+        elapsed = time.perf_counter() - started
+        update_job(job_id, rows=rows, seconds=round(elapsed, 3),
+                   rows_per_sec=int(rows / elapsed) if elapsed > 0 else rows)
+
+    try:
+        stats = stream_load_file(path, filename, table, on_batch=on_batch)
+        job = update_job(
+            job_id,
+            status="done",
+            rows=stats["rows"],
+            seconds=stats["seconds"],
+            rows_per_sec=stats["rows_per_sec"],
+            finished_at=datetime.now().isoformat(),
+        )
+    except Exception as e:
+        print(f"❌ Job {job_id} falhou: {e}")
+        job = update_job(job_id, status="error", error=str(e), finished_at=datetime.now().isoformat())
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    return job or {}
+
+
+def run_etl(payload: Dict) -> Dict:
+    """Ponto de entrada do worker Redis Stream (evento UPLOAD_COMPLETED)"""
+    return run_ingest_job(payload["job_id"], payload["path"], payload["filename"], payload["table"])
+
+
+# ============================================
+# SUBMISSÃO
+# ============================================
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+    return _executor
+
+
+def submit_ingest_job(job: Dict) -> Dict:
+    """Envia o job para o backend configurado (stream Redis ou process pool)"""
+    payload = {
+        "job_id": job["id"],
+        "path": job["path"],
+        "filename": job["filename"],
+        "table": job["table"],
+    }
+
+    r = get_redis() if INGEST_BACKEND == "stream" else None
+    if r is not None:
+        event = {"event": UPLOAD_EVENT, "payload": payload}
+        try:
+            r.xadd(EVENTS_STREAM, {"data": json.dumps(event)})
+            return job
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+    _get_executor().submit(run_etl, payload)
+    return job
+
+
+def shutdown_executor():
+    """Encerra o process pool (chamado no shutdown da aplicação)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
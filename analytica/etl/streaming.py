@@ -0,0 +1,200 @@
+# ============================================
+# ANALYSTIC.A — STREAMING ETL
+# Upload em disco + leitura iterativa + COPY em lotes (memória limitada)
+# ============================================
+import asyncio
+import codecs
+import csv
+import os
+import sys
+import tempfile
+import time
+from typing import Iterator, Optional
+
+import pandas as pd
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database import get_db, quote_ident
+from db.data_version import bump_table_version
+from db.rollups import refresh_rollups
+from etl.etl_engine import (ensure_table, infer_schema, normalize_columns, _chunk_to_csv,
+                            _anomalies_in_batch, _publish_batch_anomalies, _reset_anomalies,
+                            _seasonal_anomalies)
+
+# Diretório para spool dos uploads (padrão: diretório temporário do sistema)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+
+# Bytes lidos do UploadFile por vez ao gravar em disco
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+# Linhas por lote enviado ao banco
+STREAM_BATCH_ROWS = int(os.getenv("ETL_STREAM_BATCH_ROWS", "20000"))
+
+
+# ============================================
+# SPOOL DO UPLOAD EM DISCO
+# ============================================
+async def spool_upload(file, directory: str = None) -> str:
+    """Grava o UploadFile em disco em blocos e retorna o caminho do arquivo"""
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=directory or UPLOAD_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        while True:
+            block = await file.read(SPOOL_CHUNK_BYTES)
+            if not block:
+                break
+            out.write(block)
+    return path
+
+
+# ============================================
+# LEITORES ITERATIVOS
+# ============================================
+def _iter_xlsx(path: str, batch_rows: int) -> Iterator[pd.DataFrame]:
+    """Lê a primeira planilha em modo read-only (linha a linha)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"coluna_{i}" for i, c in enumerate(header)]
+
+        batch = []
+        for row in rows:
+            if row is None or all(v is None for v in row):
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) >= batch_rows:
+                yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+    finally:
+        wb.close()
+
+
+def _detect_encoding(sample: bytes) -> str:
+    """UTF-8 (com ou sem BOM) se a amostra decodifica; senão CP1252 (Excel no Brasil)"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: caractere multibyte cortado no fim da amostra não conta
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+
+def _iter_csv(path: str, batch_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Lê CSV em blocos com o parser C. Encoding e separador detectados na
+    amostra inicial; bytes inválidos adiante viram U+FFFD em vez de
+    interromper a carga no meio.
+    """
+    with open(path, "rb") as f:
+        raw = f.read(64 * 1024)
+    encoding = _detect_encoding(raw)
+    sample = raw.decode(encoding, errors="replace")
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+
+    reader = pd.read_csv(path, chunksize=batch_rows, sep=sep,
+                         encoding=encoding, encoding_errors="replace")
+    for chunk in reader:
+        yield chunk
+
+
+def iter_record_batches(path: str, filename: str, batch_rows: int = None) -> Iterator[pd.DataFrame]:
+    """Itera o arquivo em DataFrames de tamanho fixo, conforme a extensão"""
+    batch_rows = batch_rows or STREAM_BATCH_ROWS
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext in (".xlsx", ".xlsm"):
+        yield from _iter_xlsx(path, batch_rows)
+    elif ext in (".csv", ".txt"):
+        yield from _iter_csv(path, batch_rows)
+    else:
+        # .xls (xlrd) não tem leitor iterativo: carrega e fatia
+        df = pd.read_excel(path)
+        for offset in range(0, len(df), batch_rows):
+            yield df.iloc[offset:offset + batch_rows]
+
+
+# ============================================
+# CARGA EM STREAMING
+# ============================================
+def stream_load_file(path: str, filename: str, table_name: str, batch_rows: int = None,
+                     on_batch=None) -> dict:
+    """
+    Carrega o arquivo em lotes via COPY, evoluindo o schema a cada lote.
+    `on_batch(rows_total)` é chamado após cada commit (para progresso).
+
+    Returns:
+        dict: {"table", "rows", "chunks", "seconds", "rows_per_sec"}
+    """
+    start = time.perf_counter()
+    rows = 0
+    chunks = 0
+
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        _reset_anomalies(cur, table_name)
+        for batch in iter_record_batches(path, filename, batch_rows):
+            batch = normalize_columns(batch)
+
+            # Colunas totalmente nulas no lote não influenciam o tipo
+            schema = {c: (t if batch[c].notna().any() else None) for c, t in infer_schema(batch).items()}
+            ensure_table(cur, table_name, schema)
+
+            cols = ", ".join(quote_ident(str(c)) for c in batch.columns)
+            cur.copy_expert(
+                f"COPY {quote_ident(table_name)} ({cols}) FROM STDIN WITH (FORMAT csv)",
+                _chunk_to_csv(batch),
+            )
+            refresh_rollups(cur, table_name, batch)
+            flagged = _anomalies_in_batch(cur, table_name, batch)
+            conn.commit()
+            _publish_batch_anomalies(table_name, flagged)
+
+            rows += len(batch)
+            chunks += 1
+            if on_batch:
+                on_batch(rows)
+        cur.close()
+    finally:
+        conn.close()
+        if chunks:
+            # Nova versão dos dados: invalida caches de gráficos da tabela
+            bump_table_version(table_name)
+    if chunks:
+        _seasonal_anomalies(table_name)
+
+    seconds = time.perf_counter() - start
+    return {
+        "table": table_name,
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": int(rows / seconds) if seconds > 0 else rows,
+    }
+
+
+async def process_upload_streaming(file, table_name: Optional[str] = None) -> dict:
+    """Spool do upload em disco + carga em lotes fora do event loop"""
+    table_name = table_name or os.path.splitext(file.filename)[0].lower()
+    path = await spool_upload(file)
+    try:
+        stats = await asyncio.to_thread(stream_load_file, path, file.filename, table_name)
+    finally:
+        os.unlink(path)
+
+    print(f"ETL stream {table_name}: {stats['rows']} linhas em {stats['seconds']}s ({stats['rows_per_sec']} linhas/s)")
+    return stats
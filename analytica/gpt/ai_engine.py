@@ -2,20 +2,109 @@
 # ANALYSTIC.A — AI ENGINE (OLLAMA + GEMINI)
 # 100% GRATUITO!
 # ============================================
+import asyncio
 import os
 import json
-import httpx
 from typing import Optional
 
+from gpt import conversations, http_pool, llm_cache, scheduler
+from gpt.http_pool import ProviderConfig
+from gpt.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, ProviderLimiter, ProviderUnavailable
+
 # ============================================
 # CONFIGURAÇÕES
 # ============================================
-OLLAMA_URL = "http://localhost:11434"
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 OLLAMA_MODEL = "gemma:2b"  # Modelo local instalado
 
 # Gemini 1.5 Flash API (gratuito com limite generoso)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_PATH = "/v1beta/models/gemini-1.5-flash:generateContent"
+GEMINI_STREAM_PATH = "/v1beta/models/gemini-1.5-flash:streamGenerateContent"
+GEMINI_URL = GEMINI_BASE_URL + GEMINI_PATH
+
+# Status dos provedores: idade máxima antes de reconsultar (em background)
+AI_STATUS_TTL = float(os.getenv("AI_STATUS_TTL", "30"))
+AI_PROBE_TIMEOUT = 2.0
+
+# Ollama local atende poucas gerações por vez; o Gemini aguenta mais
+http_pool.register_provider(ProviderConfig(
+    name="ollama",
+    base_url=OLLAMA_URL,
+    max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "4")),
+    max_keepalive=4,
+    connect_timeout=2.0,
+    read_timeout=60.0,
+))
+http_pool.register_provider(ProviderConfig(
+    name="gemini",
+    base_url=GEMINI_BASE_URL,
+    max_connections=int(os.getenv("GEMINI_MAX_CONNECTIONS", "20")),
+    max_keepalive=10,
+    connect_timeout=5.0,
+    read_timeout=30.0,
+    http2=True,
+))
+
+# Escalonador: gerações simultâneas por provedor e cota do Gemini.
+# A cota (60 req/min) é da chave; cada worker do uvicorn fica com uma fração.
+UVICORN_WORKERS = max(1, int(os.getenv("UVICORN_WORKERS", "1")))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+
+scheduler.register_limiter(ProviderLimiter(
+    "ollama",
+    max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+    initial_latency=20.0,
+))
+scheduler.register_limiter(ProviderLimiter(
+    "gemini",
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+    rpm=GEMINI_RPM / UVICORN_WORKERS,
+    initial_latency=3.0,
+))
+
+
+# Opções de geração (também fazem parte da chave do cache de respostas)
+OLLAMA_OPTIONS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "num_predict": 1024
+}
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "topP": 0.9,
+    "maxOutputTokens": 1024
+}
+
+
+def _ollama_payload(prompt: str, model: str) -> dict:
+    return {
+        "model": model,
+        "prompt": prompt,
+        "stream": False,
+        "options": OLLAMA_OPTIONS
+    }
+
+
+def _gemini_payload(prompt: str) -> dict:
+    return {
+        "contents": [{
+            "parts": [{
+                "text": prompt
+            }]
+        }],
+        "generationConfig": GEMINI_GENERATION_CONFIG
+    }
+
+
+def _gemini_text(data: dict) -> Optional[str]:
+    candidates = data.get("candidates", [])
+    if candidates:
+        parts = candidates[0].get("content", {}).get("parts", [])
+        if parts:
+            return parts[0].get("text", "")
+    return None
 
 
 # ============================================
@@ -27,29 +116,19 @@ async def ollama_generate(prompt: str, model: str = OLLAMA_MODEL) -> Optional[st
     Totalmente offline e gratuito!
     """
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "num_predict": 1024
-                    }
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("response", "")
-            else:
-                print(f"Ollama error: {response.status_code}")
-                return None
-                
+        response = await http_pool.request("ollama", "POST", "/api/generate",
+                                           json=_ollama_payload(prompt, model))
+        http_pool.mark_health("ollama", True)
+
+        if response.status_code == 200:
+            data = response.json()
+            return data.get("response", "")
+        else:
+            print(f"Ollama error: {response.status_code}")
+            return None
+
     except Exception as e:
+        http_pool.mark_health("ollama", False, error=str(e))
         print(f"Ollama connection error: {e}")
         return None
 
@@ -57,25 +136,13 @@ async def ollama_generate(prompt: str, model: str = OLLAMA_MODEL) -> Optional[st
 def ollama_generate_sync(prompt: str, model: str = OLLAMA_MODEL) -> Optional[str]:
     """Versão síncrona do Ollama"""
     try:
-        import requests
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": 1024
-                }
-            },
-            timeout=60
-        )
-        
+        response = http_pool.request_sync("ollama", "POST", "/api/generate",
+                                          json=_ollama_payload(prompt, model))
+
         if response.status_code == 200:
             return response.json().get("response", "")
         return None
-        
+
     except Exception as e:
         print(f"Ollama sync error: {e}")
         return None
@@ -92,39 +159,21 @@ async def gemini_generate(prompt: str) -> Optional[str]:
     if not GEMINI_API_KEY:
         print("⚠️ GEMINI_API_KEY não configurada")
         return None
-    
+
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{GEMINI_URL}?key={GEMINI_API_KEY}",
-                json={
-                    "contents": [{
-                        "parts": [{
-                            "text": prompt
-                        }]
-                    }],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "topP": 0.9,
-                        "maxOutputTokens": 1024
-                    }
-                },
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                candidates = data.get("candidates", [])
-                if candidates:
-                    content = candidates[0].get("content", {})
-                    parts = content.get("parts", [])
-                    if parts:
-                        return parts[0].get("text", "")
-            else:
-                print(f"Gemini error: {response.status_code} - {response.text}")
-                return None
-                
+        response = await http_pool.request("gemini", "POST", GEMINI_PATH,
+                                           params={"key": GEMINI_API_KEY},
+                                           json=_gemini_payload(prompt))
+        http_pool.mark_health("gemini", True)
+
+        if response.status_code == 200:
+            return _gemini_text(response.json())
+        else:
+            print(f"Gemini error: {response.status_code} - {response.text}")
+            return None
+
     except Exception as e:
+        http_pool.mark_health("gemini", False, error=str(e))
         print(f"Gemini error: {e}")
         return None
 
@@ -133,105 +182,280 @@ def gemini_generate_sync(prompt: str) -> Optional[str]:
     """Versão síncrona do Gemini"""
     if not GEMINI_API_KEY:
         return None
-        
+
     try:
-        import requests
-        response = requests.post(
-            f"{GEMINI_URL}?key={GEMINI_API_KEY}",
-            json={
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "maxOutputTokens": 1024
-                }
-            },
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        
+        response = http_pool.request_sync("gemini", "POST", GEMINI_PATH,
+                                          params={"key": GEMINI_API_KEY},
+                                          json=_gemini_payload(prompt))
+
         if response.status_code == 200:
-            data = response.json()
-            candidates = data.get("candidates", [])
-            if candidates:
-                return candidates[0]["content"]["parts"][0]["text"]
+            return _gemini_text(response.json())
         return None
-        
+
     except Exception as e:
         print(f"Gemini sync error: {e}")
         return None
 
 
 # ============================================
-# FUNÇÃO PRINCIPAL - TENTA OLLAMA, DEPOIS GEMINI
+# STATUS DOS PROVEDORES (CACHEADO)
 # ============================================
-async def generate_ai_response(prompt: str, prefer_local: bool = True) -> dict:
+async def _probe_ollama() -> dict:
+    response = await http_pool.get_client("ollama").get("/api/tags", timeout=AI_PROBE_TIMEOUT)
+    if response.status_code != 200:
+        return {"available": False}
+    models = [m["name"] for m in response.json().get("models", [])]
+    return {
+        "available": True,
+        "models": models,
+        "active_model": OLLAMA_MODEL if OLLAMA_MODEL in models else models[0] if models else None
+    }
+
+
+async def _probe_gemini() -> dict:
+    # Sem chamada de rede: a cota gratuita é curta demais para gastar em sondas
+    if GEMINI_API_KEY:
+        return {"available": True, "model": "gemini-pro"}
+    return {"available": False}
+
+
+http_pool.register_probe("ollama", _probe_ollama)
+http_pool.register_probe("gemini", _probe_gemini)
+
+
+async def ai_status() -> dict:
+    """Status das IAs para /api/ai/status (responde do cache)"""
+    health = await http_pool.provider_health(AI_STATUS_TTL)
+    queues = scheduler.scheduler_stats()
+    for name, entry in health.items():
+        entry.pop("checked_at", None)
+        if name in queues:
+            entry["queue"] = queues[name]
+    return health
+
+
+# Tarefas em background: o loop só guarda referência fraca, então a
+# referência forte fica aqui até a tarefa terminar
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def start_ai_clients():
+    """Startup: faz a primeira sonda em background"""
+    _spawn(http_pool.refresh_health())
+
+
+async def close_ai_clients():
+    await http_pool.close_clients()
+
+
+# ============================================
+# STREAMING (TOKENS À MEDIDA QUE SÃO GERADOS)
+# Sair do `async for` (cliente desconectou) fecha a conexão com o
+# provedor, e o Ollama interrompe a geração.
+# ============================================
+async def ollama_stream(prompt: str, model: str = OLLAMA_MODEL):
+    """Tokens do Ollama (NDJSON: um objeto JSON por linha)"""
+    payload = _ollama_payload(prompt, model)
+    payload["stream"] = True
+    async with http_pool.get_client("ollama").stream("POST", "/api/generate", json=payload) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Ollama error: {response.status_code}")
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(f"Ollama error: {data['error']}")
+            if data.get("response"):
+                yield data["response"]
+            if data.get("done"):
+                break
+
+
+async def gemini_stream(prompt: str):
+    """Tokens do Gemini (streamGenerateContent em formato SSE)"""
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY não configurada")
+    async with http_pool.get_client("gemini").stream(
+        "POST", GEMINI_STREAM_PATH,
+        params={"key": GEMINI_API_KEY, "alt": "sse"},
+        json=_gemini_payload(prompt),
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Gemini error: {response.status_code}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            text = _gemini_text(json.loads(line[len("data:"):]))
+            if text:
+                yield text
+
+
+async def stream_ai_response(prompt: str, prefer_local: bool = True):
     """
-    Gera resposta usando IA disponível.
-    Prioriza Ollama (local/gratuito), fallback para Gemini.
-    
-    Returns:
-        dict: {"response": str, "source": str, "success": bool}
+    Gera a resposta em eventos:
+        {"type": "start", "source", "model"}
+        {"type": "token", "text"}
+        {"type": "done", "success": True} | {"type": "error", "response"}
+    Se o provedor falhar antes do primeiro token, tenta o próximo.
     """
-    
-    # Prompt otimizado para análise de dados
-    system_prompt = """Você é o ANALYSTIC.IA, um assistente especializado em análise de dados.
+    order = _provider_order(prefer_local)
+    full_prompt = _full_prompt(prompt)
+
+    # Resposta já cacheada: um único token
+    cached = _lookup_cached(full_prompt, order)
+    if cached is not None:
+        yield {"type": "start", "source": cached["source"], "model": cached["model"]}
+        yield {"type": "token", "text": cached["response"]}
+        yield {"type": "done", "success": True}
+        return
+
+    for name in scheduler.route(order):
+        provider = PROVIDERS[name]
+        started = False
+        parts = []
+        try:
+            async with scheduler.slot(name, PRIORITY_INTERACTIVE):
+                async for text in provider["stream"](full_prompt):
+                    if not started:
+                        started = True
+                        http_pool.mark_health(name, True)
+                        yield {"type": "start", "source": provider["source"], "model": provider["model"]}
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+        except ProviderUnavailable as e:
+            print(f"{name} skipped: {e}")
+            continue
+        except Exception as e:
+            print(f"{name} stream error: {e}")
+            if started:
+                yield {"type": "error", "response": "❌ A geração foi interrompida. Tente novamente."}
+                return
+            http_pool.mark_health(name, False, error=str(e))
+            continue
+        if started:
+            llm_cache.set_cached_response(
+                _cache_key(name, full_prompt),
+                _result(name, "".join(parts)),
+            )
+            yield {"type": "done", "success": True}
+            return
+
+    yield {"type": "error", "response": NO_AI_MESSAGE}
+
+
+# ============================================
+# FUNÇÃO PRINCIPAL - TENTA OLLAMA, DEPOIS GEMINI
+# ============================================
+SYSTEM_PROMPT = """Você é o ANALYSTIC.IA, um assistente especializado em análise de dados.
 Responda de forma clara, objetiva e em português brasileiro.
 Use emojis para deixar as respostas mais visuais.
 Foque em insights acionáveis e dados relevantes."""
 
-    full_prompt = f"{system_prompt}\n\nUsuário: {prompt}\n\nAssistente:"
-    
-    if prefer_local:
-        # Tenta Ollama primeiro (local, grátis, sem limites)
-        response = await ollama_generate(full_prompt)
-        if response:
-            return {
-                "response": response,
-                "source": "🦙 Ollama (Local)",
-                "model": OLLAMA_MODEL,
-                "success": True
-            }
-        
-        # Fallback para Gemini
-        response = await gemini_generate(full_prompt)
-        if response:
-            return {
-                "response": response,
-                "source": "✨ Google Gemini",
-                "model": "gemini-pro",
-                "success": True
-            }
-    else:
-        # Tenta Gemini primeiro
-        response = await gemini_generate(full_prompt)
-        if response:
-            return {
-                "response": response,
-                "source": "✨ Google Gemini",
-                "model": "gemini-pro",
-                "success": True
-            }
-        
-        # Fallback para Ollama
-        response = await ollama_generate(full_prompt)
-        if response:
-            return {
-                "response": response,
-                "source": "🦙 Ollama (Local)",
-                "model": OLLAMA_MODEL,
-                "success": True
-            }
-    
+NO_AI_MESSAGE = "❌ Nenhuma IA disponível no momento. Verifique se o Ollama está rodando (ollama serve) ou configure a GEMINI_API_KEY."
+
+
+def _full_prompt(prompt: str) -> str:
+    # Prompt otimizado para análise de dados
+    return f"{SYSTEM_PROMPT}\n\nUsuário: {prompt}\n\nAssistente:"
+
+
+PROVIDERS = {
+    "ollama": {
+        "generate": ollama_generate, "stream": ollama_stream,
+        "source": "🦙 Ollama (Local)", "model": OLLAMA_MODEL, "options": OLLAMA_OPTIONS,
+    },
+    "gemini": {
+        "generate": gemini_generate, "stream": gemini_stream,
+        "source": "✨ Google Gemini", "model": "gemini-pro", "options": GEMINI_GENERATION_CONFIG,
+    },
+}
+
+
+def _provider_order(prefer_local: bool) -> list:
+    # Ollama: local, grátis, sem limites; Gemini como fallback (ou o inverso)
+    order = ["ollama", "gemini"] if prefer_local else ["gemini", "ollama"]
+    return [name for name in order if name != "gemini" or GEMINI_API_KEY]
+
+
+def _result(name: str, response: str) -> dict:
+    provider = PROVIDERS[name]
     return {
-        "response": "❌ Nenhuma IA disponível no momento. Verifique se o Ollama está rodando (ollama serve) ou configure a GEMINI_API_KEY.",
-        "source": "Sistema",
-        "model": None,
-        "success": False
+        "response": response,
+        "source": provider["source"],
+        "model": provider["model"],
+        "success": True
     }
 
 
+def _cache_key(name: str, full_prompt: str) -> str:
+    provider = PROVIDERS[name]
+    return llm_cache.llm_key(name, provider["model"], provider["options"], full_prompt)
+
+
+def _lookup_cached(full_prompt: str, order: list) -> Optional[dict]:
+    """Resposta cacheada de qualquer provedor, na ordem de preferência"""
+    for name in order:
+        cached = llm_cache.get_cached_response(_cache_key(name, full_prompt))
+        if cached is not None:
+            return cached
+    return None
+
+
+async def generate_ai_response(prompt: str, prefer_local: bool = True,
+                               priority: int = PRIORITY_INTERACTIVE) -> dict:
+    """
+    Gera resposta usando IA disponível.
+    Prioriza Ollama (local/gratuito), fallback para Gemini; o escalonador
+    pula provedores com circuito aberto e troca a ordem quando a fila do
+    preferido está mais longa. Respostas são cacheadas e prompts idênticos
+    simultâneos geram uma vez só.
+    
+    Returns:
+        dict: {"response": str, "source": str, "success": bool}
+    """
+    full_prompt = _full_prompt(prompt)
+    order = _provider_order(prefer_local)
+
+    cached = _lookup_cached(full_prompt, order)
+    if cached is not None:
+        return cached
+
+    async def generate() -> dict:
+        for name in scheduler.route(order):
+            try:
+                async with scheduler.slot(name, priority) as ticket:
+                    response = await PROVIDERS[name]["generate"](full_prompt)
+                    ticket.success = bool(response)
+            except ProviderUnavailable as e:
+                print(f"{name} skipped: {e}")
+                continue
+            if response:
+                result = _result(name, response)
+                llm_cache.set_cached_response(_cache_key(name, full_prompt), result)
+                return result
+
+        return {
+            "response": NO_AI_MESSAGE,
+            "source": "Sistema",
+            "model": None,
+            "success": False
+        }
+
+    return await llm_cache.coalesce(
+        _cache_key(order[0], full_prompt),
+        lambda: _lookup_cached(full_prompt, order),
+        generate,
+    )
+
+
 def generate_insights(question: str) -> str:
     """
     Função compatível com o sistema existente.
@@ -253,8 +477,32 @@ def generate_insights(question: str) -> str:
 # ============================================
 # FUNÇÕES ESPECÍFICAS PARA ANÁLISE DE DADOS
 # ============================================
-async def analyze_data(data_description: str) -> dict:
-    """Analisa dados e retorna insights"""
+async def analyze_data(data_description: str = "", table: Optional[str] = None) -> dict:
+    """
+    Analisa dados e retorna insights.
+    Com `table`, as estatísticas são calculadas localmente (stats.profiler)
+    e o modelo recebe só o perfil compacto, já com os números exatos.
+    """
+    if table:
+        from stats.profiler import profile_table, profile_to_text
+        try:
+            profile = await asyncio.to_thread(profile_table, table)
+        except Exception as e:
+            print(f"Profile error for {table}: {e}")
+            return {"response": f"❌ Não foi possível analisar a tabela {table}.",
+                    "source": "Sistema", "model": None, "success": False}
+        prompt = f"""Estatísticas calculadas da tabela (valores exatos, não recalcule):
+{profile_to_text(profile)}
+
+Com base nessas estatísticas, forneça:
+1. 📈 Tendências identificadas
+2. 💡 3 insights principais
+3. ⚠️ Pontos de atenção (nulos, outliers, concentração)
+4. 🎯 Recomendações"""
+        result = await generate_ai_response(prompt, priority=PRIORITY_BATCH)
+        result["profile"] = profile
+        return result
+
     prompt = f"""Analise os seguintes dados e forneça:
 1. 📊 Resumo estatístico
 2. 📈 Tendências identificadas
@@ -265,11 +513,44 @@ async def analyze_data(data_description: str) -> dict:
 Dados:
 {data_description}"""
     
-    return await generate_ai_response(prompt)
+    return await generate_ai_response(prompt, priority=PRIORITY_BATCH)
 
 
-async def predict_trend(historical_data: str) -> dict:
-    """Faz previsão baseada em dados históricos"""
+async def predict_trend(historical_data: str = "", table: Optional[str] = None,
+                        date_column: Optional[str] = None, value_column: Optional[str] = None,
+                        group_by: Optional[str] = None, horizon: int = 3,
+                        freq: str = "month", narrate: bool = True) -> dict:
+    """
+    Faz previsão baseada em dados históricos.
+    Com `table`, a previsão é calculada por stats.forecast (reprodutível,
+    com intervalos) e a IA só a explica.
+    """
+    if table:
+        from stats.forecast import forecast_table, forecast_to_text
+        try:
+            forecast = await asyncio.to_thread(
+                forecast_table, table, date_column, value_column, group_by, horizon, freq
+            )
+        except ValueError as e:
+            return {"response": f"❌ {e}", "source": "Sistema", "model": None, "success": False}
+        except Exception as e:
+            print(f"Forecast error for {table}: {e}")
+            return {"response": f"❌ Não foi possível prever a partir da tabela {table}.",
+                    "source": "Sistema", "model": None, "success": False}
+        if not narrate or not forecast["series"]:
+            return {"response": "", "source": "📈 Previsão estatística", "model": None,
+                    "success": bool(forecast["series"]), "forecast": forecast}
+        prompt = f"""Previsão calculada estatisticamente (não altere os números):
+{forecast_to_text(forecast)}
+
+Explique para o usuário:
+1. 📊 Tendência esperada (crescimento/queda/estável)
+2. 🔮 O que os valores previstos e os intervalos significam
+3. ⚠️ Fatores de risco e limitações"""
+        result = await generate_ai_response(prompt, priority=PRIORITY_BATCH)
+        result["forecast"] = forecast
+        return result
+
     prompt = f"""Com base nos dados históricos abaixo, faça uma previsão para os próximos 3 meses:
 
 {historical_data}
@@ -280,7 +561,7 @@ Forneça:
 3. 🎯 Nível de confiança
 4. ⚠️ Fatores de risco"""
     
-    return await generate_ai_response(prompt)
+    return await generate_ai_response(prompt, priority=PRIORITY_BATCH)
 
 
 async def explain_chart(chart_description: str) -> dict:
@@ -295,7 +576,7 @@ Inclua:
 3. 💡 Insights importantes
 4. 🎯 Conclusões práticas"""
     
-    return await generate_ai_response(prompt)
+    return await generate_ai_response(prompt, priority=PRIORITY_BATCH)
 
 
 async def suggest_visualization(data_type: str) -> dict:
@@ -308,50 +589,103 @@ Sugira:
 3. 📐 Layout ideal
 4. 💡 Dicas de visualização"""
     
-    return await generate_ai_response(prompt)
+    return await generate_ai_response(prompt, priority=PRIORITY_BATCH)
 
 
 # ============================================
-# CHAT CONVERSACIONAL
+# CHAT CONVERSACIONAL (MEMÓRIA POR USUÁRIO + SESSÃO)
 # ============================================
+SUMMARY_PROMPT = """Atualize o resumo de uma conversa entre um usuário e um assistente de análise de dados.
+Mantenha fatos, números, tabelas e decisões mencionados. Máximo de 5 frases, em português.
+
+Resumo atual:
+{summary}
+
+Novas mensagens:
+{messages}
+
+Resumo atualizado:"""
+
+
 class AIChat:
-    def __init__(self):
-        self.history = []
-        self.max_history = 10
-    
-    async def send_message(self, message: str) -> dict:
-        """Envia mensagem mantendo contexto da conversa"""
-        
-        # Monta contexto com histórico
-        context = "\n".join([
-            f"{'Usuário' if i % 2 == 0 else 'IA'}: {msg}"
-            for i, msg in enumerate(self.history[-6:])  # Últimas 3 trocas
-        ])
-        
-        full_prompt = f"""Contexto da conversa:
+    """
+    Conversa de um usuário em uma sessão. O histórico fica em
+    gpt.conversations (Redis com TTL), compartilhado entre workers; o
+    prompt leva só o resumo + as mensagens recentes que cabem no orçamento.
+    """
+
+    def __init__(self, user: str, session: str = "default"):
+        self.user = user
+        self.session = session
+
+    def _prompt(self, message: str) -> str:
+        summary, messages = conversations.load(self.user, self.session)
+        context = conversations.build_context(summary, messages)
+        return f"""Contexto da conversa:
 {context}
 
 Usuário: {message}
 
 Responda de forma útil e contextualizada:"""
-        
-        response = await generate_ai_response(full_prompt)
-        
-        # Salva no histórico
-        self.history.append(message)
-        if response["success"]:
-            self.history.append(response["response"])
-        
-        # Limita histórico
-        if len(self.history) > self.max_history * 2:
-            self.history = self.history[-self.max_history * 2:]
-        
+
+    async def send_message(self, message: str, prefer_local: bool = True) -> dict:
+        """Envia mensagem mantendo contexto da conversa"""
+        response = await generate_ai_response(self._prompt(message), prefer_local)
+        self._remember(message, response["response"] if response["success"] else None)
         return response
-    
+
+    async def stream_message(self, message: str, prefer_local: bool = True):
+        """Como send_message, em eventos de stream_ai_response"""
+        parts = []
+        answered = False
+        async for event in stream_ai_response(self._prompt(message), prefer_local):
+            if event["type"] == "token":
+                parts.append(event["text"])
+            elif event["type"] == "done":
+                answered = True
+            yield event
+        self._remember(message, "".join(parts) if answered else None)
+
+    def _remember(self, message: str, answer: Optional[str]):
+        turn = [{"role": "user", "content": message}]
+        if answer:
+            turn.append({"role": "assistant", "content": answer})
+        conversations.append(self.user, self.session, *turn)
+        # Resumo das mensagens antigas fora do caminho da resposta
+        if conversations.overflow(self.user, self.session):
+            _spawn(self._summarize())
+
+    async def _summarize(self):
+        token = conversations.acquire_fold_lock(self.user, self.session)
+        if token is None:
+            return   # outro worker já está resumindo
+        try:
+            # Turnos que chegaram durante o resumo entram na rodada seguinte
+            while True:
+                old = conversations.overflow(self.user, self.session)
+                if not old:
+                    return
+                summary, _ = conversations.load(self.user, self.session)
+                lines = "\n".join(
+                    f"{'Usuário' if m['role'] == 'user' else 'IA'}: {m['content']}" for m in old
+                )
+                result = await generate_ai_response(
+                    SUMMARY_PROMPT.format(summary=summary or "(vazio)", messages=lines),
+                    priority=PRIORITY_BATCH,
+                )
+                # Sem IA disponível: guarda o texto cru (truncado no fold)
+                new_summary = result["response"] if result["success"] else f"{summary}\n{lines}"
+                if not conversations.fold(self.user, self.session, old, new_summary.strip()):
+                    return
+        except Exception as e:
+            print(f"Chat summary error: {e}")
+        finally:
+            conversations.release_fold_lock(self.user, self.session, token)
+
     def clear_history(self):
         """Limpa histórico da conversa"""
-        self.history = []
+        conversations.clear(self.user, self.session)
 
 
-# Instância global do chat
-ai_chat = AIChat()
+def get_chat(user: str, session: str = "default") -> AIChat:
+    return AIChat(user, session or "default")
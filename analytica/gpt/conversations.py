@@ -0,0 +1,190 @@
+# ============================================
+# ANALYSTIC.A — MEMÓRIA DE CONVERSAS DA IA
+# Por usuário + sessão, no Redis (TTL) com fallback em memória:
+# últimas mensagens em buffer circular + resumo incremental das antigas
+# ============================================
+import json
+import os
+import sys
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:      # sem o pacote redis, get_redis() retorna None
+    class WatchError(Exception):
+        pass
+
+CHAT_TTL = int(os.getenv("CHAT_TTL", str(24 * 3600)))
+# Mensagens guardadas na íntegra; as mais antigas viram resumo
+CHAT_MAX_MESSAGES = int(os.getenv("CHAT_MAX_MESSAGES", "12"))
+# Teto rígido do buffer: se o resumo falhar seguidamente (IA fora, lock
+# ocupado), as mais antigas são descartadas sem resumo
+CHAT_HARD_LIMIT = 4 * CHAT_MAX_MESSAGES
+# Orçamento de tokens do contexto enviado ao modelo (resumo + mensagens)
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1200"))
+SUMMARY_MAX_CHARS = 1500
+
+_local = LRUCache(max_entries=10000, ttl=CHAT_TTL)   # sem Redis: só este processo
+_folding = set()                                      # conversas sendo resumidas (sem Redis)
+_folding_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token (português/inglês); suficiente para orçamento
+    return len(text) // 4 + 1
+
+
+def _key(user: str, session: str) -> str:
+    return f"analytica:chat:{user}:{session}"
+
+
+def load(user: str, session: str) -> Tuple[str, List[dict]]:
+    """(resumo, mensagens) da conversa; mensagens = [{"role", "content"}]"""
+    key = _key(user, session)
+    r = get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline()
+            pipe.get(f"{key}:summary")
+            pipe.lrange(f"{key}:messages", 0, -1)
+            summary, raw = pipe.execute()
+            return (summary.decode() if summary else ""), [json.loads(m) for m in raw]
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    conv = _local.get(key)
+    if conv is None:
+        return "", []
+    return conv["summary"], list(conv["messages"])
+
+
+def append(user: str, session: str, *messages: dict):
+    key = _key(user, session)
+    r = get_redis()
+    if r is not None:
+        try:
+            pipe = r.pipeline()
+            pipe.rpush(f"{key}:messages", *(json.dumps(m, ensure_ascii=False) for m in messages))
+            pipe.ltrim(f"{key}:messages", -CHAT_HARD_LIMIT, -1)
+            pipe.expire(f"{key}:messages", CHAT_TTL)
+            pipe.expire(f"{key}:summary", CHAT_TTL)
+            pipe.execute()
+            return
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    conv = _local.get(key) or {"summary": "", "messages": []}
+    conv["messages"] = (conv["messages"] + list(messages))[-CHAT_HARD_LIMIT:]
+    _local.set(key, conv)
+
+
+def overflow(user: str, session: str) -> List[dict]:
+    """Mensagens mais antigas que excedem o buffer (a resumir)"""
+    _, messages = load(user, session)
+    return messages[:max(0, len(messages) - CHAT_MAX_MESSAGES)]
+
+
+def fold(user: str, session: str, folded: List[dict], summary: str) -> bool:
+    """
+    Troca as mensagens resumidas (`folded`) pelo novo resumo. A contagem
+    é conferida na hora: se o início da lista não for mais `folded`
+    (conversa limpa ou já resumida), nada muda e retorna False.
+    """
+    key = _key(user, session)
+    summary = summary[-SUMMARY_MAX_CHARS:]
+    count = len(folded)
+    r = get_redis()
+    if r is not None:
+        expected = [json.dumps(m, ensure_ascii=False).encode() for m in folded]
+        with r.pipeline() as pipe:
+            try:
+                pipe.watch(f"{key}:messages")
+                if pipe.lrange(f"{key}:messages", 0, count - 1) != expected:
+                    return False
+                pipe.multi()
+                pipe.ltrim(f"{key}:messages", count, -1)
+                pipe.set(f"{key}:summary", summary, ex=CHAT_TTL)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False   # lista mudou no meio: o próximo turno resume de novo
+            except REDIS_ERRORS as e:
+                redis_failed(e)
+                return False
+    conv = _local.get(key)
+    if conv is None or conv["messages"][:count] != folded:
+        return False
+    _local.set(key, {"summary": summary, "messages": conv["messages"][count:]})
+    return True
+
+
+def acquire_fold_lock(user: str, session: str) -> Optional[str]:
+    """Um resumo por conversa de cada vez (entre workers/réplicas)"""
+    r = get_redis()
+    if r is None:
+        with _folding_lock:
+            if _key(user, session) in _folding:
+                return None
+            _folding.add(_key(user, session))
+        return "local"
+    token = uuid.uuid4().hex
+    try:
+        if r.set(f"{_key(user, session)}:fold", token, nx=True, ex=120):
+            return token
+    except REDIS_ERRORS as e:
+        redis_failed(e)
+    return None
+
+
+def release_fold_lock(user: str, session: str, token: str):
+    if token == "local":
+        with _folding_lock:
+            _folding.discard(_key(user, session))
+        return
+    r = get_redis()
+    try:
+        if r is not None and r.get(f"{_key(user, session)}:fold") == token.encode():
+            r.delete(f"{_key(user, session)}:fold")
+    except REDIS_ERRORS as e:
+        redis_failed(e)   # o lock expira sozinho (ex=120)
+
+
+def clear(user: str, session: str):
+    key = _key(user, session)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.delete(f"{key}:messages", f"{key}:summary")
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    _local.delete(key)
+
+
+def build_context(summary: str, messages: List[dict], budget: int = CHAT_CONTEXT_TOKENS) -> str:
+    """
+    Contexto dentro do orçamento: resumo + mensagens mais recentes que
+    couberem (da mais nova para a mais antiga).
+    """
+    lines = []
+    used = estimate_tokens(summary) if summary else 0
+    for message in reversed(messages):
+        speaker = "Usuário" if message["role"] == "user" else "IA"
+        line = f"{speaker}: {message['content']}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+
+    parts = []
+    if summary:
+        parts.append(f"Resumo da conversa até aqui: {summary}")
+    parts.extend(lines)
+    return "\n".join(parts)
@@ -10,7 +10,7 @@ from gpt.ai_engine import (
     generate_ai_response,
     analyze_data,
     predict_trend,
-    ai_chat
+    get_chat
 )
 
 def generate_insights(question: str) -> str:
@@ -0,0 +1,248 @@
+# ============================================
+# file: http_pool.py — clientes HTTP persistentes para provedores de IA
+# Um cliente por provedor (keep-alive, limites, timeouts, retry/backoff)
+# + status de saúde cacheado
+# ============================================
+import asyncio
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+# HTTP/2 só se o pacote h2 estiver instalado
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Respostas que valem nova tentativa (limite de taxa / indisponibilidade)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_BACKOFF_SECONDS = 8.0
+
+
+@dataclass
+class ProviderConfig:
+    name: str
+    base_url: str
+    max_connections: int = 10
+    max_keepalive: int = 5
+    connect_timeout: float = 5.0
+    read_timeout: float = 60.0
+    pool_timeout: float = 10.0       # espera máx. por uma conexão livre
+    retries: int = 2
+    backoff: float = 0.5             # 0.5s, 1s, 2s... (+ jitter)
+    http2: bool = False
+
+
+_configs: Dict[str, ProviderConfig] = {}
+# Clientes por event loop: {loop: (clientes, gerador que os fecha)}
+_loop_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_sessions: Dict[str, object] = {}
+_sessions_lock = threading.Lock()
+
+
+def register_provider(config: ProviderConfig):
+    _configs[config.name] = config
+
+
+# ============================================
+# CLIENTE ASYNC (httpx)
+# ============================================
+async def _close_on_shutdown(clients: Dict[str, httpx.AsyncClient]):
+    """
+    Gerador async aberto enquanto o loop roda: o shutdown_asyncgens() do
+    fim do asyncio.run o fecha, e o finally fecha os clientes do loop
+    (ainda com o loop ativo, sem vazar conexões).
+    """
+    try:
+        yield
+    finally:
+        for client in list(clients.values()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"Erro ao fechar cliente HTTP: {e}")
+        clients.clear()
+
+
+def _current_clients() -> Dict[str, httpx.AsyncClient]:
+    loop = asyncio.get_running_loop()
+    entry = _loop_clients.get(loop)
+    if entry is None:
+        clients: Dict[str, httpx.AsyncClient] = {}
+        closer = _close_on_shutdown(clients)
+        # Primeiro passo: registra o gerador no loop e para no yield
+        try:
+            closer.asend(None).send(None)
+        except StopIteration:
+            pass
+        entry = _loop_clients[loop] = (clients, closer)
+    return entry[0]
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Cliente do provedor, criado uma vez e reutilizado (conexões keep-alive).
+    Clientes httpx pertencem a um event loop: cada loop tem os seus, fechados
+    quando ele termina (scripts com vários asyncio.run).
+    """
+    clients = _current_clients()
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        config = _configs[name]
+        client = clients[name] = httpx.AsyncClient(
+            base_url=config.base_url,
+            http2=config.http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(
+                config.read_timeout,
+                connect=config.connect_timeout,
+                pool=config.pool_timeout,
+            ),
+        )
+    return client
+
+
+def _retry_delay(config: ProviderConfig, attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    delay = config.backoff * (2 ** attempt)
+    return min(delay + random.uniform(0, delay / 2), MAX_BACKOFF_SECONDS)
+
+
+async def request(name: str, method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Requisição com retry/backoff exponencial em falhas de conexão e nos
+    status de RETRY_STATUSES. Timeouts de leitura não são repetidos (a
+    geração pode ter ido até o fim no provedor).
+    """
+    config = _configs[name]
+    client = get_client(name)
+    for attempt in range(config.retries + 1):
+        last = attempt == config.retries
+        try:
+            response = await client.request(method, path, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError):
+            if last:
+                raise
+            await asyncio.sleep(_retry_delay(config, attempt))
+            continue
+        if response.status_code in RETRY_STATUSES and not last:
+            await asyncio.sleep(_retry_delay(config, attempt, response.headers.get("retry-after")))
+            continue
+        return response
+
+
+async def close_clients():
+    """Fecha os clientes do loop atual (shutdown da aplicação)"""
+    clients = _current_clients()
+    for client in list(clients.values()):
+        await client.aclose()
+    clients.clear()
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+# ============================================
+# SESSÃO SÍNCRONA (requests)
+# ============================================
+def get_session(name: str):
+    """requests.Session por provedor, com pool e retry do urllib3"""
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                config = _configs[name]
+                retry = Retry(
+                    total=config.retries,
+                    connect=config.retries,
+                    read=0,
+                    status=config.retries,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=None,          # POST também (geração é idempotente)
+                    backoff_factor=config.backoff,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                session = requests.Session()
+                session.mount(config.base_url, HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=config.max_connections,
+                    max_retries=retry,
+                ))
+                _sessions[name] = session
+    return session
+
+
+def request_sync(name: str, method: str, path: str, **kwargs):
+    config = _configs[name]
+    kwargs.setdefault("timeout", (config.connect_timeout, config.read_timeout))
+    return get_session(name).request(method, config.base_url + path, **kwargs)
+
+
+# ============================================
+# SAÚDE DOS PROVEDORES (CACHEADA)
+# ============================================
+_probes: Dict[str, Callable[[], Awaitable[dict]]] = {}
+_health: Dict[str, dict] = {}
+_refreshing: Optional[asyncio.Task] = None
+
+
+def register_probe(name: str, probe: Callable[[], Awaitable[dict]]):
+    """`probe()` retorna {"available": bool, ...detalhes}"""
+    _probes[name] = probe
+
+
+def mark_health(name: str, available: bool, **details):
+    """Atualiza o status a partir de chamadas reais (sucesso/falha)"""
+    entry = dict(_health.get(name, {}))
+    if available:
+        entry.pop("error", None)
+    entry.update(details, available=available, checked_at=time.time())
+    _health[name] = entry
+
+
+async def _probe(name: str):
+    try:
+        result = await _probes[name]()
+    except Exception as e:
+        result = {"available": False, "error": str(e)}
+    _health[name] = {**result, "checked_at": time.time()}
+
+
+async def refresh_health():
+    await asyncio.gather(*(_probe(name) for name in _probes))
+
+
+async def provider_health(max_age: float) -> Dict[str, dict]:
+    """
+    Status de cada provedor sem esperar a rede: devolve o último resultado
+    e, se estiver mais velho que `max_age`, atualiza em background. Só a
+    primeira chamada (sem nenhum resultado) espera as sondas.
+    """
+    global _refreshing
+    if any(name not in _health for name in _probes):
+        await refresh_health()
+    elif any(time.time() - h["checked_at"] > max_age for h in _health.values()):
+        if _refreshing is None or _refreshing.done():
+            _refreshing = asyncio.get_running_loop().create_task(refresh_health())
+    return {name: dict(h) for name, h in _health.items()}
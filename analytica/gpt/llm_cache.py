@@ -0,0 +1,135 @@
+# ============================================
+# ANALYSTIC.A — CACHE DE RESPOSTAS DA IA
+# LRU em memória + Redis, chave = provedor + modelo + opções + prompt,
+# e coalescência de gerações idênticas em andamento
+# ============================================
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "512"))
+LLM_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Geração em outro worker: quanto esperar pelo resultado antes de gerar também
+LLM_LOCK_TTL = 90
+LLM_LOCK_WAIT = 60
+LLM_LOCK_POLL = 0.25
+
+_local = LRUCache(
+    max_entries=LLM_CACHE_ENTRIES,
+    ttl=LLM_CACHE_TTL,
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    sizeof=lambda result: len(result.get("response") or ""),
+)
+
+
+def llm_key(provider: str, model: str, options: Dict, prompt: str) -> str:
+    digest = hashlib.sha256(
+        json.dumps({"model": model, "options": options, "prompt": prompt}, sort_keys=True).encode()
+    ).hexdigest()
+    return f"analytica:llm:{provider}:{digest}"
+
+
+def get_cached_response(key: str) -> Optional[dict]:
+    """Busca no LRU local e depois no Redis (promovendo para o local)"""
+    result = _local.get(key)
+    if result is not None:
+        return dict(result)
+
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(key)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            return None
+        if raw is not None:
+            result = json.loads(raw)
+            _local.set(key, result)
+            return dict(result)
+    return None
+
+
+def set_cached_response(key: str, result: dict):
+    """Só respostas bem-sucedidas são cacheadas"""
+    if not result.get("success"):
+        return
+    _local.set(key, dict(result))
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(key, json.dumps(result, ensure_ascii=False), ex=LLM_CACHE_TTL)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+
+
+def clear_local_cache():
+    _local.clear()
+
+
+# ============================================
+# COALESCÊNCIA DE GERAÇÕES EM ANDAMENTO
+# ============================================
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+async def _generate_once(key: str, lookup: Callable[[], Optional[dict]],
+                         generate: Callable[[], Awaitable[dict]]) -> dict:
+    """
+    Entre workers: quem pega o lock no Redis gera; os demais esperam o
+    resultado aparecer no cache (até LLM_LOCK_WAIT) antes de gerar também.
+    """
+    r = get_redis()
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    try:
+        if r is not None and not r.set(lock_key, token, nx=True, ex=LLM_LOCK_TTL):
+            deadline = time.time() + LLM_LOCK_WAIT
+            while time.time() < deadline:
+                await asyncio.sleep(LLM_LOCK_POLL)
+                result = lookup()
+                if result is not None:
+                    return result
+                if not r.exists(lock_key):
+                    break
+            r = None   # o lock continua com o outro worker
+    except REDIS_ERRORS as e:
+        redis_failed(e)
+        r = None       # sem Redis: gera neste worker
+
+    try:
+        return await generate()
+    finally:
+        if r is not None:
+            try:
+                if r.get(lock_key) == token.encode():
+                    r.delete(lock_key)
+            except REDIS_ERRORS as e:
+                redis_failed(e)
+
+
+async def coalesce(key: str, lookup: Callable[[], Optional[dict]],
+                   generate: Callable[[], Awaitable[dict]]) -> dict:
+    """
+    Requisições idênticas simultâneas compartilham uma única geração.
+    A geração roda em uma task própria: se quem a iniciou cancelar
+    (cliente desconectou), as demais continuam esperando o resultado.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_generate_once(key, lookup, generate))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return dict(await asyncio.shield(task))
@@ -0,0 +1,212 @@
+# ============================================
+# ANALYSTIC.A — ESCALONADOR DOS PROVEDORES DE IA
+# Concorrência máxima + token bucket + prioridade por provedor,
+# roteamento pela menor espera estimada e circuit breaker
+# ============================================
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+# Prioridades (menor = atende primeiro)
+PRIORITY_INTERACTIVE = 0   # chat
+PRIORITY_BATCH = 1         # análises, previsões, insights automáticos
+
+# Tempo máximo na fila de um provedor antes de tentar o próximo
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "20"))
+
+# Circuit breaker: falhas seguidas para abrir e tempo aberto
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+
+# Peso da última medição na média móvel (EWMA) da duração das chamadas
+EWMA_ALPHA = 0.3
+
+
+class ProviderUnavailable(Exception):
+    """Circuito aberto ou fila longa demais: tente outro provedor"""
+
+
+class TokenBucket:
+    """`rate` requisições por minuto, com rajada de até `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate / 60.0
+        self.capacity = burst if burst is not None else max(1.0, rate / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Segundos até haver uma ficha (0 se já há)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, max_concurrency: int, rpm: Optional[float] = None,
+                 initial_latency: float = 5.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rpm) if rpm else None
+        self.in_flight = 0
+        self._waiters = []                 # heap de (prioridade, seq, future)
+        self._seq = itertools.count()
+        self.ewma_latency = initial_latency
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    # ----- circuit breaker -----
+    def is_open(self) -> bool:
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at >= BREAKER_COOLDOWN and not self._probing:
+            return False                   # meio-aberto: deixa uma chamada de teste
+        return True
+
+    def record(self, success: Optional[bool], elapsed: float):
+        """success=None: chamada cancelada pelo cliente, não conta"""
+        if success is None:
+            pass
+        elif success:
+            self.ewma_latency = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.ewma_latency
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            if self.failures >= BREAKER_FAILURES or self._probing:
+                self.opened_at = time.monotonic()
+        self._probing = False
+
+    # ----- estimativa de espera -----
+    def estimated_wait(self) -> float:
+        """Segundos estimados até começar a ser atendido"""
+        ahead = self.in_flight + len(self._waiters) - self.max_concurrency + 1
+        queue_wait = max(0, ahead) * self.ewma_latency / self.max_concurrency
+        bucket_wait = self.bucket.wait_time() if self.bucket else 0.0
+        return queue_wait + bucket_wait
+
+    # ----- concorrência com prioridade -----
+    async def acquire(self, priority: int, timeout: float):
+        if self.is_open():
+            raise ProviderUnavailable(f"{self.name}: circuito aberto")
+        probing = self.opened_at is not None
+        if probing:
+            self._probing = True
+        try:
+            await self._acquire(priority, timeout)
+        except BaseException:
+            if probing:
+                self._probing = False
+            raise
+
+    async def _acquire(self, priority: int, timeout: float):
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self._seq), future)
+            heapq.heappush(self._waiters, entry)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    self._release_slot()   # a vaga chegou junto com o timeout
+                else:
+                    future.cancel()
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise ProviderUnavailable(f"{self.name}: fila cheia")
+
+        # Limite de taxa: espera a próxima ficha já com a vaga reservada
+        if self.bucket is not None:
+            try:
+                delay = self.bucket.wait_time()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self.bucket.wait_time()
+            except BaseException:
+                self._release_slot()
+                raise
+            self.bucket.take()
+
+    def _release_slot(self):
+        # Passa a vaga direto para o próximo da fila (mais prioritário)
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def release(self, success: Optional[bool], elapsed: float):
+        self.record(success, elapsed)
+        self._release_slot()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "ewma_latency": round(self.ewma_latency, 3),
+            "estimated_wait": round(self.estimated_wait(), 3),
+            "circuit_open": self.is_open(),
+        }
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def register_limiter(limiter: ProviderLimiter):
+    _limiters[limiter.name] = limiter
+
+
+def route(preferred: List[str]) -> List[str]:
+    """
+    Provedores disponíveis (circuito fechado) pela menor espera estimada;
+    empates mantêm a ordem de preferência.
+    """
+    candidates = [name for name in preferred if not _limiters[name].is_open()]
+    return sorted(candidates, key=lambda name: (_limiters[name].estimated_wait(), preferred.index(name)))
+
+
+class Ticket:
+    """Marque `success = False` se a chamada falhar sem exceção"""
+    success: Optional[bool] = True
+
+
+@asynccontextmanager
+async def slot(name: str, priority: int = PRIORITY_BATCH, timeout: float = AI_QUEUE_TIMEOUT):
+    """Reserva uma vaga no provedor; ProviderUnavailable se não houver"""
+    limiter = _limiters[name]
+    await limiter.acquire(priority, timeout)
+    ticket = Ticket()
+    start = time.monotonic()
+    try:
+        yield ticket
+    except (asyncio.CancelledError, GeneratorExit):
+        ticket.success = None      # cliente desistiu: não é falha do provedor
+        raise
+    except BaseException:
+        ticket.success = False
+        raise
+    finally:
+        limiter.release(ticket.success, time.monotonic() - start)
+
+
+def scheduler_stats() -> Dict[str, dict]:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
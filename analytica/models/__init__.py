@@ -0,0 +1 @@
+# Pacote models
\ No newline at end of file
@@ -2,12 +2,23 @@
 # ANALYSTIC.A — DATA MODELING ENGINE
 # Relacionamentos entre tabelas + DAX simplificado
 # ============================================
-import json
 import os
+import sys
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, asdict
 from datetime import datetime
 
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.measure_engine import (
+    AGGREGATES, Call, ColumnRef, ColumnStore, EvalContext, as_array, compile_expression, parse_expression, plan_cache,
+)
+from models.join_engine import get_join_engine, drop_join_engine
+from db.database import db_connection
+from db.rollups import query_rollup
+from persistence import VERSION_KEY, DocumentStore
+
 # ============================================
 # MODELOS DE DADOS
 # ============================================
@@ -54,6 +65,7 @@ class DataModel:
     created_at: str
     updated_at: str
     owner: str
+    version: int = 0  # versão em disco (concorrência otimista)
 
 
 # ============================================
@@ -62,23 +74,26 @@ class DataModel:
 MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "models")
 os.makedirs(MODELS_DIR, exist_ok=True)
 
+MODEL_STORE = DocumentStore(MODELS_DIR)
+
 
 def save_model(model: DataModel) -> bool:
-    """Salva modelo no disco"""
+    """Salva modelo no disco (falha se outro processo gravou desde o load)"""
     try:
-        filepath = os.path.join(MODELS_DIR, f"{model.id}.json")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            data = {
-                "id": model.id,
-                "name": model.name,
-                "tables": [{"name": t.name, "columns": [asdict(c) for c in t.columns], "row_count": t.row_count, "source": t.source} for t in model.tables],
-                "relationships": [asdict(r) for r in model.relationships],
-                "measures": [asdict(m) for m in model.measures],
-                "created_at": model.created_at,
-                "updated_at": datetime.now().isoformat(),
-                "owner": model.owner
-            }
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        data = {
+            "id": model.id,
+            "name": model.name,
+            "tables": [{"name": t.name, "columns": [asdict(c) for c in t.columns], "row_count": t.row_count, "source": t.source} for t in model.tables],
+            "relationships": [asdict(r) for r in model.relationships],
+            "measures": [asdict(m) for m in model.measures],
+            "created_at": model.created_at,
+            "updated_at": datetime.now().isoformat(),
+            "owner": model.owner
+        }
+        model.version = MODEL_STORE.save(model.id, data, expected_version=model.version)
+        # Medidas podem ter mudado: descarta planos compilados do modelo
+        plan_cache.invalidate(model.id)
+        drop_join_engine(model.id)
         return True
     except Exception as e:
         print(f"Error saving model: {e}")
@@ -88,10 +103,10 @@ def save_model(model: DataModel) -> bool:
 def load_model(model_id: str) -> Optional[DataModel]:
     """Carrega modelo do disco"""
     try:
-        filepath = os.path.join(MODELS_DIR, f"{model_id}.json")
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
+        data = MODEL_STORE.load(model_id)
+        if data is None:
+            return None
+
         tables = [
             Table(
                 name=t["name"],
@@ -112,7 +127,8 @@ def load_model(model_id: str) -> Optional[DataModel]:
             measures=measures,
             created_at=data["created_at"],
             updated_at=data["updated_at"],
-            owner=data["owner"]
+            owner=data["owner"],
+            version=data.get(VERSION_KEY, 0)
         )
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -122,26 +138,26 @@ def load_model(model_id: str) -> Optional[DataModel]:
 def list_models(owner: str = None) -> List[Dict]:
     """Lista todos os modelos"""
     models = []
-    for filename in os.listdir(MODELS_DIR):
-        if filename.endswith('.json'):
-            model = load_model(filename[:-5])
-            if model:
-                if owner is None or model.owner == owner:
-                    models.append({
-                        "id": model.id,
-                        "name": model.name,
-                        "tables_count": len(model.tables),
-                        "updated_at": model.updated_at,
-                        "owner": model.owner
-                    })
+    for model_id in MODEL_STORE.ids():
+        model = load_model(model_id)
+        if model:
+            if owner is None or model.owner == owner:
+                models.append({
+                    "id": model.id,
+                    "name": model.name,
+                    "tables_count": len(model.tables),
+                    "updated_at": model.updated_at,
+                    "owner": model.owner
+                })
     return models
 
 
 def delete_model(model_id: str) -> bool:
     """Deleta um modelo"""
     try:
-        filepath = os.path.join(MODELS_DIR, f"{model_id}.json")
-        os.remove(filepath)
+        MODEL_STORE.delete(model_id)
+        plan_cache.invalidate(model_id)
+        drop_join_engine(model_id)
         return True
     except:
         return False
@@ -150,45 +166,94 @@ def delete_model(model_id: str) -> bool:
 # ============================================
 # DAX SIMPLIFICADO (PARSER)
 # ============================================
+# Agregações vetorizadas (NumPy) — mesma assinatura (coluna, dados) de antes
 DAX_FUNCTIONS = {
-    "SUM": lambda col, data: sum(data.get(col, [])),
-    "AVERAGE": lambda col, data: sum(data.get(col, [])) / len(data.get(col, [1])),
-    "COUNT": lambda col, data: len(data.get(col, [])),
-    "MIN": lambda col, data: min(data.get(col, [0])),
-    "MAX": lambda col, data: max(data.get(col, [0])),
-    "DISTINCTCOUNT": lambda col, data: len(set(data.get(col, []))),
+    name: (lambda col, data, _agg=agg: _agg(as_array(data.get(col, []))))
+    for name, agg in AGGREGATES.items()
 }
 
 
 def parse_dax(expression: str, data: Dict[str, List]) -> Any:
     """
-    Parser DAX simplificado
-    Suporta: SUM, AVERAGE, COUNT, MIN, MAX, DISTINCTCOUNT
-    Exemplo: SUM(Vendas[Valor])
+    Avalia DAX simplificado com o measure engine colunar.
+    Suporta: SUM, AVERAGE, COUNT, MIN, MAX, DISTINCTCOUNT, COUNTROWS, DIVIDE,
+    IF, CALCULATE com FILTER/ALL/DATEADD, comparações e aritmética.
+    A expressão é compilada uma vez e cacheada.
+    Exemplo: SUM(Vendas[Valor]) / COUNT(Vendas[ID])
+    `data` usa chaves "Tabela.Coluna" (ou nomes simples para variáveis).
     """
-    expression = expression.strip()
-    
-    for func_name, func in DAX_FUNCTIONS.items():
-        if expression.upper().startswith(func_name + "("):
-            # Extrai a coluna
-            inner = expression[len(func_name)+1:-1]  # Remove FUNC( e )
-            
-            # Parse Tabela[Coluna]
-            if "[" in inner and "]" in inner:
-                table = inner.split("[")[0]
-                column = inner.split("[")[1].rstrip("]")
-                key = f"{table}.{column}"
-            else:
-                key = inner
-            
-            return func(key, data)
-    
-    # Operações matemáticas simples
     try:
-        return eval(expression, {"__builtins__": {}}, data)
-    except:
+        plan = compile_expression(expression)
+        return plan(EvalContext(ColumnStore.from_flat(data)))
+    except (SyntaxError, KeyError, TypeError, ValueError, RecursionError):
+        return None
+
+
+def evaluate_measure(model: DataModel, measure_name: str, store: ColumnStore,
+                     group_by: Optional[tuple] = None, filters: Optional[Dict] = None) -> Any:
+    """
+    Avalia uma medida do modelo (pode referenciar outras medidas: [Nome]).
+    O plano compilado fica em cache por (model.id, nome da medida) e os
+    filtros se propagam pelos relacionamentos do modelo.
+
+    group_by=("Tabela", "Coluna") retorna {"keys": [...], "values": [...]}
+    com a medida calculada por valor da coluna (ordenado pelas chaves),
+    inclusive atributos de dimensão, ex.: ("Produtos", "Categoria").
+    """
+    measures = {m.name: m.expression for m in model.measures}
+    if measure_name not in measures:
+        return None
+
+    plan = plan_cache.get(model.id, measure_name, measures[measure_name])
+    ctx = EvalContext(store, measures, filters, joins=get_join_engine(model, store))
+    if group_by is None:
+        return plan.evaluate(ctx)
+
+    keys, values = plan.evaluate_grouped(ctx, *group_by)
+    return {
+        "keys": keys.tolist(),
+        "values": [None if v is None or v != v else v for v in values.tolist()],
+    }
+
+
+# Agregados DAX que um rollup responde (nome no rollup)
+ROLLUP_AGGREGATES = {"SUM": "sum", "AVERAGE": "avg", "COUNT": "count", "MIN": "min", "MAX": "max"}
+
+
+def evaluate_measure_rollup(model: DataModel, measure_name: str, group_by: Optional[tuple] = None,
+                            filters: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Medida simples (SUM/AVERAGE/COUNT/MIN/MAX de uma coluna) respondida
+    por um rollup materializado no Postgres, sem carregar a tabela base.
+    `filters` são igualdades {coluna: valor} na tabela da medida.
+    Retorna None quando nenhum rollup cobre a consulta.
+    """
+    measures = {m.name: m.expression for m in model.measures}
+    if measure_name not in measures:
+        return None
+    try:
+        node = parse_expression(measures[measure_name])
+    except SyntaxError:
+        return None
+    if not (isinstance(node, Call) and node.name in ROLLUP_AGGREGATES and len(node.args) == 1
+            and isinstance(node.args[0], ColumnRef) and node.args[0].table):
         return None
 
+    table, column = node.args[0].table, node.args[0].column
+    if group_by is not None and group_by[0] != table:
+        return None
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        rows = query_rollup(cur, table.lower(), group_by[1] if group_by else None, column,
+                            ROLLUP_AGGREGATES[node.name], filters=filters)
+        cur.close()
+    if rows is None:
+        return None
+    if group_by is None:
+        return rows[0][0] if rows else None
+    return {"keys": [r[0] for r in rows], "values": [r[1] for r in rows]}
+
 
 def validate_dax(expression: str) -> Dict:
     """Valida expressão DAX"""
@@ -211,6 +276,14 @@ def validate_dax(expression: str) -> Dict:
         result["valid"] = False
         result["errors"].append("Colchetes não balanceados")
     
+    # Verifica sintaxe com o parser do measure engine
+    if result["valid"]:
+        try:
+            compile_expression(expression)
+        except SyntaxError as e:
+            result["valid"] = False
+            result["errors"].append(str(e))
+    
     return result
 
 
@@ -314,6 +387,7 @@ QUICK_MEASURES = {
     "maximo": lambda table, col: f"MAX({table}[{col}])",
     "variacao_percentual": lambda table, col: f"(SUM({table}[{col}]) - SUM({table}[{col}_anterior])) / SUM({table}[{col}_anterior])",
     "acumulado": lambda table, col: f"CALCULATE(SUM({table}[{col}]), FILTER(ALL({table}), {table}[Data] <= MAX({table}[Data])))",
+    "variacao_periodo": lambda table, col: f"DIVIDE(SUM({table}[{col}]) - CALCULATE(SUM({table}[{col}]), DATEADD({table}[Data], -1, MONTH)), CALCULATE(SUM({table}[{col}]), DATEADD({table}[Data], -1, MONTH)))",
 }
 
 
@@ -0,0 +1,207 @@
+# ============================================
+# ANALYSTIC.A — JOIN ENGINE (STAR SCHEMA)
+# Índices hash dos relacionamentos + propagação de filtros
+# ============================================
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Marca "ALL(T)" no contexto de filtro: bloqueia filtros propagados para T
+ALL_MARKER = "__all__"
+
+
+class RelationshipIndex:
+    """
+    Índice de um relacionamento muitos-para-um:
+    hash de `to_column` na dimensão + posição da linha da dimensão para
+    cada linha do fato (-1 quando a chave não existe na dimensão).
+    """
+
+    def __init__(self, store, fact_table: str, fact_column: str, dim_table: str, dim_column: str):
+        dim_keys = pd.Index(store.column(dim_table, dim_column))
+        positions = np.arange(len(dim_keys))
+        if not dim_keys.is_unique:
+            # Lado "um" com chaves repetidas: vale a primeira ocorrência
+            keep = ~dim_keys.duplicated()
+            dim_keys, positions = dim_keys[keep], positions[keep]
+
+        found = dim_keys.get_indexer(store.column(fact_table, fact_column))
+        self.fact_to_dim = np.where(found >= 0, positions[np.maximum(found, 0)], -1)
+        self.dim_rows = store.row_count(dim_table)
+        self.versions = (store.versions.get(fact_table), store.versions.get(dim_table))
+
+    def to_fact(self, dim_mask: np.ndarray) -> np.ndarray:
+        """Filtro da dimensão → linhas do fato"""
+        return (self.fact_to_dim >= 0) & dim_mask[np.maximum(self.fact_to_dim, 0)]
+
+    def to_dim(self, fact_mask: np.ndarray) -> np.ndarray:
+        """Filtro do fato → linhas da dimensão (cross_filter = both)"""
+        mask = np.zeros(self.dim_rows, dtype=bool)
+        rows = self.fact_to_dim[fact_mask]
+        mask[rows[rows >= 0]] = True
+        return mask
+
+
+class JoinEngine:
+    """
+    Relacionamentos do modelo sobre um ColumnStore. Os índices ficam em
+    memória entre consultas e só são reconstruídos quando a versão de uma
+    das tabelas do relacionamento muda.
+    """
+
+    def __init__(self, store, relationships: List):
+        self.store = store
+        self.relationships = []
+        for rel in relationships:
+            cardinality = getattr(rel, "cardinality", "many-to-one")
+            if cardinality == "many-to-many":
+                continue
+            if cardinality == "one-to-many":
+                fact, fact_col, dim, dim_col = rel.to_table, rel.to_column, rel.from_table, rel.from_column
+            else:
+                fact, fact_col, dim, dim_col = rel.from_table, rel.from_column, rel.to_table, rel.to_column
+            self.relationships.append({
+                "id": rel.id,
+                "fact": fact, "fact_column": fact_col,
+                "dim": dim, "dim_column": dim_col,
+                "both": getattr(rel, "cross_filter", "single") == "both",
+            })
+        self.signature = None
+        self._indexes: Dict[str, RelationshipIndex] = {}
+        self._paths: Dict[tuple, tuple] = {}
+        self._row_maps: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def index(self, rel: Dict) -> RelationshipIndex:
+        versions = (self.store.versions.get(rel["fact"]), self.store.versions.get(rel["dim"]))
+        idx = self._indexes.get(rel["id"])
+        if idx is None or idx.versions != versions:
+            idx = RelationshipIndex(self.store, rel["fact"], rel["fact_column"], rel["dim"], rel["dim_column"])
+            with self._lock:
+                self._indexes[rel["id"]] = idx
+        return idx
+
+    # ============================================
+    # PROPAGAÇÃO DE FILTROS
+    # ============================================
+    def propagate(self, filters: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Propaga filtros dimensão → fato (e fato → dimensão se cross_filter
+        = both), encadeando relacionamentos (snowflake) até estabilizar.
+        Máscaras derivadas ficam sob chaves "->id" / "<-id".
+        """
+        result = {table: dict(cols) for table, cols in filters.items()}
+
+        for _ in range(len(self.relationships) + 1):
+            changed = False
+            for rel in self.relationships:
+                fact, dim = rel["fact"], rel["dim"]
+                if fact not in self.store.tables or dim not in self.store.tables:
+                    continue
+
+                dim_mask = _mask(result.get(dim, {}), exclude=f"<-{rel['id']}")
+                if dim_mask is not None and ALL_MARKER not in result.get(fact, {}):
+                    changed |= _set(result, fact, f"->{rel['id']}", self.index(rel).to_fact(dim_mask))
+
+                if rel["both"]:
+                    fact_mask = _mask(result.get(fact, {}), exclude=f"->{rel['id']}")
+                    if fact_mask is not None and ALL_MARKER not in result.get(dim, {}):
+                        changed |= _set(result, dim, f"<-{rel['id']}", self.index(rel).to_dim(fact_mask))
+            if not changed:
+                break
+        return result
+
+    # ============================================
+    # AGRUPAMENTO POR ATRIBUTO DE DIMENSÃO
+    # ============================================
+    def row_map(self, from_table: str, to_table: str) -> Optional[np.ndarray]:
+        """
+        Para cada linha de `from_table`, a linha correspondente em `to_table`
+        seguindo relacionamentos muitos-para-um (-1 se não houver).
+        None se não existir caminho.
+        """
+        path = self._find_path(from_table, to_table)
+        if path is None:
+            return None
+
+        versions = tuple(self.index(rel).versions for rel in path)
+        cached = self._row_maps.get((from_table, to_table))
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+
+        rows = np.arange(self.store.row_count(from_table))
+        for rel in path:
+            step = self.index(rel).fact_to_dim
+            rows = np.where(rows >= 0, step[np.maximum(rows, 0)], -1)
+        with self._lock:
+            self._row_maps[(from_table, to_table)] = (versions, rows)
+        return rows
+
+    def _find_path(self, from_table: str, to_table: str) -> Optional[list]:
+        key = (from_table, to_table)
+        if key in self._paths:
+            return self._paths[key]
+
+        # BFS pelos relacionamentos fato → dimensão
+        queue, seen = [(from_table, [])], {from_table}
+        path = None
+        while queue:
+            table, steps = queue.pop(0)
+            if table == to_table:
+                path = steps
+                break
+            for rel in self.relationships:
+                if rel["fact"] == table and rel["dim"] not in seen:
+                    seen.add(rel["dim"])
+                    queue.append((rel["dim"], steps + [rel]))
+
+        self._paths[key] = path
+        return path
+
+
+def _mask(cols: Dict[str, np.ndarray], exclude: str = None) -> Optional[np.ndarray]:
+    mask = None
+    for key, m in cols.items():
+        if m is None or key == exclude:
+            continue
+        mask = m if mask is None else mask & m
+    return mask
+
+
+def _set(filters: Dict, table: str, key: str, mask: np.ndarray) -> bool:
+    cols = filters.setdefault(table, {})
+    current = cols.get(key)
+    if current is not None and np.array_equal(current, mask):
+        return False
+    cols[key] = mask
+    return True
+
+
+# ============================================
+# CACHE DE ENGINES POR MODELO
+# ============================================
+_engines: Dict[str, JoinEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_join_engine(model, store) -> JoinEngine:
+    """JoinEngine do modelo (reutilizado enquanto store e relacionamentos forem os mesmos)"""
+    signature = tuple(
+        (r.id, r.from_table, r.from_column, r.to_table, r.to_column,
+         getattr(r, "cardinality", ""), getattr(r, "cross_filter", ""))
+        for r in model.relationships
+    )
+    engine = _engines.get(model.id)
+    if engine is None or engine.store is not store or engine.signature != signature:
+        engine = JoinEngine(store, model.relationships)
+        engine.signature = signature
+        with _engines_lock:
+            _engines[model.id] = engine
+    return engine
+
+
+def drop_join_engine(model_id: str):
+    with _engines_lock:
+        _engines.pop(model_id, None)
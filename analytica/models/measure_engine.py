@@ -0,0 +1,950 @@
+# ============================================
+# ANALYSTIC.A — MEASURE ENGINE (COLUNAR)
+# Colunas em arrays NumPy + medidas DAX compiladas uma única vez
+# ============================================
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from models.join_engine import ALL_MARKER
+
+
+# ============================================
+# ARMAZENAMENTO COLUNAR
+# ============================================
+def as_array(values) -> np.ndarray:
+    """Converte lista/Series em array NumPy (numérico quando possível)"""
+    if isinstance(values, np.ndarray):
+        return values
+    if isinstance(values, pd.Series):
+        return values.to_numpy()
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        try:
+            return arr.astype(np.float64)
+        except (TypeError, ValueError):
+            return arr
+    return arr
+
+
+class ColumnStore:
+    """
+    Tabelas do modelo em formato colunar: {tabela: {coluna: np.ndarray}}.
+    Cada tabela tem uma versão, incrementada quando os dados mudam.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, np.ndarray]] = {}
+        self.versions: Dict[str, int] = {}
+        self.scalars: Dict[str, Any] = {}
+
+    def set_table(self, name: str, columns: Union[Dict[str, Any], pd.DataFrame]):
+        if isinstance(columns, pd.DataFrame):
+            columns = {str(c): columns[c] for c in columns.columns}
+        self.tables[name] = {col: as_array(values) for col, values in columns.items()}
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    def column(self, table: Optional[str], column: str) -> np.ndarray:
+        try:
+            return self.tables[table or ""][column]
+        except KeyError:
+            raise KeyError(f"Coluna não encontrada: {table}[{column}]" if table else f"Coluna não encontrada: {column}")
+
+    def row_count(self, table: str) -> int:
+        cols = self.tables.get(table) or {}
+        return len(next(iter(cols.values()))) if cols else 0
+
+    @classmethod
+    def from_flat(cls, data: Dict[str, Any]) -> "ColumnStore":
+        """
+        Constrói a partir do formato legado {"Tabela.Coluna": [valores]}.
+        Chaves sem ponto ficam na tabela "" e valores escalares viram variáveis.
+        """
+        store = cls()
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for key, values in data.items():
+            if np.isscalar(values):
+                store.scalars[key] = values
+                continue
+            table, _, column = key.rpartition(".")
+            grouped.setdefault(table, {})[column] = values
+        for table, columns in grouped.items():
+            store.set_table(table, columns)
+        return store
+
+
+# ============================================
+# AGREGAÇÕES VETORIZADAS
+# ============================================
+def _valid(arr: np.ndarray) -> np.ndarray:
+    """Remove nulos (NaN/None) — equivalente aos BLANKs do DAX"""
+    if arr.dtype.kind == "f":
+        return arr[~np.isnan(arr)]
+    if arr.dtype.kind == "M":
+        return arr[~np.isnat(arr)]
+    if arr.dtype == object:
+        return arr[~pd.isna(arr)]
+    return arr
+
+
+def _sum(arr):
+    return float(np.nansum(arr)) if arr.dtype.kind in "fiub" else float(np.sum(_valid(arr).astype(np.float64)))
+
+
+def _average(arr):
+    arr = _valid(arr)
+    return float(arr.astype(np.float64).mean()) if len(arr) else None
+
+
+def _scalar(value):
+    # Datas continuam np.datetime64 para comparação com as colunas
+    return value if isinstance(value, np.datetime64) else value.item() if hasattr(value, "item") else value
+
+
+def _extreme(arr, reduce, builtin):
+    arr = _valid(arr)
+    if not len(arr):
+        return None
+    if arr.dtype.kind in "fiubmM":
+        return _scalar(reduce(arr))
+    # Texto (<U / object): ordem lexicográfica, como no Python
+    values = arr.tolist()
+    try:
+        return builtin(values)
+    except TypeError:       # tipos misturados: compara como texto
+        return builtin(values, key=str)
+
+
+def _min(arr):
+    return _extreme(arr, np.min, min)
+
+
+def _max(arr):
+    return _extreme(arr, np.max, max)
+
+
+AGGREGATES: Dict[str, Callable[[np.ndarray], Any]] = {
+    "SUM": _sum,
+    "AVERAGE": _average,
+    "COUNT": lambda arr: int(len(_valid(arr))),
+    "MIN": _min,
+    "MAX": _max,
+    "DISTINCTCOUNT": lambda arr: int(len(pd.unique(_valid(arr)))),
+}
+
+
+# ============================================
+# TOKENIZER
+# ============================================
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<colref>(?:'(?:[^']|'')+'|[^\W\d][\w.]*)?\[[^\]]+\])
+  | (?P<ident>[^\W\d][\w.]*)
+  | (?P<op><=|>=|<>|==|&&|\|\||[-+*/(),<>=])
+""", re.VERBOSE)
+
+
+@dataclass
+class Token:
+    kind: str
+    value: str
+    pos: int
+
+
+def tokenize(expression: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if not match:
+            raise SyntaxError(f"Caractere inválido na posição {pos}: {expression[pos]!r}")
+        kind = match.lastgroup
+        if kind != "ws":
+            tokens.append(Token(kind, match.group(), pos))
+        pos = match.end()
+    return tokens
+
+
+# ============================================
+# AST
+# ============================================
+@dataclass(frozen=True)
+class Number:
+    value: float
+
+
+@dataclass(frozen=True)
+class String:
+    value: str
+
+
+@dataclass(frozen=True)
+class ColumnRef:
+    table: Optional[str]
+    column: str
+
+
+@dataclass(frozen=True)
+class MeasureRef:
+    name: str
+
+
+@dataclass(frozen=True)
+class Name:
+    name: str
+
+
+@dataclass(frozen=True)
+class Call:
+    name: str
+    args: tuple
+
+
+@dataclass(frozen=True)
+class BinOp:
+    op: str
+    left: Any
+    right: Any
+
+
+@dataclass(frozen=True)
+class Neg:
+    operand: Any
+
+
+# ============================================
+# PARSER (descida recursiva)
+# ============================================
+class Parser:
+    """
+    expr   := and ('||' and)*
+    and    := cmp ('&&' cmp)*
+    cmp    := add (('<'|'<='|'>'|'>='|'='|'<>') add)?
+    add    := mul (('+'|'-') mul)*
+    mul    := unary (('*'|'/') unary)*
+    unary  := '-' unary | primary
+    primary:= NUMBER | STRING | COLREF | [Medida] | IDENT '(' args ')' | IDENT | '(' expr ')'
+    """
+
+    COMPARISONS = ("<", "<=", ">", ">=", "=", "==", "<>")
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.i = 0
+
+    def _peek(self) -> Optional[Token]:
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def _next(self) -> Token:
+        tok = self._peek()
+        if tok is None:
+            raise SyntaxError("Fim inesperado da expressão")
+        self.i += 1
+        return tok
+
+    def _expect(self, value: str):
+        tok = self._next()
+        if tok.value != value:
+            raise SyntaxError(f"Esperado {value!r} na posição {tok.pos}, encontrado {tok.value!r}")
+
+    def parse(self):
+        node = self.expr()
+        if self._peek() is not None:
+            tok = self._peek()
+            raise SyntaxError(f"Token inesperado na posição {tok.pos}: {tok.value!r}")
+        return node
+
+    def expr(self):
+        node = self.conj()
+        while self._peek() and self._peek().value == "||":
+            self._next()
+            node = BinOp("||", node, self.conj())
+        return node
+
+    def conj(self):
+        node = self.cmp()
+        while self._peek() and self._peek().value == "&&":
+            self._next()
+            node = BinOp("&&", node, self.cmp())
+        return node
+
+    def cmp(self):
+        left = self.add()
+        tok = self._peek()
+        if tok and tok.kind == "op" and tok.value in self.COMPARISONS:
+            self._next()
+            op = "=" if tok.value == "==" else tok.value
+            return BinOp(op, left, self.add())
+        return left
+
+    def add(self):
+        node = self.mul()
+        while self._peek() and self._peek().value in ("+", "-"):
+            op = self._next().value
+            node = BinOp(op, node, self.mul())
+        return node
+
+    def mul(self):
+        node = self.unary()
+        while self._peek() and self._peek().value in ("*", "/"):
+            op = self._next().value
+            node = BinOp(op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self._peek() and self._peek().value == "-":
+            self._next()
+            return Neg(self.unary())
+        return self.primary()
+
+    def primary(self):
+        tok = self._next()
+        if tok.kind == "number":
+            return Number(float(tok.value))
+        if tok.kind == "string":
+            return String(tok.value[1:-1].replace('""', '"'))
+        if tok.kind == "colref":
+            table, _, column = tok.value.partition("[")
+            column = column[:-1]
+            if not table:
+                return MeasureRef(column)
+            if table.startswith("'"):
+                table = table[1:-1].replace("''", "'")
+            return ColumnRef(table, column)
+        if tok.kind == "ident":
+            if self._peek() and self._peek().value == "(":
+                self._next()
+                args = []
+                if self._peek() and self._peek().value != ")":
+                    args.append(self.expr())
+                    while self._peek() and self._peek().value == ",":
+                        self._next()
+                        args.append(self.expr())
+                self._expect(")")
+                return Call(tok.value.upper(), tuple(args))
+            return Name(tok.value)
+        if tok.value == "(":
+            node = self.expr()
+            self._expect(")")
+            return node
+        raise SyntaxError(f"Token inesperado na posição {tok.pos}: {tok.value!r}")
+
+
+@lru_cache(maxsize=2048)
+def parse_expression(expression: str):
+    """AST da expressão (cacheada: cada expressão é analisada uma vez)"""
+    return Parser(expression.strip()).parse()
+
+
+
+
+# ============================================
+# CONTEXTO DE FILTRO
+# ============================================
+class EvalContext:
+    """
+    Estado da avaliação: dados colunares, medidas nomeadas do modelo e
+    contexto de filtro {tabela: {coluna | "*": máscara booleana}}.
+    Com `joins` (JoinEngine), filtros se propagam pelos relacionamentos.
+    """
+
+    def __init__(self, store: ColumnStore, measures: Optional[Dict[str, str]] = None,
+                 filters: Optional[Dict[str, Dict[str, np.ndarray]]] = None, _stack: Optional[List[str]] = None,
+                 joins=None):
+        self.store = store
+        self.measures = measures or {}
+        self.filters = filters or {}
+        self.joins = joins
+        self._measure_stack = _stack if _stack is not None else []
+        self._effective = None
+
+    def with_filters(self, filters: Dict[str, Dict[str, np.ndarray]]) -> "EvalContext":
+        return EvalContext(self.store, self.measures, filters, self._measure_stack, self.joins)
+
+    def copy_filters(self) -> Dict[str, Dict[str, np.ndarray]]:
+        return {table: dict(cols) for table, cols in self.filters.items()}
+
+    def effective_filters(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """Filtros após propagação pelos relacionamentos (calculado uma vez por contexto)"""
+        if self._effective is None:
+            has_filters = any(m is not None for cols in self.filters.values() for m in cols.values())
+            self._effective = self.joins.propagate(self.filters) if self.joins and has_filters else self.filters
+        return self._effective
+
+    def mask(self, table: str) -> Optional[np.ndarray]:
+        """Máscara efetiva da tabela (AND dos filtros) ou None se sem filtro"""
+        mask = None
+        for m in self.effective_filters().get(table, {}).values():
+            if m is None:
+                continue
+            mask = m if mask is None else mask & m
+        return mask
+
+    def column(self, table: Optional[str], column: str) -> np.ndarray:
+        """Valores da coluna visíveis no contexto de filtro atual"""
+        arr = self.store.column(table, column)
+        mask = self.mask(table or "")
+        return arr if mask is None else arr[mask]
+
+    def group_codes(self, table: str, G: "GroupIndex") -> Optional[np.ndarray]:
+        """Código de grupo por linha de `table` (direto ou via relacionamentos)"""
+        if table == G.table:
+            return G.codes
+        if self.joins is None:
+            return None
+        row_map = self.joins.row_map(table, G.table)
+        if row_map is None:
+            return None
+        return np.where(row_map >= 0, G.codes[np.maximum(row_map, 0)], -1)
+
+
+# ============================================
+# OPERADORES
+# ============================================
+def _arith(op: str, a, b):
+    if a is None or b is None:
+        return None
+    if op == "+":
+        return a + b
+    if op == "-":
+        return a - b
+    if op == "*":
+        return a * b
+    if op == "/":
+        return a / b if b else None
+    raise SyntaxError(f"Operador não suportado: {op}")
+
+
+def _coerce_pair(a, b):
+    """Literais de texto comparados a datas viram np.datetime64"""
+    def is_date(v):
+        return isinstance(v, np.datetime64) or (isinstance(v, np.ndarray) and v.dtype.kind == "M")
+    if isinstance(a, str) and is_date(b):
+        a = np.datetime64(a)
+    if isinstance(b, str) and is_date(a):
+        b = np.datetime64(b)
+    return a, b
+
+
+def _compare(op: str, a, b):
+    a, b = _coerce_pair(a, b)
+    if op == "<":
+        return a < b
+    if op == "<=":
+        return a <= b
+    if op == ">":
+        return a > b
+    if op == ">=":
+        return a >= b
+    if op == "=":
+        return a == b
+    if op == "<>":
+        return a != b
+    if op == "&&":
+        return np.logical_and(a, b) if isinstance(a, np.ndarray) or isinstance(b, np.ndarray) else bool(a and b)
+    if op == "||":
+        return np.logical_or(a, b) if isinstance(a, np.ndarray) or isinstance(b, np.ndarray) else bool(a or b)
+    raise SyntaxError(f"Operador não suportado: {op}")
+
+
+LOGICAL_OPS = ("<", "<=", ">", ">=", "=", "<>", "&&", "||")
+
+_DATE_UNITS = {"DAY": "days", "MONTH": "months", "QUARTER": "months", "YEAR": "years"}
+
+
+def _shift_keys(keys: np.ndarray, n: int, unit: str) -> np.ndarray:
+    """Desloca chaves de período (datas por unidade; números por n)"""
+    if keys.dtype.kind == "M":
+        amount = n * 3 if unit == "QUARTER" else n
+        return (pd.DatetimeIndex(keys) + pd.DateOffset(**{_DATE_UNITS[unit]: amount})).to_numpy()
+    if keys.dtype.kind in "iuf":
+        return keys + n
+    raise ValueError("DATEADD exige coluna de data ou numérica")
+
+
+def _constant(node) -> Any:
+    """Valor de um nó constante (número, texto, -número)"""
+    if isinstance(node, (Number, String)):
+        return node.value
+    if isinstance(node, Neg):
+        return -_constant(node.operand)
+    if isinstance(node, Name):
+        return node.name.upper()
+    raise SyntaxError("Argumento deve ser constante")
+
+
+def _table_name(node) -> str:
+    if isinstance(node, Name):
+        return node.name
+    if isinstance(node, String):
+        return node.value
+    raise SyntaxError("Esperado nome de tabela")
+
+
+# ============================================
+# COMPILAÇÃO ESCALAR (AST → closures)
+# ============================================
+def compile_node(node) -> Callable[[EvalContext], Any]:
+    """Gera uma função (ctx → valor) para o nó; feito uma vez por expressão"""
+    if isinstance(node, (Number, String)):
+        value = node.value
+        return lambda ctx: value
+    if isinstance(node, Name):
+        name = node.name
+        return lambda ctx: ctx.store.scalars[name]
+    if isinstance(node, Neg):
+        inner = compile_node(node.operand)
+
+        def neg(ctx):
+            value = inner(ctx)
+            return -value if value is not None else None
+        return neg
+    if isinstance(node, BinOp):
+        left, right, op = compile_node(node.left), compile_node(node.right), node.op
+        if op in LOGICAL_OPS:
+            return lambda ctx: _compare(op, left(ctx), right(ctx))
+        return lambda ctx: _arith(op, left(ctx), right(ctx))
+    if isinstance(node, MeasureRef):
+        name = node.name
+        return lambda ctx: _eval_measure(ctx, name)
+    if isinstance(node, Call):
+        return _compile_call(node)
+    if isinstance(node, ColumnRef):
+        raise SyntaxError(f"Coluna {node.table}[{node.column}] fora de uma agregação")
+    raise SyntaxError(f"Nó não suportado: {node!r}")
+
+
+def _agg_target(node: Call) -> tuple:
+    if len(node.args) != 1 or not isinstance(node.args[0], (ColumnRef, Name)):
+        raise SyntaxError(f"{node.name} espera uma coluna: {node.name}(Tabela[Coluna])")
+    arg = node.args[0]
+    return (arg.table, arg.column) if isinstance(arg, ColumnRef) else (None, arg.name)
+
+
+def _compile_call(node: Call):
+    name, args = node.name, node.args
+
+    if name in AGGREGATES:
+        table, column = _agg_target(node)
+        agg = AGGREGATES[name]
+        return lambda ctx: agg(ctx.column(table, column))
+
+    if name == "COUNTROWS":
+        table = _table_name(args[0])
+
+        def countrows(ctx):
+            mask = ctx.mask(table)
+            return int(mask.sum()) if mask is not None else ctx.store.row_count(table)
+        return countrows
+
+    if name == "DIVIDE":
+        num, den = compile_node(args[0]), compile_node(args[1])
+        alt = compile_node(args[2]) if len(args) > 2 else (lambda ctx: None)
+
+        def divide(ctx):
+            a, b = num(ctx), den(ctx)
+            if a is None or not b:
+                return alt(ctx)
+            return a / b
+        return divide
+
+    if name == "IF":
+        cond, then = compile_node(args[0]), compile_node(args[1])
+        other = compile_node(args[2]) if len(args) > 2 else (lambda ctx: None)
+        return lambda ctx: then(ctx) if cond(ctx) else other(ctx)
+
+    if name == "CALCULATE":
+        inner = compile_node(args[0])
+        modifiers = [_compile_modifier(arg) for arg in args[1:]]
+
+        def calculate(ctx):
+            filters = ctx.copy_filters()
+            for modifier in modifiers:
+                modifier(ctx, filters)
+            return inner(ctx.with_filters(filters))
+        return calculate
+
+    if name in ("FILTER", "ALL", "DATEADD"):
+        raise SyntaxError(f"{name} só é suportado como argumento de CALCULATE")
+    raise SyntaxError(f"Função não suportada: {name}")
+
+
+# ============================================
+# MODIFICADORES DE FILTRO (argumentos de CALCULATE)
+# ============================================
+def _compile_modifier(node) -> Callable[[EvalContext, Dict], None]:
+    """Gera função (ctx, filtros) que altera o novo contexto de filtro"""
+    if isinstance(node, Call) and node.name == "ALL":
+        arg = node.args[0]
+        if isinstance(arg, ColumnRef):
+            def all_column(ctx, filters, t=arg.table, c=arg.column):
+                filters.get(t, {}).pop(c, None)
+            return all_column
+
+        table = _table_name(arg)
+
+        def all_table(ctx, filters):
+            filters[table] = {ALL_MARKER: None}
+        return all_table
+
+    if isinstance(node, Call) and node.name == "FILTER":
+        source, condition = node.args
+        remove_filters = isinstance(source, Call) and source.name == "ALL"
+        table = _table_name(source.args[0] if remove_filters else source)
+        cond = _compile_row(condition, table)
+
+        def filter_table(ctx, filters):
+            # Agregações dentro da condição usam o contexto externo (ctx)
+            mask = np.broadcast_to(np.asarray(cond(ctx), dtype=bool), (ctx.store.row_count(table),))
+            if remove_filters:
+                filters[table] = {ALL_MARKER: None, "*": mask}
+            else:
+                base = ctx.mask(table)
+                filters.setdefault(table, {})["*"] = mask if base is None else mask & base
+        return filter_table
+
+    if isinstance(node, Call) and node.name == "DATEADD":
+        col, n_node, unit_node = node.args
+        if not isinstance(col, ColumnRef):
+            raise SyntaxError("DATEADD espera uma coluna: DATEADD(Tabela[Data], -1, MONTH)")
+        n, unit = int(_constant(n_node)), _constant(unit_node)
+        if unit not in _DATE_UNITS:
+            raise SyntaxError(f"Unidade inválida em DATEADD: {unit}")
+
+        def dateadd(ctx, filters):
+            keys = pd.unique(ctx.column(col.table, col.column))
+            shifted = _shift_keys(np.asarray(keys), n, unit)
+            values = ctx.store.column(col.table, col.column)
+            filters.setdefault(col.table, {})[col.column] = np.isin(values, shifted)
+        return dateadd
+
+    # Filtro booleano simples: Tabela[Coluna] > 10 (substitui filtros da coluna)
+    if isinstance(node, BinOp) and node.op in LOGICAL_OPS:
+        refs = _column_refs(node)
+        if len({r.table for r in refs}) != 1:
+            raise SyntaxError("Filtro booleano deve referenciar colunas de uma única tabela")
+        table = refs[0].table
+        cond = _compile_row(node, table)
+        columns = {r.column for r in refs}
+
+        def boolean_filter(ctx, filters):
+            mask = np.broadcast_to(np.asarray(cond(ctx), dtype=bool), (ctx.store.row_count(table),))
+            cols = filters.setdefault(table, {})
+            for c in columns:
+                cols.pop(c, None)
+            cols["+".join(sorted(columns))] = mask
+        return boolean_filter
+
+    raise SyntaxError(f"Argumento de CALCULATE não suportado: {node!r}")
+
+
+def _column_refs(node) -> List[ColumnRef]:
+    if isinstance(node, ColumnRef):
+        return [node]
+    if isinstance(node, BinOp):
+        return _column_refs(node.left) + _column_refs(node.right)
+    if isinstance(node, Neg):
+        return _column_refs(node.operand)
+    return []
+
+
+def _compile_row(node, table: str) -> Callable[[EvalContext], Any]:
+    """
+    Compila expressão de linha (condição do FILTER) vetorizada sobre todas
+    as linhas da tabela. Agregações e medidas são escalares do contexto externo.
+    """
+    if isinstance(node, ColumnRef):
+        if node.table != table:
+            raise SyntaxError(f"Coluna de outra tabela no FILTER: {node.table}[{node.column}]")
+        col = node.column
+        return lambda ctx: ctx.store.column(table, col)
+    if isinstance(node, BinOp):
+        left, right, op = _compile_row(node.left, table), _compile_row(node.right, table), node.op
+        if op in LOGICAL_OPS:
+            return lambda ctx: _compare(op, left(ctx), right(ctx))
+
+        def arith(ctx):
+            a, b = left(ctx), right(ctx)
+            a = np.nan if a is None else a
+            b = np.nan if b is None else b
+            if op == "/":
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    return np.divide(a, b)
+            return {"+": np.add, "-": np.subtract, "*": np.multiply}[op](a, b)
+        return arith
+    if isinstance(node, Neg):
+        inner = _compile_row(node.operand, table)
+        return lambda ctx: -inner(ctx)
+    return compile_node(node)
+
+
+def _eval_measure(ctx: EvalContext, name: str):
+    if name not in ctx.measures:
+        raise KeyError(f"Medida não encontrada: [{name}]")
+    if name in ctx._measure_stack:
+        raise RecursionError(f"Referência circular na medida [{name}]")
+    ctx._measure_stack.append(name)
+    try:
+        return compile_expression(ctx.measures[name])(ctx)
+    finally:
+        ctx._measure_stack.pop()
+
+
+@lru_cache(maxsize=2048)
+def compile_expression(expression: str) -> Callable[[EvalContext], Any]:
+    """Compila a expressão uma única vez; chamadas seguintes reutilizam o plano"""
+    return compile_node(parse_expression(expression))
+
+
+def evaluate(expression: str, store: ColumnStore, measures: Optional[Dict[str, str]] = None,
+             filters: Optional[Dict[str, Dict[str, np.ndarray]]] = None, joins=None) -> Any:
+    """Avalia uma expressão DAX sobre o ColumnStore"""
+    return compile_expression(expression)(EvalContext(store, measures, filters, joins=joins))
+
+
+# ============================================
+# PLANO AGRUPADO (medida por valor de uma coluna)
+# ============================================
+class GroupIndex:
+    """Códigos de grupo por linha (chaves ordenadas) — calculado uma vez por avaliação"""
+
+    def __init__(self, store: ColumnStore, table: str, column: str):
+        self.table = table
+        self.column = column
+        codes, keys = pd.factorize(store.column(table, column), sort=True)
+        self.codes = codes
+        self.keys = np.asarray(keys)
+        self.n = len(keys)
+
+
+def _grouped_agg(name: str, values: np.ndarray, codes: np.ndarray, n: int) -> np.ndarray:
+    """Agregação por grupo em uma passada (bincount / groupby)"""
+    notnull = ~pd.isna(values)
+    valid = (codes >= 0) & notnull
+    codes, values = codes[valid], values[valid]
+    counts = np.bincount(codes, minlength=n).astype(np.float64)
+
+    if name == "COUNT":
+        return counts
+    if name in ("SUM", "AVERAGE"):
+        sums = np.bincount(codes, weights=values.astype(np.float64), minlength=n)
+        if name == "SUM":
+            return np.where(counts > 0, sums, np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / counts
+
+    grouped = pd.Series(values).groupby(codes)
+    if name == "DISTINCTCOUNT":
+        result = grouped.nunique()
+        return result.reindex(range(n), fill_value=0).to_numpy(dtype=np.float64)
+    result = grouped.min() if name == "MIN" else grouped.max()
+    return result.reindex(range(n)).to_numpy()
+
+
+def _compile_grouped(node, table: str, column: str) -> Callable[[EvalContext, GroupIndex], np.ndarray]:
+    """
+    Compila a medida para avaliação agrupada por table[column].
+    Padrões reconhecidos rodam em uma passada ordenada; o restante cai no
+    fallback (avaliação escalar por grupo).
+    """
+    if isinstance(node, Number):
+        value = node.value
+        return lambda ctx, G: np.full(G.n, value, dtype=np.float64)
+
+    if isinstance(node, Neg):
+        inner = _compile_grouped(node.operand, table, column)
+        return lambda ctx, G: -inner(ctx, G)
+
+    if isinstance(node, BinOp) and node.op in ("+", "-", "*", "/"):
+        left, right, op = _compile_grouped(node.left, table, column), _compile_grouped(node.right, table, column), node.op
+
+        def arith(ctx, G):
+            a, b = left(ctx, G).astype(np.float64), right(ctx, G).astype(np.float64)
+            if op == "/":
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    return np.where(b != 0, a / b, np.nan)
+            return {"+": np.add, "-": np.subtract, "*": np.multiply}[op](a, b)
+        return arith
+
+    if isinstance(node, Call) and node.name == "DIVIDE" and len(node.args) == 2:
+        return _compile_grouped(BinOp("/", node.args[0], node.args[1]), table, column)
+
+    if isinstance(node, MeasureRef):
+        name = node.name
+
+        def measure(ctx, G):
+            if name in ctx._measure_stack:
+                raise RecursionError(f"Referência circular na medida [{name}]")
+            ctx._measure_stack.append(name)
+            try:
+                return compile_grouped_expression(ctx.measures[name], table, column)(ctx, G)
+            finally:
+                ctx._measure_stack.pop()
+        return measure
+
+    if isinstance(node, Call) and node.name in AGGREGATES:
+        agg_table, agg_column = _agg_target(node)
+        agg_name = node.name
+        fallback = _compile_fallback(node, table, column)
+
+        def aggregate(ctx, G):
+            # Agregação no fato agrupada por atributo da dimensão: códigos via relacionamento
+            codes = ctx.group_codes(agg_table, G)
+            if codes is None:
+                return fallback(ctx, G)
+            values = ctx.store.column(agg_table, agg_column)
+            mask = ctx.mask(agg_table)
+            if mask is not None:
+                codes = np.where(mask, codes, -1)
+            return _grouped_agg(agg_name, values, codes, G.n)
+        return aggregate
+
+    if isinstance(node, Call) and node.name == "CALCULATE" and len(node.args) == 2:
+        plan = _compile_cumulative(node, table, column) or _compile_dateadd(node, table, column)
+        if plan is not None:
+            return plan
+
+    return _compile_fallback(node, table, column)
+
+
+def _compile_cumulative(node: Call, table: str, column: str):
+    """
+    Total acumulado: CALCULATE(SUM|COUNT(T[c]), FILTER(ALL(T), T[k] <= MAX(T[k])))
+    agrupado por T[k] → agregação por grupo + cumsum (uma passada ordenada).
+    """
+    inner, modifier = node.args
+    if not (isinstance(inner, Call) and inner.name in ("SUM", "COUNT") and _agg_target(inner)[0] == table):
+        return None
+    if not (isinstance(modifier, Call) and modifier.name == "FILTER"):
+        return None
+    source, cond = modifier.args
+    if not (isinstance(source, Call) and source.name == "ALL" and _table_name(source.args[0]) == table):
+        return None
+    if not (isinstance(cond, BinOp) and cond.op in ("<=", "<", ">=", ">")):
+        return None
+    key = ColumnRef(table, column)
+    if not (cond.left == key and isinstance(cond.right, Call) and cond.right.name in ("MAX", "MIN")
+            and cond.right.args == (key,)):
+        return None
+
+    base = _compile_grouped(inner, table, column)
+    op = cond.op
+
+    def cumulative(ctx, G):
+        filters = ctx.copy_filters()
+        filters[table] = {ALL_MARKER: None}  # ALL(T)
+        values = np.nan_to_num(base(ctx.with_filters(filters), G))
+        if op in ("<=", "<"):
+            total = np.cumsum(values)
+            return total if op == "<=" else total - values
+        total = np.cumsum(values[::-1])[::-1]
+        return total if op == ">=" else total - values
+    return cumulative
+
+
+def _compile_dateadd(node: Call, table: str, column: str):
+    """
+    Período anterior/posterior: CALCULATE(expr, DATEADD(T[k], n, UNIDADE))
+    agrupado por T[k] → valor do grupo deslocado via searchsorted nas chaves ordenadas.
+    """
+    inner, modifier = node.args
+    if not (isinstance(modifier, Call) and modifier.name == "DATEADD"):
+        return None
+    col, n_node, unit_node = modifier.args
+    if col != ColumnRef(table, column):
+        return None
+    n, unit = int(_constant(n_node)), _constant(unit_node)
+    base = _compile_grouped(inner, table, column)
+
+    def shifted(ctx, G):
+        values = base(ctx, G).astype(np.float64)
+        target = _shift_keys(G.keys, n, unit)
+        idx = np.searchsorted(G.keys, target)
+        idx_clipped = np.minimum(idx, G.n - 1)
+        found = (idx < G.n) & (G.keys[idx_clipped] == target)
+        return np.where(found, values[idx_clipped], np.nan)
+    return shifted
+
+
+def _compile_fallback(node, table: str, column: str):
+    """Avaliação escalar para cada grupo (correta para qualquer expressão)"""
+    scalar = compile_node(node)
+
+    def per_group(ctx, G):
+        out = np.full(G.n, np.nan, dtype=object)
+        for g in range(G.n):
+            filters = ctx.copy_filters()
+            cols = filters.setdefault(table, {})
+            group_mask = G.codes == g
+            cols[column] = group_mask if column not in cols else cols[column] & group_mask
+            out[g] = scalar(ctx.with_filters(filters))
+        try:
+            return out.astype(np.float64)
+        except (TypeError, ValueError):
+            return out
+    return per_group
+
+
+@lru_cache(maxsize=2048)
+def compile_grouped_expression(expression: str, table: str, column: str):
+    return _compile_grouped(parse_expression(expression), table, column)
+
+
+# ============================================
+# CACHE DE PLANOS POR (MODELO, MEDIDA)
+# ============================================
+class MeasurePlan:
+    """Plano compilado de uma medida (escalar + agrupados por coluna)"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.scalar = compile_expression(expression)
+        self.grouped: Dict[tuple, Callable] = {}
+
+    def evaluate(self, ctx: EvalContext) -> Any:
+        return self.scalar(ctx)
+
+    def evaluate_grouped(self, ctx: EvalContext, table: str, column: str) -> tuple:
+        """Retorna (chaves ordenadas, valores) da medida por table[column]"""
+        key = (table, column)
+        if key not in self.grouped:
+            self.grouped[key] = compile_grouped_expression(self.expression, table, column)
+        G = GroupIndex(ctx.store, table, column)
+        values = self.grouped[key](ctx, G)
+        return G.keys, values
+
+
+class PlanCache:
+    """Planos compilados por (id do modelo, nome da medida)"""
+
+    def __init__(self):
+        self._plans: Dict[tuple, MeasurePlan] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_id: str, measure_name: str, expression: str) -> MeasurePlan:
+        key = (model_id, measure_name)
+        plan = self._plans.get(key)
+        if plan is None or plan.expression != expression:
+            plan = MeasurePlan(expression)
+            with self._lock:
+                self._plans[key] = plan
+        return plan
+
+    def invalidate(self, model_id: Optional[str] = None):
+        with self._lock:
+            if model_id is None:
+                self._plans.clear()
+            else:
+                for key in [k for k in self._plans if k[0] == model_id]:
+                    del self._plans[key]
+
+
+plan_cache = PlanCache()
@@ -2,13 +2,25 @@
 # ANALYSTIC.A — WORKSPACES & MULTI-USUÁRIO
 # Áreas de trabalho compartilhadas + Permissões
 # ============================================
-import json
 import os
+import sys
+import threading
 import uuid
 from datetime import datetime
 from typing import Dict, List, Optional
 from dataclasses import dataclass, asdict, field
 
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from persistence import VERSION_KEY, DocumentStore
+from db.invalidation import on_invalidate, publish_invalidation
+from models.workspace_index import (
+    find_public_dashboard, find_user_id, index_user, index_workspace,
+    public_token as token_from_url, sync_index, unindex_workspace, workspace_roles, workspace_summaries,
+)
+
 # ============================================
 # DIRETÓRIOS
 # ============================================
@@ -57,6 +69,7 @@ class Workspace:
     created_at: str = field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = field(default_factory=lambda: datetime.now().isoformat())
     settings: Dict = field(default_factory=dict)
+    version: int = 0  # versão em disco (concorrência otimista)
 
 
 @dataclass
@@ -90,81 +103,107 @@ def create_workspace(name: str, owner: str, description: str = "") -> Workspace:
     return workspace
 
 
+def _workspace_to_dict(workspace: Workspace) -> Dict:
+    return {
+        "id": workspace.id,
+        "name": workspace.name,
+        "description": workspace.description,
+        "owner": workspace.owner,
+        "permissions": [asdict(p) for p in workspace.permissions],
+        "dashboards": [asdict(d) for d in workspace.dashboards],
+        "datasets": workspace.datasets,
+        "created_at": workspace.created_at,
+        "updated_at": datetime.now().isoformat(),
+        "settings": workspace.settings
+    }
+
+
+def _workspace_from_dict(data: Dict) -> Workspace:
+    return Workspace(
+        id=data["id"],
+        name=data["name"],
+        description=data.get("description", ""),
+        owner=data["owner"],
+        permissions=[Permission(**p) for p in data.get("permissions", [])],
+        dashboards=[Dashboard(**d) for d in data.get("dashboards", [])],
+        datasets=data.get("datasets", []),
+        created_at=data["created_at"],
+        updated_at=data.get("updated_at", ""),
+        settings=data.get("settings", {}),
+        version=data.get(VERSION_KEY, 0)
+    )
+
+
+def _after_workspace_flush(workspace_id: str, data: Dict):
+    """Após gravar em disco: atualiza o índice e derruba permissões em cache"""
+    index_workspace(data, os.path.getmtime(WORKSPACE_STORE.path(workspace_id)))
+    invalidate_permissions(workspace_id)
+
+
+WORKSPACE_STORE = DocumentStore(WORKSPACES_DIR, on_flush=_after_workspace_flush)
+
+
 def save_workspace(workspace: Workspace) -> bool:
-    """Salva workspace no disco"""
+    """
+    Salva workspace no disco (escrita atômica). Falha se outro processo
+    gravou o workspace desde que ele foi carregado.
+    """
     try:
-        filepath = os.path.join(WORKSPACES_DIR, f"{workspace.id}.json")
-        data = {
-            "id": workspace.id,
-            "name": workspace.name,
-            "description": workspace.description,
-            "owner": workspace.owner,
-            "permissions": [asdict(p) for p in workspace.permissions],
-            "dashboards": [asdict(d) for d in workspace.dashboards],
-            "datasets": workspace.datasets,
-            "created_at": workspace.created_at,
-            "updated_at": datetime.now().isoformat(),
-            "settings": workspace.settings
-        }
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        workspace.version = WORKSPACE_STORE.save(
+            workspace.id, _workspace_to_dict(workspace),
+            expected_version=workspace.version
+        )
         return True
     except Exception as e:
         print(f"Error saving workspace: {e}")
         return False
 
 
+class _Rejected(Exception):
+    """Alteração recusada: nada é gravado"""
+
+
+def _update_workspace(workspace_id: str, change, defer: bool = False) -> Dict:
+    """
+    Leitura-modificação-escrita do workspace sob lock (sem perder
+    alterações concorrentes). `change(ws)` retorna o dict de resultado;
+    só grava se "success" for verdadeiro. defer=True agrupa edições
+    seguidas numa gravação (`change` é reaplicado ao gravar).
+    """
+    outcome = {}
+
+    def mutator(data: Dict):
+        ws = _workspace_from_dict(data)
+        outcome.update(change(ws))
+        if not outcome.get("success"):
+            raise _Rejected()
+        return _workspace_to_dict(ws)
+
+    if WORKSPACE_STORE.load(workspace_id) is None:
+        return {"success": False, "error": "Workspace não encontrado"}
+    try:
+        doc = WORKSPACE_STORE.update(workspace_id, mutator, defer=defer)
+        outcome["version"] = doc[VERSION_KEY]
+    except _Rejected:
+        pass
+    return outcome
+
+
 def load_workspace(workspace_id: str) -> Optional[Workspace]:
     """Carrega workspace do disco"""
     try:
-        filepath = os.path.join(WORKSPACES_DIR, f"{workspace_id}.json")
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        return Workspace(
-            id=data["id"],
-            name=data["name"],
-            description=data.get("description", ""),
-            owner=data["owner"],
-            permissions=[Permission(**p) for p in data.get("permissions", [])],
-            dashboards=[Dashboard(**d) for d in data.get("dashboards", [])],
-            datasets=data.get("datasets", []),
-            created_at=data["created_at"],
-            updated_at=data.get("updated_at", ""),
-            settings=data.get("settings", {})
-        )
+        data = WORKSPACE_STORE.load(workspace_id)
+        if data is None:
+            return None
+        return _workspace_from_dict(data)
     except Exception as e:
         print(f"Error loading workspace: {e}")
         return None
 
 
 def list_workspaces(user_id: str = None) -> List[Dict]:
-    """Lista workspaces (filtrado por usuário se especificado)"""
-    workspaces = []
-    
-    for filename in os.listdir(WORKSPACES_DIR):
-        if filename.endswith('.json'):
-            ws = load_workspace(filename[:-5])
-            if ws:
-                # Verifica se usuário tem acesso
-                has_access = user_id is None or ws.owner == user_id
-                if not has_access:
-                    for perm in ws.permissions:
-                        if perm.user_id == user_id:
-                            has_access = True
-                            break
-                
-                if has_access:
-                    workspaces.append({
-                        "id": ws.id,
-                        "name": ws.name,
-                        "description": ws.description,
-                        "owner": ws.owner,
-                        "dashboards_count": len(ws.dashboards),
-                        "updated_at": ws.updated_at
-                    })
-    
-    return workspaces
+    """Lista workspaces (filtrado por usuário se especificado) pelo índice"""
+    return workspace_summaries(user_id)
 
 
 def delete_workspace(workspace_id: str, user_id: str) -> Dict:
@@ -177,8 +216,9 @@ def delete_workspace(workspace_id: str, user_id: str) -> Dict:
         return {"success": False, "error": "Apenas o proprietário pode deletar"}
     
     try:
-        filepath = os.path.join(WORKSPACES_DIR, f"{workspace_id}.json")
-        os.remove(filepath)
+        WORKSPACE_STORE.delete(workspace_id)
+        unindex_workspace(workspace_id)
+        invalidate_permissions(workspace_id)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -195,6 +235,65 @@ ROLE_PERMISSIONS = {
     "viewer": ["read"]
 }
 
+ROLE_ACTIONS = {role: frozenset(actions) for role, actions in ROLE_PERMISSIONS.items()}
+
+
+# ============================================
+# CACHE DE PERMISSÕES
+# workspace → {user_id: role}, carregado de uma vez do índice.
+# Invalidado a cada save/delete do workspace (local + pub/sub entre
+# workers); o TTL só cobre mensagens perdidas.
+# ============================================
+PERMISSIONS_CACHE_TTL = float(os.getenv("PERMISSIONS_CACHE_TTL", "300"))
+PERMISSIONS_CHANNEL = "permissions"
+
+_permission_cache = LRUCache(max_entries=10000, ttl=PERMISSIONS_CACHE_TTL)
+# Geração por workspace (e global, para "limpar tudo"): uma leitura do
+# índice só entra no cache se nenhuma invalidação chegou durante ela
+_permission_generations: Dict[str, int] = {}
+_permission_epoch = 0
+_permission_lock = threading.Lock()
+
+
+def _permission_generation(workspace_id: str) -> tuple:
+    return _permission_epoch, _permission_generations.get(workspace_id, 0)
+
+
+def _workspace_roles(workspace_id: str) -> Dict[str, str]:
+    roles = _permission_cache.get(workspace_id)
+    if roles is None:
+        with _permission_lock:
+            generation = _permission_generation(workspace_id)
+        roles = workspace_roles(workspace_id)
+        with _permission_lock:
+            if _permission_generation(workspace_id) == generation:
+                _permission_cache.set(workspace_id, roles)
+    return roles
+
+
+def _drop_permissions(workspace_id: Optional[str]):
+    global _permission_epoch
+    with _permission_lock:
+        if workspace_id is None:
+            _permission_epoch += 1
+            _permission_generations.clear()
+            _permission_cache.clear()
+        else:
+            _permission_generations[workspace_id] = _permission_generations.get(workspace_id, 0) + 1
+            _permission_cache.delete(workspace_id)
+
+
+def invalidate_permissions(workspace_id: str):
+    _drop_permissions(workspace_id)
+    publish_invalidation(PERMISSIONS_CHANNEL, workspace_id)
+
+
+def _on_permissions_invalidated(workspace_id: Optional[str]):
+    _drop_permissions(workspace_id)
+
+
+on_invalidate(PERMISSIONS_CHANNEL, _on_permissions_invalidated)
+
 
 def add_user_to_workspace(
     workspace_id: str, 
@@ -203,34 +302,31 @@ def add_user_to_workspace(
     granted_by: str
 ) -> Dict:
     """Adiciona usuário ao workspace"""
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return {"success": False, "error": "Workspace não encontrado"}
-    
-    # Verifica se quem está adicionando tem permissão
-    has_permission = False
-    for perm in ws.permissions:
-        if perm.user_id == granted_by and perm.role in ["owner", "admin"]:
-            has_permission = True
-            break
-    
-    if not has_permission:
-        return {"success": False, "error": "Sem permissão para adicionar usuários"}
-    
-    # Verifica se usuário já existe
-    for perm in ws.permissions:
-        if perm.user_id == user_id:
-            return {"success": False, "error": "Usuário já está no workspace"}
-    
-    # Adiciona permissão
-    ws.permissions.append(Permission(
-        user_id=user_id,
-        role=role,
-        granted_by=granted_by
-    ))
-    
-    save_workspace(ws)
-    return {"success": True}
+    def change(ws: Workspace) -> Dict:
+        # Verifica se quem está adicionando tem permissão
+        has_permission = False
+        for perm in ws.permissions:
+            if perm.user_id == granted_by and perm.role in ["owner", "admin"]:
+                has_permission = True
+                break
+
+        if not has_permission:
+            return {"success": False, "error": "Sem permissão para adicionar usuários"}
+
+        # Verifica se usuário já existe
+        for perm in ws.permissions:
+            if perm.user_id == user_id:
+                return {"success": False, "error": "Usuário já está no workspace"}
+
+        # Adiciona permissão
+        ws.permissions.append(Permission(
+            user_id=user_id,
+            role=role,
+            granted_by=granted_by
+        ))
+        return {"success": True}
+
+    return _update_workspace(workspace_id, change)
 
 
 def remove_user_from_workspace(
@@ -239,56 +335,49 @@ def remove_user_from_workspace(
     removed_by: str
 ) -> Dict:
     """Remove usuário do workspace"""
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return {"success": False, "error": "Workspace não encontrado"}
-    
-    # Owner não pode ser removido
-    if user_id == ws.owner:
-        return {"success": False, "error": "Não é possível remover o proprietário"}
-    
-    # Verifica permissão de quem está removendo
-    has_permission = False
-    for perm in ws.permissions:
-        if perm.user_id == removed_by and perm.role in ["owner", "admin"]:
-            has_permission = True
-            break
-    
-    if not has_permission:
-        return {"success": False, "error": "Sem permissão para remover usuários"}
-    
-    # Remove
-    ws.permissions = [p for p in ws.permissions if p.user_id != user_id]
-    save_workspace(ws)
-    
-    return {"success": True}
+    def change(ws: Workspace) -> Dict:
+        # Owner não pode ser removido
+        if user_id == ws.owner:
+            return {"success": False, "error": "Não é possível remover o proprietário"}
+
+        # Verifica permissão de quem está removendo
+        has_permission = False
+        for perm in ws.permissions:
+            if perm.user_id == removed_by and perm.role in ["owner", "admin"]:
+                has_permission = True
+                break
+
+        if not has_permission:
+            return {"success": False, "error": "Sem permissão para remover usuários"}
+
+        # Remove
+        ws.permissions = [p for p in ws.permissions if p.user_id != user_id]
+        return {"success": True}
+
+    return _update_workspace(workspace_id, change)
 
 
 def check_permission(workspace_id: str, user_id: str, action: str) -> bool:
     """Verifica se usuário tem permissão para ação"""
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return False
-    
-    for perm in ws.permissions:
-        if perm.user_id == user_id:
-            allowed_actions = ROLE_PERMISSIONS.get(perm.role, [])
-            return action in allowed_actions
-    
-    return False
+    role = _workspace_roles(workspace_id).get(user_id)
+    return role is not None and action in ROLE_ACTIONS.get(role, ())
 
 
 def get_user_role(workspace_id: str, user_id: str) -> Optional[str]:
     """Retorna role do usuário no workspace"""
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return None
-    
-    for perm in ws.permissions:
-        if perm.user_id == user_id:
-            return perm.role
-    
-    return None
+    return _workspace_roles(workspace_id).get(user_id)
+
+
+def owns_dataset(user_id: str, table: str) -> bool:
+    """Usuário é owner de algum workspace que inclui a tabela nos datasets"""
+    table = table.strip().lower()
+    for summary in list_workspaces(user_id):
+        if summary.get("owner") != user_id:
+            continue
+        ws = load_workspace(summary["id"])
+        if ws and table in (d.strip().lower() for d in ws.datasets):
+            return True
+    return False
 
 
 # ============================================
@@ -304,21 +393,42 @@ def create_dashboard(
     """Cria dashboard no workspace"""
     if not check_permission(workspace_id, user_id, "write"):
         return {"success": False, "error": "Sem permissão"}
-    
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return {"success": False, "error": "Workspace não encontrado"}
-    
+
     dashboard = Dashboard(
         id=str(uuid.uuid4())[:8],
         name=name,
         description=description
     )
-    
-    ws.dashboards.append(dashboard)
-    save_workspace(ws)
-    
-    return {"success": True, "dashboard": asdict(dashboard)}
+
+    def change(ws: Workspace) -> Dict:
+        ws.dashboards.append(dashboard)
+        return {"success": True, "dashboard": asdict(dashboard)}
+
+    return _update_workspace(workspace_id, change)
+
+
+def update_dashboard_layout(
+    workspace_id: str,
+    dashboard_id: str,
+    layout: Dict,
+    user_id: str
+) -> Dict:
+    """
+    Atualiza o layout (tiles) do dashboard. Edições em sequência (arrastar,
+    redimensionar) são agrupadas pelo write-behind numa única gravação.
+    """
+    if not check_permission(workspace_id, user_id, "write"):
+        return {"success": False, "error": "Sem permissão"}
+
+    def change(ws: Workspace) -> Dict:
+        for dashboard in ws.dashboards:
+            if dashboard.id == dashboard_id:
+                dashboard.layout = layout
+                dashboard.updated_at = datetime.now().isoformat()
+                return {"success": True}
+        return {"success": False, "error": "Dashboard não encontrado"}
+
+    return _update_workspace(workspace_id, change, defer=True)
 
 
 def publish_dashboard(
@@ -330,52 +440,51 @@ def publish_dashboard(
     """Publica dashboard (gera link público)"""
     if not check_permission(workspace_id, user_id, "share"):
         return {"success": False, "error": "Sem permissão para publicar"}
-    
-    ws = load_workspace(workspace_id)
-    if not ws:
-        return {"success": False, "error": "Workspace não encontrado"}
-    
-    for dashboard in ws.dashboards:
-        if dashboard.id == dashboard_id:
-            dashboard.is_public = is_public
-            
-            if is_public:
-                # Gera URL pública
-                public_token = str(uuid.uuid4())[:12]
-                dashboard.public_url = f"/public/dashboard/{public_token}"
-                dashboard.embed_code = f'<iframe src="https://analystica.app{dashboard.public_url}" width="100%" height="600" frameborder="0"></iframe>'
-            else:
-                dashboard.public_url = ""
-                dashboard.embed_code = ""
-            
-            dashboard.updated_at = datetime.now().isoformat()
-            save_workspace(ws)
-            
-            return {
-                "success": True,
-                "public_url": dashboard.public_url,
-                "embed_code": dashboard.embed_code
-            }
-    
-    return {"success": False, "error": "Dashboard não encontrado"}
+
+    # Token gerado uma vez: `change` pode ser reaplicado numa nova tentativa
+    public_token = str(uuid.uuid4())[:12]
+
+    def change(ws: Workspace) -> Dict:
+        for dashboard in ws.dashboards:
+            if dashboard.id == dashboard_id:
+                dashboard.is_public = is_public
+
+                if is_public:
+                    # Gera URL pública
+                    dashboard.public_url = f"/public/dashboard/{public_token}"
+                    dashboard.embed_code = f'<iframe src="https://analystica.app{dashboard.public_url}" width="100%" height="600" frameborder="0"></iframe>'
+                else:
+                    dashboard.public_url = ""
+                    dashboard.embed_code = ""
+
+                dashboard.updated_at = datetime.now().isoformat()
+                return {
+                    "success": True,
+                    "public_url": dashboard.public_url,
+                    "embed_code": dashboard.embed_code
+                }
+        return {"success": False, "error": "Dashboard não encontrado"}
+
+    return _update_workspace(workspace_id, change)
 
 
 def get_public_dashboard(public_token: str) -> Optional[Dict]:
     """Recupera dashboard público pelo token"""
-    for filename in os.listdir(WORKSPACES_DIR):
-        if filename.endswith('.json'):
-            ws = load_workspace(filename[:-5])
-            if ws:
-                for dashboard in ws.dashboards:
-                    if dashboard.public_url and public_token in dashboard.public_url:
-                        if dashboard.is_public:
-                            return {
-                                "id": dashboard.id,
-                                "name": dashboard.name,
-                                "description": dashboard.description,
-                                "layout": dashboard.layout,
-                                "workspace_name": ws.name
-                            }
+    found = find_public_dashboard(token_from_url(public_token))
+    if not found:
+        return None
+
+    ws = load_workspace(found[0])
+    if ws:
+        for dashboard in ws.dashboards:
+            if dashboard.id == found[1] and dashboard.is_public:
+                return {
+                    "id": dashboard.id,
+                    "name": dashboard.name,
+                    "description": dashboard.description,
+                    "layout": dashboard.layout,
+                    "workspace_name": ws.name
+                }
     return None
 
 
@@ -394,12 +503,17 @@ def create_user_profile(email: str, name: str) -> UserProfile:
     return user
 
 
+def _after_user_flush(user_id: str, data: Dict):
+    index_user(data, os.path.getmtime(USER_STORE.path(user_id)))
+
+
+USER_STORE = DocumentStore(USERS_DIR, on_flush=_after_user_flush)
+
+
 def save_user_profile(user: UserProfile) -> bool:
     """Salva perfil do usuário"""
     try:
-        filepath = os.path.join(USERS_DIR, f"{user.id}.json")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(asdict(user), f, indent=2, ensure_ascii=False)
+        USER_STORE.save(user.id, asdict(user))
         return True
     except Exception as e:
         print(f"Error saving user: {e}")
@@ -407,18 +521,18 @@ def save_user_profile(user: UserProfile) -> bool:
 
 
 def get_user_by_email(email: str) -> Optional[UserProfile]:
-    """Busca usuário por email"""
-    for filename in os.listdir(USERS_DIR):
-        if filename.endswith('.json'):
-            try:
-                filepath = os.path.join(USERS_DIR, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if data.get("email") == email:
-                    return UserProfile(**data)
-            except:
-                continue
-    return None
+    """Busca usuário por email (índice → um único arquivo)"""
+    user_id = find_user_id(email)
+    if not user_id:
+        return None
+    try:
+        data = USER_STORE.load(user_id)
+    except ValueError:
+        return None
+    if not data or data.get("email") != email:
+        return None
+    data.pop(VERSION_KEY, None)
+    return UserProfile(**data)
 
 
 # ============================================
@@ -447,5 +561,6 @@ def init_default_workspace():
     return None
 
 
-# Inicializa ao importar
+# Inicializa ao importar (importa JSON ainda não indexados)
+sync_index(WORKSPACES_DIR, USERS_DIR)
 init_default_workspace()
@@ -0,0 +1,206 @@
+# ============================================
+# ANALYSTIC.A — ÍNDICE DE WORKSPACES (SQLite)
+# Índices secundários sobre os JSON de workspaces e usuários
+# ============================================
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+# Os arquivos JSON continuam sendo a fonte da verdade: o índice pode ser
+# apagado a qualquer momento e é reconstruído a partir deles.
+INDEX_PATH = os.getenv(
+    "WORKSPACE_INDEX_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "workspaces.db"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workspaces (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    owner TEXT,
+    dashboards_count INTEGER,
+    updated_at TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS workspace_members (
+    workspace_id TEXT,
+    user_id TEXT,
+    role TEXT,
+    PRIMARY KEY (workspace_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_members_user ON workspace_members (user_id);
+CREATE TABLE IF NOT EXISTS public_dashboards (
+    token TEXT PRIMARY KEY,
+    workspace_id TEXT,
+    dashboard_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_public_workspace ON public_dashboards (workspace_id);
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+"""
+
+_local = threading.local()
+
+
+def _conn() -> sqlite3.Connection:
+    """Uma conexão por thread (WAL: leitores não bloqueiam o escritor)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(INDEX_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def public_token(public_url: str) -> str:
+    """Token do link público (/public/dashboard/<token>)"""
+    return public_url.rstrip("/").rsplit("/", 1)[-1] if public_url else ""
+
+
+# ============================================
+# ESCRITA (chamada após gravar o JSON)
+# ============================================
+def index_workspace(data: Dict, mtime: Optional[float] = None):
+    """Atualiza o índice com o conteúdo (dict) de um workspace"""
+    ws_id = data["id"]
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO workspaces VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (ws_id, data.get("name", ""), data.get("description", ""), data.get("owner", ""),
+             len(data.get("dashboards", [])), data.get("updated_at", ""), mtime),
+        )
+        conn.execute("DELETE FROM workspace_members WHERE workspace_id = ?", (ws_id,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO workspace_members VALUES (?, ?, ?)",
+            [(ws_id, p["user_id"], p["role"]) for p in data.get("permissions", [])],
+        )
+        conn.execute("DELETE FROM public_dashboards WHERE workspace_id = ?", (ws_id,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO public_dashboards VALUES (?, ?, ?)",
+            [(public_token(d["public_url"]), ws_id, d["id"])
+             for d in data.get("dashboards", []) if d.get("is_public") and d.get("public_url")],
+        )
+
+
+def unindex_workspace(workspace_id: str):
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM workspaces WHERE id = ?", (workspace_id,))
+        conn.execute("DELETE FROM workspace_members WHERE workspace_id = ?", (workspace_id,))
+        conn.execute("DELETE FROM public_dashboards WHERE workspace_id = ?", (workspace_id,))
+
+
+def index_user(data: Dict, mtime: Optional[float] = None):
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?)", (data["id"], data.get("email", ""), mtime))
+
+
+# ============================================
+# CONSULTAS
+# ============================================
+def workspace_summaries(user_id: Optional[str] = None) -> List[Dict]:
+    """Resumo dos workspaces (todos, ou os que o usuário possui/participa)"""
+    columns = "w.id, w.name, w.description, w.owner, w.dashboards_count, w.updated_at"
+    if user_id is None:
+        rows = _conn().execute(f"SELECT {columns} FROM workspaces w ORDER BY w.id").fetchall()
+    else:
+        rows = _conn().execute(
+            f"SELECT {columns} FROM workspaces w WHERE w.owner = ? OR w.id IN "
+            f"(SELECT workspace_id FROM workspace_members WHERE user_id = ?) ORDER BY w.id",
+            (user_id, user_id),
+        ).fetchall()
+    keys = ("id", "name", "description", "owner", "dashboards_count", "updated_at")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def workspace_roles(workspace_id: str) -> Dict[str, str]:
+    """Todas as permissões do workspace: {user_id: role}"""
+    rows = _conn().execute(
+        "SELECT user_id, role FROM workspace_members WHERE workspace_id = ?", (workspace_id,)
+    ).fetchall()
+    return dict(rows)
+
+
+def find_public_dashboard(token: str) -> Optional[tuple]:
+    """(workspace_id, dashboard_id) do token público"""
+    row = _conn().execute(
+        "SELECT workspace_id, dashboard_id FROM public_dashboards WHERE token = ?", (token,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+def find_user_id(email: str) -> Optional[str]:
+    row = _conn().execute("SELECT id FROM users WHERE email = ? LIMIT 1", (email,)).fetchone()
+    return row[0] if row else None
+
+
+# ============================================
+# SINCRONIZAÇÃO COM OS ARQUIVOS JSON
+# ============================================
+def _sync_dir(directory: str, table: str, index_fn, remove_fn):
+    """Reindexa arquivos novos/alterados (por mtime) e remove os apagados"""
+    indexed = dict(_conn().execute(f"SELECT id, mtime FROM {table}").fetchall())
+    seen = set()
+    changed = 0
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".json"):
+            continue
+        obj_id = entry.name[:-5]
+        seen.add(obj_id)
+        mtime = entry.stat().st_mtime
+        if indexed.get(obj_id) == mtime:
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                index_fn(json.load(f), mtime)
+            changed += 1
+        except Exception as e:
+            print(f"Error indexing {entry.path}: {e}")
+
+    for obj_id in set(indexed) - seen:
+        remove_fn(obj_id)
+        changed += 1
+    return changed
+
+
+def _unindex_user(user_id: str):
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+
+def sync_index(workspaces_dir: str, users_dir: str) -> int:
+    """
+    Importa o layout JSON para o índice (primeira execução, arquivos
+    copiados manualmente ou gravados por versões antigas). Retorna o
+    número de entradas atualizadas.
+    """
+    return (
+        _sync_dir(workspaces_dir, "workspaces", index_workspace, unindex_workspace)
+        + _sync_dir(users_dir, "users", index_user, _unindex_user)
+    )
+
+
+def rebuild_index(workspaces_dir: str, users_dir: str) -> int:
+    """Descarta e reconstrói o índice inteiro a partir dos JSON"""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for table in ("workspaces", "workspace_members", "public_dashboards", "users"):
+            conn.execute(f"DELETE FROM {table}")
+    return sync_index(workspaces_dir, users_dir)
@@ -0,0 +1,290 @@
+# ============================================
+# file: persistence.py — documentos JSON seguros entre processos
+# Escrita atômica (temp + rename), locks, versões e write-behind
+# ============================================
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# fcntl só existe em POSIX: no Windows o lock é apenas entre threads
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# orjson é opcional (mais rápido); o formato é JSON compacto em ambos os casos
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VERSION_KEY = "_version"
+
+# Atraso padrão do write-behind: edições em sequência viram uma gravação
+WRITE_BEHIND_SECONDS = float(os.getenv("PERSIST_WRITE_BEHIND_MS", "500")) / 1000
+
+
+class ConflictError(Exception):
+    """O documento foi alterado por outro escritor desde a leitura"""
+
+
+# ============================================
+# SERIALIZAÇÃO
+# ============================================
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# ============================================
+# ESCRITA ATÔMICA E LOCKS
+# ============================================
+def atomic_write(path: str, data: bytes):
+    """
+    Grava em arquivo temporário no mesmo diretório, fsync e rename:
+    leitores veem o arquivo antigo ou o novo, nunca um parcial.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+_thread_locks: Dict[str, threading.RLock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path: str) -> threading.RLock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.RLock())
+
+
+@contextmanager
+def file_lock(path: str):
+    """Lock exclusivo do documento entre threads e entre processos (flock)"""
+    path = os.path.abspath(path)
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_document(path: str) -> Optional[dict]:
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def write_document(path: str, doc: dict, expected_version: Optional[int] = None) -> int:
+    """
+    Grava o documento com versão incrementada. Com `expected_version`,
+    falha com ConflictError se a versão em disco for outra (concorrência
+    otimista). Retorna a nova versão.
+    """
+    with file_lock(path):
+        current = read_document(path)
+        version = current.get(VERSION_KEY, 0) if current else 0
+        if expected_version is not None and expected_version != version:
+            raise ConflictError(f"{os.path.basename(path)}: versão {expected_version} != {version}")
+        doc[VERSION_KEY] = version + 1
+        atomic_write(path, dumps(doc))
+        return doc[VERSION_KEY]
+
+
+def update_document(path: str, mutator: Callable[[dict], Optional[dict]],
+                    default: Optional[Callable[[], dict]] = None) -> dict:
+    """
+    Leitura-modificação-escrita sob lock: `mutator` recebe o documento
+    atual (ou `default()` se não existir) e o altera no lugar ou retorna
+    um novo. Nenhuma atualização concorrente é perdida.
+    """
+    with file_lock(path):
+        doc = read_document(path)
+        if doc is None:
+            doc = default() if default else {}
+        version = doc.get(VERSION_KEY, 0)
+        result = mutator(doc)
+        doc = doc if result is None else result
+        doc[VERSION_KEY] = version + 1
+        atomic_write(path, dumps(doc))
+        return doc
+
+
+# ============================================
+# STORE DE DOCUMENTOS COM WRITE-BEHIND
+# ============================================
+class DocumentStore:
+    """
+    Um documento JSON por id em `directory`.
+
+    update(..., defer=True) aplica a alteração em memória e agenda a
+    gravação: edições seguidas do mesmo documento dentro de `delay`
+    segundos resultam em uma única escrita. Na gravação, as alterações
+    pendentes são reaplicadas sobre o documento em disco, sob lock (nada
+    gravado por outro processo nesse meio-tempo se perde). load() enxerga
+    as gravações pendentes do próprio processo. `on_flush(id, doc)` roda
+    após cada gravação em disco (índices, invalidação de caches).
+    """
+
+    def __init__(self, directory: str, delay: float = WRITE_BEHIND_SECONDS,
+                 on_flush: Optional[Callable[[str, dict], None]] = None):
+        self.directory = directory
+        self.delay = delay
+        self.on_flush = on_flush
+        self._pending: Dict[str, tuple] = {}   # id → (doc em memória, [mutators])
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        _stores.append(self)
+
+    def path(self, doc_id: str) -> str:
+        return os.path.join(self.directory, f"{doc_id}.json")
+
+    def load(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            pending = self._pending.get(doc_id)
+        if pending is not None:
+            return copy.deepcopy(pending[0])
+        return read_document(self.path(doc_id))
+
+    def ids(self) -> list:
+        """Ids em disco + pendentes de gravação"""
+        with self._lock:
+            pending = set(self._pending)
+        on_disk = {f[:-5] for f in os.listdir(self.directory) if f.endswith(".json")}
+        return sorted(on_disk | pending)
+
+    def version(self, doc_id: str) -> int:
+        doc = self.load(doc_id)
+        return doc.get(VERSION_KEY, 0) if doc else 0
+
+    def save(self, doc_id: str, doc: dict, expected_version: Optional[int] = None) -> int:
+        """Grava o documento inteiro; retorna a nova versão (ConflictError se mudou)"""
+        self.flush(doc_id)
+        version = write_document(self.path(doc_id), doc, expected_version)
+        self._after_flush(doc_id, doc)
+        return version
+
+    def update(self, doc_id: str, mutator: Callable[[dict], Optional[dict]],
+               default: Optional[Callable[[], dict]] = None, defer: bool = False) -> dict:
+        """
+        Leitura-modificação-escrita (ver update_document). Com defer=True,
+        `mutator` é aplicado já à cópia em memória e de novo ao documento
+        em disco na gravação; por isso deve poder rodar mais de uma vez.
+        """
+        if not defer or self.delay <= 0:
+            self.flush(doc_id)
+            doc = update_document(self.path(doc_id), mutator, default)
+            self._after_flush(doc_id, doc)
+            return doc
+
+        with self._lock:
+            pending = self._pending.get(doc_id)
+            if pending is not None:
+                doc, mutators = copy.deepcopy(pending[0]), pending[1]
+            else:
+                doc, mutators = read_document(self.path(doc_id)), []
+                if doc is None:
+                    doc = default() if default else {}
+            version = doc.get(VERSION_KEY, 0)
+            result = mutator(doc)
+            doc = doc if result is None else result
+            doc[VERSION_KEY] = version + 1
+            self._pending[doc_id] = (doc, mutators + [mutator])
+            if doc_id not in self._timers:
+                timer = threading.Timer(self.delay, self.flush, args=(doc_id,))
+                timer.daemon = True
+                self._timers[doc_id] = timer
+                timer.start()
+            return copy.deepcopy(doc)
+
+    def delete(self, doc_id: str):
+        with self._lock:
+            self._pending.pop(doc_id, None)
+            timer = self._timers.pop(doc_id, None)
+        if timer is not None:
+            timer.cancel()
+        path = self.path(doc_id)
+        with file_lock(path):
+            os.remove(path)
+
+    def flush(self, doc_id: Optional[str] = None):
+        """Grava pendências (todas, ou só de `doc_id`)"""
+        with self._lock:
+            ids = [doc_id] if doc_id is not None else list(self._pending)
+            items = []
+            for i in ids:
+                timer = self._timers.pop(i, None)
+                if timer is not None:
+                    timer.cancel()
+                if i in self._pending:
+                    items.append((i, *self._pending.pop(i)))
+
+        for i, view, mutators in items:
+            path = self.path(i)
+            with file_lock(path):
+                doc = read_document(path)
+                if doc is None:
+                    # Apagado por outro processo: grava a versão em memória
+                    doc = view
+                else:
+                    # Reaplica sobre o disco: inclui o que outros processos gravaram
+                    base_version = doc.get(VERSION_KEY, 0)
+                    try:
+                        for mutator in mutators:
+                            result = mutator(doc)
+                            doc = doc if result is None else result
+                    except Exception as e:
+                        print(f"Write-behind de {i} recusado sobre a versão em disco: {e}")
+                        continue
+                    # Mesma versão já devolvida aos chamadores, se ninguém gravou antes
+                    doc[VERSION_KEY] = max(base_version + 1, view.get(VERSION_KEY, 0))
+                atomic_write(path, dumps(doc))
+            self._after_flush(i, doc)
+
+    def _after_flush(self, doc_id: str, doc: dict):
+        if self.on_flush is not None:
+            try:
+                self.on_flush(doc_id, doc)
+            except Exception as e:
+                print(f"Error in on_flush for {doc_id}: {e}")
+
+
+_stores = []
+
+
+@atexit.register
+def _flush_all():
+    for store in _stores:
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"Error flushing {store.directory}: {e}")
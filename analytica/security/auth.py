@@ -7,112 +7,220 @@ from fastapi import Request
 from fastapi.responses import RedirectResponse
 import os
 import hashlib
-import json
+import threading
+import time
+from typing import Optional
+
+from cache import LRUCache
+from db.invalidation import on_invalidate, publish_invalidation
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+from security import crypto_service
+from security.crypto_service import hash_password, needs_rehash, verify_password
+from security.user_store import get_user_repository
 
 SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-# Arquivo para persistir usuários (em produção use um banco de dados)
-USERS_FILE = os.path.join(os.path.dirname(__file__), "users.json")
+# Tokens já verificados (chave = sha256 do token), válidos até o "exp"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKENS_CHANNEL = "tokens"
 
 
 def _hash_password(password: str) -> str:
-    """Hash simples de senha (em produção use bcrypt)"""
+    """Hash SHA-256 legado (usuários padrão; migrado para scrypt no login)"""
     return hashlib.sha256(password.encode()).hexdigest()
 
 
-def _load_users() -> dict:
-    """Carrega usuários do arquivo JSON"""
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    
-    # Usuários padrão
-    default_users = {
-        "admin@aliancia.com": {"password": _hash_password("123456"), "name": "Admin Aliança", "role": "admin"},
-        "admin@analystic.a": {"password": _hash_password("admin123"), "name": "Admin", "role": "admin"},
-        "demo@analystic.a": {"password": _hash_password("demo123"), "name": "Demo User", "role": "user"},
-    }
-    _save_users(default_users)
-    return default_users
-
-
-def _save_users(users: dict):
-    """Salva usuários no arquivo JSON"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+# Usuários padrão (criados no repositório se ainda não existirem)
+DEFAULT_USERS = {
+    "admin@aliancia.com": {"password": _hash_password("123456"), "name": "Admin Aliança", "role": "admin"},
+    "admin@analystic.a": {"password": _hash_password("admin123"), "name": "Admin", "role": "admin"},
+    "demo@analystic.a": {"password": _hash_password("demo123"), "name": "Demo User", "role": "user"},
+}
 
 
-# Carregar usuários ao iniciar
-USERS = _load_users()
+def _users():
+    """Repositório compartilhado entre workers/réplicas (USER_STORE)"""
+    return get_user_repository(seed=DEFAULT_USERS)
 
 
 def create_access_token(data: dict):
     to_encode = data.copy()
-    to_encode["exp"] = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    now = datetime.utcnow()
+    to_encode["iat"] = now
+    to_encode["exp"] = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
 def register_user(email: str, password: str, name: str) -> dict:
     """Registra um novo usuário"""
-    global USERS
-    
     email = email.lower().strip()
     
-    if email in USERS:
-        return {"success": False, "error": "E-mail já cadastrado"}
-    
-    USERS[email] = {
-        "password": _hash_password(password),
+    created = _users().create(email, {
+        "password": hash_password(password),
         "name": name,
         "role": "user",
         "created_at": datetime.utcnow().isoformat()
-    }
-    
-    _save_users(USERS)
+    })
+    if not created:
+        return {"success": False, "error": "E-mail já cadastrado"}
     
     return {"success": True, "message": "Usuário criado com sucesso"}
 
 
 def login_user(email: str, password: str):
     email = email.lower().strip()
-    user = USERS.get(email)
+    user = _users().get(email)
     
     if not user:
         return None
     
-    # Verificar senha (hash ou texto puro para retrocompatibilidade)
-    hashed = _hash_password(password)
-    if user["password"] != hashed and user["password"] != password:
+    # Verificar senha (scrypt, SHA-256 legado ou texto puro para retrocompatibilidade)
+    if not verify_password(password, user["password"]):
         return None
+    if needs_rehash(user["password"]):
+        _users().update(email, {"password": hash_password(password)})
 
     return create_access_token({"sub": email, "name": user.get("name", "User")})
 
 
+# ============================================
+# CACHE DE TOKENS VERIFICADOS + REVOGAÇÃO
+# Revogação compartilhada no Redis: token negado (logout) e
+# "revogado antes de" por usuário (troca de senha, compara com o iat).
+# Consultada só quando o token não está no cache; revogações derrubam
+# o cache de todos os workers via pub/sub.
+# ============================================
+_verified = LRUCache(max_entries=TOKEN_CACHE_SIZE)
+# Geração das revogações: uma verificação só entra no cache se nenhuma
+# revogação chegou entre a consulta e o set
+_revocation_generation = 0
+_revocation_lock = threading.Lock()
+_denied_local = LRUCache(max_entries=TOKEN_CACHE_SIZE)   # sem Redis: só este processo
+_revoked_before_local = {}
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _denied_key(digest: str) -> str:
+    return f"analytica:token:denied:{digest}"
+
+
+def _revoked_before_key(email: str) -> str:
+    return f"analytica:token:revoked_before:{email}"
+
+
+def _is_revoked(digest: str, payload: dict) -> bool:
+    r = get_redis()
+    if r is not None:
+        try:
+            denied, revoked_before = r.mget([_denied_key(digest), _revoked_before_key(payload.get("sub", ""))])
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            r = None
+    if r is None:
+        denied = _denied_local.get(digest)
+        revoked_before = _revoked_before_local.get(payload.get("sub", ""))
+    if denied:
+        return True
+    # iat tem resolução de segundos: tokens do mesmo segundo da revogação também caem
+    return revoked_before is not None and payload.get("iat", 0) <= int(revoked_before)
+
+
+def _drop_verified(digest: Optional[str] = None):
+    global _revocation_generation
+    with _revocation_lock:
+        _revocation_generation += 1
+        if digest is None:
+            _verified.clear()
+        else:
+            _verified.delete(digest)
+
+
+def _on_tokens_invalidated(key):
+    if key and key.startswith("token:"):
+        _drop_verified(key[len("token:"):])
+    else:
+        # Revogação por usuário (ou reconexão): reverifica todos os tokens
+        _drop_verified()
+
+
+on_invalidate(TOKENS_CHANNEL, _on_tokens_invalidated)
+
+
 def verify_token(token: str):
-    """Verifica e decodifica um token JWT"""
+    """Verifica e decodifica um token JWT (cacheado até expirar)"""
+    digest = _token_digest(token)
+    payload = _verified.get(digest)
+    if payload is not None:
+        return payload
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    with _revocation_lock:
+        generation = _revocation_generation
+    if _is_revoked(digest, payload):
+        return None
+
+    with _revocation_lock:
+        if _revocation_generation == generation:
+            _verified.set(digest, payload, expires_at=payload["exp"])
+    return payload
+
+
+def revoke_token(token: str):
+    """Logout: nega o token em todos os workers até ele expirar"""
+    payload = verify_token(token)
+    if payload is None:
+        return
+    digest = _token_digest(token)
+    ttl = max(1, int(payload["exp"] - time.time()))
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_denied_key(digest), "1", ex=ttl)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    _denied_local.set(digest, True, ttl=ttl)
+    _drop_verified(digest)
+    publish_invalidation(TOKENS_CHANNEL, f"token:{digest}")
+
+
+def revoke_user_tokens(email: str):
+    """Invalida todos os tokens do usuário emitidos até agora"""
+    email = email.lower().strip()
+    now = int(time.time())
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_revoked_before_key(email), now, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    _revoked_before_local[email] = now
+    _drop_verified()
+    publish_invalidation(TOKENS_CHANNEL, f"user:{email}")
 
 
 def get_current_user(request: Request):
-    """Retorna o usuário atual ou None se não autenticado"""
-    token = request.cookies.get("access_token")
-    if not token:
-        return None
+    """
+    Retorna o usuário atual ou None se não autenticado.
+    Resolvido uma vez por requisição (request.state.user).
+    """
+    if hasattr(request.state, "user"):
+        return request.state.user
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload["sub"]
-    except JWTError:
-        return None
+    token = request.cookies.get("access_token")
+    payload = verify_token(token) if token else None
+    request.state.user = payload["sub"] if payload else None
+    request.state.token_payload = payload
+    return request.state.user
 
 
 def get_current_user_or_redirect(request: Request):
@@ -125,7 +233,7 @@ def get_current_user_or_redirect(request: Request):
 
 def get_user_info(email: str) -> dict:
     """Retorna informações do usuário"""
-    user = USERS.get(email.lower().strip())
+    user = _users().get(email.lower().strip())
     if user:
         return {
             "email": email,
@@ -137,20 +245,33 @@ def get_user_info(email: str) -> dict:
 
 def change_password(email: str, old_password: str, new_password: str) -> dict:
     """Altera a senha do usuário"""
-    global USERS
     email = email.lower().strip()
     
-    user = USERS.get(email)
+    user = _users().get(email)
     if not user:
         return {"success": False, "error": "Usuário não encontrado"}
     
     # Verificar senha atual
-    hashed = _hash_password(old_password)
-    if user["password"] != hashed and user["password"] != old_password:
+    if not verify_password(old_password, user["password"]):
         return {"success": False, "error": "Senha atual incorreta"}
     
-    # Atualizar senha
-    USERS[email]["password"] = _hash_password(new_password)
-    _save_users(USERS)
+    # Atualizar senha e derrubar as sessões abertas com a senha antiga
+    _users().update(email, {"password": hash_password(new_password)})
+    revoke_user_tokens(email)
     
     return {"success": True, "message": "Senha alterada com sucesso"}
+
+
+# ============================================
+# VERSÕES ASYNC (KDF no pool de criptografia, fora do event loop)
+# ============================================
+async def login_user_async(email: str, password: str):
+    return await crypto_service.run(login_user, email, password)
+
+
+async def register_user_async(email: str, password: str, name: str) -> dict:
+    return await crypto_service.run(register_user, email, password, name)
+
+
+async def change_password_async(email: str, old_password: str, new_password: str) -> dict:
+    return await crypto_service.run(change_password, email, old_password, new_password)
@@ -1,9 +1,10 @@
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 import base64
 
+from security.crypto_service import aesgcm
+
 def encrypt_data(key: bytes, plaintext: str) -> str:
-    aes = AESGCM(key)
+    aes = aesgcm(key)
     nonce = os.urandom(12)
     ciphertext = aes.encrypt(nonce, plaintext.encode(), None)
     return base64.b64encode(nonce + ciphertext).decode()
@@ -12,5 +13,5 @@ def decrypt_data(key: bytes, encrypted: str) -> str:
     raw = base64.b64decode(encrypted)
     nonce = raw[:12]
     ciphertext = raw[12:]
-    aes = AESGCM(key)
+    aes = aesgcm(key)
     return aes.decrypt(nonce, ciphertext, None).decode()
@@ -0,0 +1,237 @@
+# ============================================
+# file: crypto_service.py — criptografia fora do event loop
+# KDF de senhas, RSA e AES-GCM em pool limitado + cache de chaves
+# ============================================
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from security.rsa_engine import generate_keys, rsa_sign
+
+# scrypt, RSA e AES-GCM (OpenSSL) liberam o GIL: threads bastam e evitam
+# serializar chaves/dados entre processos. O tamanho do pool limita quanta
+# CPU as operações lentas podem ocupar ao mesmo tempo.
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Custo do scrypt (n=2^14, r=8: ~16 MB e dezenas de ms por hash)
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Chaves RSA persistidas para que todos os workers usem o mesmo par
+RSA_KEY_DIR = os.getenv("RSA_KEY_DIR", os.path.join(os.path.dirname(__file__), "keys"))
+
+# Valores por tarefa enviada ao pool em encrypt_column/decrypt_column
+COLUMN_CHUNK = 5000
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+    return _executor
+
+
+async def run(fn: Callable, *args):
+    """Executa `fn(*args)` no pool de criptografia sem bloquear o event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_pool(), fn, *args)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+# ============================================
+# SENHAS (scrypt, com verificação dos formatos antigos)
+# ============================================
+def hash_password(password: str) -> str:
+    """Formato: scrypt$n$r$p$salt$hash (base64)"""
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return "scrypt${}${}${}${}${}".format(
+        SCRYPT_N, SCRYPT_R, SCRYPT_P,
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode(),
+    )
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """Aceita scrypt, SHA-256 hex (legado) e texto puro (retrocompatibilidade)"""
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, expected = stored.split("$")
+            digest = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt),
+                                    n=int(n), r=int(r), p=int(p), dklen=32)
+            expected = base64.b64decode(expected)
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest, expected)
+
+    # Em bytes: compare_digest recusa str com caracteres não-ASCII
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    return (hmac.compare_digest(stored.encode(), legacy.encode())
+            or hmac.compare_digest(stored.encode(), password.encode()))
+
+
+def needs_rehash(stored: str) -> bool:
+    """Hash legado ou com custo diferente do atual"""
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+async def hash_password_async(password: str) -> str:
+    return await run(hash_password, password)
+
+
+async def verify_password_async(password: str, stored: str) -> bool:
+    return await run(verify_password, password, stored)
+
+
+# ============================================
+# AES-GCM (instância cacheada por chave)
+# ============================================
+@lru_cache(maxsize=64)
+def aesgcm(key: bytes) -> AESGCM:
+    return AESGCM(key)
+
+
+def _encrypt_chunk(key: bytes, values: List) -> List[Optional[str]]:
+    aes = aesgcm(key)
+    out = []
+    for value in values:
+        if value is None:
+            out.append(None)
+            continue
+        nonce = os.urandom(12)
+        out.append(base64.b64encode(nonce + aes.encrypt(nonce, str(value).encode(), None)).decode())
+    return out
+
+
+def _decrypt_chunk(key: bytes, values: List) -> List[Optional[str]]:
+    aes = aesgcm(key)
+    out = []
+    for value in values:
+        if value is None:
+            out.append(None)
+            continue
+        raw = base64.b64decode(value)
+        out.append(aes.decrypt(raw[:12], raw[12:], None).decode())
+    return out
+
+
+def _chunks(values: Iterable) -> List[List]:
+    values = list(values)
+    return [values[i:i + COLUMN_CHUNK] for i in range(0, len(values), COLUMN_CHUNK)]
+
+
+def _null(value) -> bool:
+    # NaN/NaT de colunas pandas também contam como nulo
+    return value is None or value != value
+
+
+def encrypt_column(key: bytes, values: Iterable) -> List[Optional[str]]:
+    """
+    Criptografa uma coluna inteira (mesmo formato de crypto.encrypt_data),
+    em blocos paralelos no pool. Nulos continuam nulos.
+    """
+    parts = _pool().map(lambda chunk: _encrypt_chunk(key, chunk),
+                        _chunks(None if _null(v) else v for v in values))
+    return [v for part in parts for v in part]
+
+
+def decrypt_column(key: bytes, values: Iterable) -> List[Optional[str]]:
+    parts = _pool().map(lambda chunk: _decrypt_chunk(key, chunk),
+                        _chunks(None if _null(v) else v for v in values))
+    return [v for part in parts for v in part]
+
+
+async def encrypt_column_async(key: bytes, values: Iterable) -> List[Optional[str]]:
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(_pool(), _encrypt_chunk, key, chunk)
+        for chunk in _chunks(None if _null(v) else v for v in values)
+    ))
+    return [v for part in parts for v in part]
+
+
+async def decrypt_column_async(key: bytes, values: Iterable) -> List[Optional[str]]:
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(_pool(), _decrypt_chunk, key, chunk)
+        for chunk in _chunks(None if _null(v) else v for v in values)
+    ))
+    return [v for part in parts for v in part]
+
+
+# ============================================
+# RSA (par de chaves gerado uma vez e reutilizado)
+# ============================================
+_rsa_keys = {}
+_rsa_lock = threading.Lock()
+
+
+def _load_or_create_keypair(name: str):
+    path = os.path.join(RSA_KEY_DIR, f"{name}.pem")
+    try:
+        with open(path, "rb") as f:
+            private = serialization.load_pem_private_key(f.read(), password=None)
+        return private, private.public_key()
+    except FileNotFoundError:
+        pass
+
+    private, public = generate_keys()
+    os.makedirs(RSA_KEY_DIR, exist_ok=True)
+    pem = private.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    # Grava em temporário e publica com link (atômico, falha se já existir):
+    # se outro worker gravou primeiro, usa a chave dele
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        return _load_or_create_keypair(name)
+    finally:
+        os.unlink(tmp)
+    return private, public
+
+
+def get_rsa_keypair(name: str = "default"):
+    """(private, public) — carregado do disco ou gerado na primeira chamada"""
+    keys = _rsa_keys.get(name)
+    if keys is None:
+        with _rsa_lock:
+            keys = _rsa_keys.get(name)
+            if keys is None:
+                keys = _rsa_keys[name] = _load_or_create_keypair(name)
+    return keys
+
+
+async def get_rsa_keypair_async(name: str = "default"):
+    return await run(get_rsa_keypair, name)
+
+
+async def rsa_sign_async(message: str, name: str = "default") -> bytes:
+    private, _ = await get_rsa_keypair_async(name)
+    return await run(rsa_sign, private, message)
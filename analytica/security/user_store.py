@@ -0,0 +1,293 @@
+# ============================================
+# file: user_store.py — repositório de usuários compartilhado
+# Postgres / SQLite / Redis / arquivo + cache com TTL e invalidação
+# ============================================
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from cache import LRUCache
+from db.invalidation import on_invalidate, publish_invalidation
+from persistence import atomic_write, dumps, file_lock, read_document
+
+# Backend: file (users.json, padrão) | sqlite | postgres | redis
+USER_STORE = os.getenv("USER_STORE", "file").lower()
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+USERS_FILE = os.path.join(os.path.dirname(__file__), "users.json")
+USERS_DB = os.getenv("USERS_DB_PATH", os.path.join(os.path.dirname(__file__), "users.db"))
+
+USERS_CHANNEL = "users"
+
+
+class UserRepository(ABC):
+    """
+    Usuários por email (chave primária). Cada usuário é um dict
+    {"password", "name", "role", ...}.
+    """
+
+    @abstractmethod
+    def get(self, email: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def create(self, email: str, user: Dict) -> bool:
+        """Insere se o email ainda não existir (atômico). False se já existe."""
+
+    @abstractmethod
+    def update(self, email: str, fields: Dict) -> bool:
+        """Atualiza campos do usuário. False se não existe."""
+
+
+# ============================================
+# BACKENDS
+# ============================================
+class FileUserRepository(UserRepository):
+    """users.json (um host só; leitura-modificação-escrita sob flock)"""
+
+    def __init__(self, path: str = USERS_FILE):
+        self.path = path
+
+    def _read(self) -> Dict:
+        return read_document(self.path) or {}
+
+    def get(self, email):
+        return self._read().get(email)
+
+    def _change(self, change) -> bool:
+        with file_lock(self.path):
+            users = self._read()
+            if not change(users):
+                return False
+            atomic_write(self.path, dumps(users))
+            return True
+
+    def create(self, email, user):
+        def change(users):
+            if email in users:
+                return False
+            users[email] = user
+            return True
+        return self._change(change)
+
+    def update(self, email, fields):
+        def change(users):
+            if email not in users:
+                return False
+            users[email].update(fields)
+            return True
+        return self._change(change)
+
+
+class SQLiteUserRepository(UserRepository):
+    """Arquivo SQLite (vários workers no mesmo host)"""
+
+    def __init__(self, path: str = USERS_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, email):
+        row = self._conn().execute("SELECT data FROM users WHERE email = ?", (email,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, email, user):
+        cur = self._conn().execute("INSERT OR IGNORE INTO users VALUES (?, ?)", (email, json.dumps(user)))
+        return cur.rowcount == 1
+
+    def update(self, email, fields):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM users WHERE email = ?", (email,)).fetchone()
+            if not row:
+                return False
+            user = {**json.loads(row[0]), **fields}
+            conn.execute("UPDATE users SET data = ? WHERE email = ?", (json.dumps(user), email))
+            return True
+
+
+class PostgresUserRepository(UserRepository):
+    """Tabela app_users no Postgres (réplicas do k8s)"""
+
+    def __init__(self):
+        self._ready = False
+
+    def _connection(self):
+        from db.database import db_connection
+        return db_connection()
+
+    def _ensure_table(self, cur):
+        if not self._ready:
+            cur.execute("CREATE TABLE IF NOT EXISTS app_users (email TEXT PRIMARY KEY, data JSONB NOT NULL)")
+            self._ready = True
+
+    def get(self, email):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute("SELECT data FROM app_users WHERE email = %s", (email,))
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+        return row[0] if row else None
+
+    def create(self, email, user):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute(
+                "INSERT INTO app_users (email, data) VALUES (%s, %s::jsonb) ON CONFLICT (email) DO NOTHING",
+                (email, json.dumps(user)),
+            )
+            created = cur.rowcount == 1
+            conn.commit()
+            cur.close()
+        return created
+
+    def update(self, email, fields):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute(
+                "UPDATE app_users SET data = data || %s::jsonb WHERE email = %s",
+                (json.dumps(fields), email),
+            )
+            updated = cur.rowcount == 1
+            conn.commit()
+            cur.close()
+        return updated
+
+
+class RedisUserRepository(UserRepository):
+    """Um JSON por usuário em analytica:user:{email}"""
+
+    def _client(self):
+        from db.redis_client import get_redis
+        r = get_redis()
+        if r is None:
+            raise ConnectionError("Redis indisponível para o USER_STORE")
+        return r
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return f"analytica:user:{email}"
+
+    def get(self, email):
+        raw = self._client().get(self._key(email))
+        return json.loads(raw) if raw else None
+
+    def create(self, email, user):
+        return bool(self._client().set(self._key(email), json.dumps(user), nx=True))
+
+    def update(self, email, fields):
+        from redis.exceptions import WatchError
+        r = self._client()
+        key = self._key(email)
+        # WATCH/MULTI: falha e repete se outro worker alterar no meio
+        with r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    if not raw:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.set(key, json.dumps({**json.loads(raw), **fields}))
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+
+BACKENDS = {
+    "file": FileUserRepository,
+    "sqlite": SQLiteUserRepository,
+    "postgres": PostgresUserRepository,
+    "redis": RedisUserRepository,
+}
+
+
+# ============================================
+# REPOSITÓRIO COM CACHE (READ-THROUGH)
+# ============================================
+class CachedUserRepository(UserRepository):
+    """
+    Cache local com TTL curto na frente do backend. Escritas invalidam a
+    entrada local e avisam os outros workers/réplicas via pub/sub.
+    """
+
+    def __init__(self, backend: UserRepository, ttl: float = USER_CACHE_TTL):
+        self.backend = backend
+        self._cache = LRUCache(max_entries=10000, ttl=ttl)
+        on_invalidate(USERS_CHANNEL, self._on_invalidated)
+
+    def _on_invalidated(self, email: Optional[str]):
+        if email is None:
+            self._cache.clear()
+        else:
+            self._cache.delete(email)
+
+    def _invalidate(self, email: str):
+        self._cache.delete(email)
+        publish_invalidation(USERS_CHANNEL, email)
+
+    def get(self, email):
+        user = self._cache.get(email)
+        if user is None:
+            user = self.backend.get(email)
+            if user is not None:
+                self._cache.set(email, user)
+        return user
+
+    def create(self, email, user):
+        created = self.backend.create(email, user)
+        if created:
+            self._invalidate(email)
+        return created
+
+    def update(self, email, fields):
+        updated = self.backend.update(email, fields)
+        self._invalidate(email)
+        return updated
+
+
+def import_users(repo: UserRepository, users: Dict[str, Dict]) -> int:
+    """Importa usuários (ex.: users.json) sem sobrescrever os existentes"""
+    return sum(1 for email, user in users.items() if repo.create(email, user))
+
+
+_repo: Optional[UserRepository] = None
+_repo_lock = threading.Lock()
+
+
+def get_user_repository(seed: Optional[Dict[str, Dict]] = None) -> UserRepository:
+    """
+    Repositório configurado em USER_STORE (um por processo). Na criação,
+    importa users.json e os usuários `seed` que ainda não existirem.
+    """
+    global _repo
+    if _repo is None:
+        with _repo_lock:
+            if _repo is None:
+                if USER_STORE not in BACKENDS:
+                    raise ValueError(f"USER_STORE inválido: {USER_STORE}")
+                backend = BACKENDS[USER_STORE]()
+                if USER_STORE != "file" and os.path.exists(USERS_FILE):
+                    import_users(backend, read_document(USERS_FILE) or {})
+                if seed:
+                    import_users(backend, seed)
+                _repo = CachedUserRepository(backend)
+    return _repo
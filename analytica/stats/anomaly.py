@@ -0,0 +1,359 @@
+# ============================================
+# ANALYSTIC.A — DETECÇÃO DE ANOMALIAS
+# Incremental a cada lote ingerido: z-score robusto (mediana/MAD
+# móveis) em todas as colunas numéricas. Ao fim da carga: decomposição
+# sazonal da série agregada no tempo. Pontos marcados ficam em
+# analytica_anomalies (sobreposição em gráficos) e vão para o realtime.
+# ============================================
+import os
+import re
+import sys
+import warnings
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database import db_connection, quote_ident
+from persistence import atomic_write, dumps, file_lock, read_document
+
+ANOMALY_TABLE = "analytica_anomalies"
+
+# Janela móvel (pontos anteriores) e limiar do z-score robusto
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "100"))
+ANOMALY_MIN_PERIODS = 20
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "5.0"))
+# A decomposição sazonal estima a escala na série inteira: limiar menor
+SEASONAL_THRESHOLD = float(os.getenv("ANOMALY_SEASONAL_THRESHOLD", "3.5"))
+# Máximo de pontos por coluna e por lote (uma coluna ruidosa não inunda o banco)
+MAX_POINTS_PER_COLUMN = 200
+
+# Cauda de cada coluna guardada entre lotes (contexto da janela móvel)
+STATE_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "anomalies")
+
+MAD_SCALE = 1.4826   # MAD → desvio padrão (distribuição normal)
+
+
+# ============================================
+# SCORES VETORIZADOS (todas as colunas de uma vez)
+# ============================================
+def rolling_scores(frame: pd.DataFrame, window: int = ANOMALY_WINDOW,
+                   min_periods: int = ANOMALY_MIN_PERIODS) -> pd.DataFrame:
+    """
+    z robusto de cada ponto contra os `window` pontos anteriores:
+    (x - mediana) / (1.4826 · MAD). Com MAD zero (série quase constante),
+    usa o desvio padrão da janela.
+    """
+    previous = frame.shift(1)
+    median = previous.rolling(window, min_periods=min_periods).median()
+    mad = (previous - median).abs().rolling(window, min_periods=min_periods).median()
+    std = previous.rolling(window, min_periods=min_periods).std()
+    scale = (MAD_SCALE * mad).where(mad > 0, std)
+    return (frame - median) / scale.where(scale > 0)
+
+
+def seasonal_scores(frame: pd.DataFrame, period: int) -> pd.DataFrame:
+    """
+    Decomposição aditiva: tendência (média móvel centrada de um período),
+    sazonalidade (média do resíduo por fase) e z robusto do restante.
+    """
+    trend = frame.rolling(period, center=True, min_periods=period).mean()
+    detrended = frame - trend
+    phase = np.arange(len(frame)) % period
+    seasonal = detrended.groupby(phase).transform("mean")
+    resid = detrended - seasonal.to_numpy()
+    median = resid.median()
+    mad = (resid - median).abs().median()
+    return (resid - median) / (MAD_SCALE * mad).where(mad > 0)
+
+
+def _flagged(scores: pd.DataFrame, values: pd.DataFrame, x: pd.Series, kind: str,
+             threshold: float = ANOMALY_THRESHOLD) -> List[Dict]:
+    points = []
+    for col in scores.columns:
+        s = scores[col].to_numpy()
+        idx = np.flatnonzero(np.abs(np.nan_to_num(s)) > threshold)
+        if len(idx) > MAX_POINTS_PER_COLUMN:
+            idx = idx[np.argsort(-np.abs(s[idx]))[:MAX_POINTS_PER_COLUMN]]
+        for i in idx:
+            points.append({
+                "column": col,
+                "kind": kind,
+                "x": _x_value(x.iloc[i]),
+                "value": float(values[col].iloc[i]),
+                "score": round(float(s[i]), 3),
+            })
+    return points
+
+
+def _x_value(value) -> str:
+    if isinstance(value, (pd.Timestamp, datetime, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    return str(value)
+
+
+# ============================================
+# COLUNAS
+# ============================================
+def _numeric_columns(frame: pd.DataFrame) -> List[str]:
+    return [c for c in frame.columns
+            if pd.api.types.is_numeric_dtype(frame[c]) and not pd.api.types.is_bool_dtype(frame[c])]
+
+
+def _time_column(frame: pd.DataFrame) -> Optional[str]:
+    """Primeira coluna de data (tipada ou texto que converte por inteiro)"""
+    for col in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[col]):
+            return col
+    for col in frame.columns:
+        if pd.api.types.is_object_dtype(frame[col]) or pd.api.types.is_string_dtype(frame[col]):
+            sample = frame[col].dropna().head(50)
+            if not len(sample) or not isinstance(sample.iloc[0], str):
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                parsed = pd.to_datetime(sample, errors="coerce")
+            if parsed.notna().all():
+                return col
+    return None
+
+
+# ============================================
+# ESTADO ENTRE LOTES
+# ============================================
+def _state_path(table: str) -> str:
+    safe = re.sub(r"[^a-zA-Z0-9_.-]", "_", table)
+    return os.path.join(STATE_DIR, f"{safe}.json")
+
+
+def _load_state(table: str) -> Dict:
+    return read_document(_state_path(table)) or {"rows": 0, "x": [], "tail": {}}
+
+
+def save_state(table: str, state: Optional[Dict]):
+    """Grava a cauda do lote: só depois do commit do COPY (lote falho não avança)"""
+    if state is None:
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with file_lock(_state_path(table)):
+        atomic_write(_state_path(table), dumps(state))
+
+
+def reset_if_new(cur, table: str):
+    """
+    Antes da carga: tabela que ainda não existe (nova, ou apagada e
+    recriada) não herda cauda nem anomalias de uma tabela anterior.
+    """
+    cur.execute("SELECT to_regclass(%s)", (quote_ident(table),))
+    if cur.fetchone()[0] is not None:
+        return
+    try:
+        os.remove(_state_path(table))
+    except FileNotFoundError:
+        pass
+    cur.execute("SELECT to_regclass(%s)", (ANOMALY_TABLE,))
+    if cur.fetchone()[0] is not None:
+        cur.execute(f"DELETE FROM {ANOMALY_TABLE} WHERE table_name = %s", (table,))
+
+
+# ============================================
+# ARMAZENAMENTO
+# ============================================
+def _ensure_table(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ANOMALY_TABLE} (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            x TEXT NOT NULL,
+            value DOUBLE PRECISION,
+            score DOUBLE PRECISION,
+            detected_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {ANOMALY_TABLE}_lookup "
+                f"ON {ANOMALY_TABLE} (table_name, column_name, x)")
+
+
+def store_anomalies(cur, table: str, points: List[Dict]):
+    if not points:
+        return
+    from psycopg2.extras import execute_values
+    _ensure_table(cur)
+    execute_values(
+        cur,
+        f"INSERT INTO {ANOMALY_TABLE} (table_name, column_name, kind, x, value, score) VALUES %s",
+        [(table, p["column"], p["kind"], p["x"], p["value"], p["score"]) for p in points],
+    )
+
+
+def list_anomalies(table: str, column: Optional[str] = None, kind: Optional[str] = None,
+                   limit: int = 1000) -> List[Dict]:
+    """Pontos marcados da tabela (para sobrepor nos gráficos)"""
+    clauses, params = ["table_name = %s"], [table.strip().lower()]
+    if column:
+        clauses.append("column_name = %s")
+        params.append(column.strip().lower())
+    if kind:
+        clauses.append("kind = %s")
+        params.append(kind)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass(%s)", (ANOMALY_TABLE,))
+        if cur.fetchone()[0] is None:
+            cur.close()
+            return []
+        cur.execute(
+            f"SELECT column_name, kind, x, value, score, detected_at FROM {ANOMALY_TABLE} "
+            f"WHERE {' AND '.join(clauses)} ORDER BY x LIMIT %s",
+            params + [limit],
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    return [
+        {"column": c, "kind": k, "x": x, "value": v, "score": s, "detected_at": d.isoformat()}
+        for c, k, x, v, s, d in rows
+    ]
+
+
+# ============================================
+# INCREMENTAL (A CADA LOTE)
+# ============================================
+def detect_batch(cur, table: str, batch: pd.DataFrame) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    Marca os pontos anômalos do lote recém-copiado, usando a cauda dos
+    lotes anteriores como contexto da janela. Grava os pontos na mesma
+    transação do COPY e retorna (pontos, nova cauda); após o commit o
+    chamador grava a cauda (save_state) e publica os pontos.
+    """
+    state = _load_state(table)
+    time_col = state.get("time_column") or _time_column(batch)
+    columns = _numeric_columns(batch)
+    if not columns:
+        return [], None
+
+    frame = batch[columns].astype(np.float64)
+    if time_col and time_col in batch.columns:
+        x = pd.to_datetime(batch[time_col], errors="coerce")
+    else:
+        time_col = None
+        x = pd.Series(np.arange(state["rows"], state["rows"] + len(batch)))
+    frame.index = range(len(frame))
+    x.index = frame.index
+
+    # Contexto: cauda dos lotes anteriores antes do lote atual
+    # (coluna nova no lote: sem histórico, NaN na cauda)
+    tail = pd.DataFrame({c: pd.Series(state["tail"].get(c, []), dtype=np.float64) for c in columns},
+                        index=range(len(state["x"])))
+    combined = pd.concat([tail, frame], ignore_index=True)
+    if time_col is not None:
+        tail_x = pd.to_datetime(pd.Series(state["x"], dtype=object), errors="coerce")
+        order = np.argsort(pd.concat([tail_x, x], ignore_index=True).to_numpy(), kind="stable")
+    else:
+        order = np.arange(len(combined))
+    scores = rolling_scores(combined.iloc[order].reset_index(drop=True))
+
+    # Só os pontos do lote atual são marcados
+    is_new = (order >= len(tail))
+    new_rows = order[is_new] - len(tail)
+    points = _flagged(scores[is_new].reset_index(drop=True),
+                      frame.iloc[new_rows].reset_index(drop=True),
+                      x.iloc[new_rows].reset_index(drop=True), "rolling")
+
+    ordered = combined.iloc[order]
+    ordered_x = pd.concat([pd.Series(state["x"], dtype=object), x.map(_x_value)],
+                          ignore_index=True).iloc[order]
+    state = {
+        "time_column": time_col,
+        "rows": state["rows"] + len(batch),
+        "x": ordered_x.iloc[-ANOMALY_WINDOW:].tolist(),
+        "tail": {c: ordered[c].iloc[-ANOMALY_WINDOW:].where(ordered[c].iloc[-ANOMALY_WINDOW:].notna(), None).tolist()
+                 for c in columns},
+    }
+
+    cur.execute("SAVEPOINT anomaly_store")
+    try:
+        store_anomalies(cur, table, points)
+        cur.execute("RELEASE SAVEPOINT anomaly_store")
+    except Exception as e:
+        print(f"Anomalias {table}: falha ao gravar ({e})")
+        cur.execute("ROLLBACK TO SAVEPOINT anomaly_store")
+        return [], state
+    return points, state
+
+
+# ============================================
+# SAZONAL (AO FIM DA CARGA, SOBRE A SÉRIE AGREGADA)
+# ============================================
+# date_trunc → frequência pandas (início do período, como o Postgres)
+_BUCKET_FREQ = {"hour": "h", "day": "D", "month": "MS"}
+
+
+def _bucket_for_span(span: pd.Timedelta) -> tuple:
+    """(date_trunc, período da estação) conforme o intervalo coberto"""
+    if span <= pd.Timedelta(days=31):
+        return "hour", 24
+    if span <= pd.Timedelta(days=3 * 365):
+        return "day", 7
+    return "month", 12
+
+
+def detect_seasonal(table: str) -> List[Dict]:
+    """
+    Agrega as colunas numéricas por período no Postgres, decompõe e
+    substitui as anomalias sazonais da tabela. Retorna só os pontos novos.
+    """
+    state = _load_state(table)
+    time_col = state.get("time_column")
+    columns = list(state.get("tail", {}))
+    if not time_col or not columns:
+        return []
+
+    t = quote_ident(time_col)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT min({t}::timestamp), max({t}::timestamp) FROM {quote_ident(table)}")
+        lo, hi = cur.fetchone()
+        if lo is None:
+            cur.close()
+            return []
+        bucket, period = _bucket_for_span(pd.Timestamp(hi) - pd.Timestamp(lo))
+        sums = ", ".join(f"SUM({quote_ident(c)})" for c in columns)
+        cur.execute(
+            f"SELECT date_trunc(%s, {t}::timestamp) AS b, {sums} FROM {quote_ident(table)} "
+            f"WHERE {t} IS NOT NULL GROUP BY 1 ORDER BY 1",
+            (bucket,),
+        )
+        rows = cur.fetchall()
+
+        # GROUP BY só devolve períodos com linhas: completa a grade (soma 0)
+        # para que a fase (posição % período) corresponda ao calendário
+        frame = pd.DataFrame(rows, columns=["b"] + columns).set_index("b")
+        frame.index = pd.to_datetime(frame.index)
+        frame = frame.astype(np.float64)
+        if len(frame):
+            grid = pd.date_range(frame.index.min(), frame.index.max(), freq=_BUCKET_FREQ[bucket])
+            frame = frame.reindex(grid, fill_value=0.0)
+        if len(frame) < 2 * period:
+            conn.commit()
+            cur.close()
+            return []
+
+        x = frame.index.to_series(index=range(len(frame)))
+        frame = frame.reset_index(drop=True)
+        points = _flagged(seasonal_scores(frame, period), frame, x, "seasonal", SEASONAL_THRESHOLD)
+
+        _ensure_table(cur)
+        cur.execute(f"SELECT column_name, x FROM {ANOMALY_TABLE} WHERE table_name = %s AND kind = 'seasonal'",
+                    (table,))
+        previous = set(cur.fetchall())
+        cur.execute(f"DELETE FROM {ANOMALY_TABLE} WHERE table_name = %s AND kind = 'seasonal'", (table,))
+        store_anomalies(cur, table, points)
+        conn.commit()
+        cur.close()
+    return [p for p in points if (p["column"], p["x"]) not in previous]
@@ -0,0 +1,345 @@
+# ============================================
+# ANALYSTIC.A — PREVISÃO DE SÉRIES TEMPORAIS
+# Holt-Winters, sazonal ingênuo e tendência linear com intervalos,
+# vetorizados em NumPy sobre várias séries ao mesmo tempo (ex.: uma
+# por produto). Escolha do método por backtest; cache pela versão.
+# ============================================
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from db.data_version import get_table_version
+from db.database import db_connection, quote_ident
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+# Frequência → (período pandas, tamanho da estação)
+FREQS = {
+    "day": ("D", 7),
+    "week": ("W", 52),
+    "month": ("M", 12),
+    "quarter": ("Q", 4),
+}
+AGGREGATIONS = {"sum": "SUM", "avg": "AVG", "count": "COUNT"}
+
+METHODS = ("holt_winters", "seasonal_naive", "linear")
+
+Z_95 = 1.959964
+
+FORECAST_MAX_SERIES = int(os.getenv("FORECAST_MAX_SERIES", "2000"))
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "2"))
+# Abaixo disso o custo de enviar dados ao process pool não compensa
+FORECAST_PARALLEL_MIN = 256
+FORECAST_CACHE_TTL = 24 * 3600
+
+# Grade de parâmetros do Holt-Winters (todas ajustadas de uma vez)
+HW_ALPHAS = (0.1, 0.3, 0.5, 0.8)
+HW_BETAS = (0.01, 0.1, 0.3)
+HW_GAMMAS = (0.05, 0.2, 0.5)
+
+_local = LRUCache(max_entries=128, ttl=FORECAST_CACHE_TTL)
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+# ============================================
+# MÉTODOS (Y: matriz séries × períodos)
+# Cada um retorna (previsão, desvio padrão) com forma séries × h
+# ============================================
+def linear_trend(Y: np.ndarray, h: int):
+    """Mínimos quadrados por série, com intervalo de previsão clássico"""
+    n, T = Y.shape
+    t = np.arange(T, dtype=np.float64)
+    t_mean = t.mean()
+    stt = ((t - t_mean) ** 2).sum()
+    y_mean = Y.mean(axis=1, keepdims=True)
+    slope = ((Y - y_mean) * (t - t_mean)).sum(axis=1, keepdims=True) / stt
+    intercept = y_mean - slope * t_mean
+    resid = Y - (intercept + slope * t)
+    sigma = np.sqrt((resid ** 2).sum(axis=1, keepdims=True) / max(T - 2, 1))
+
+    future = np.arange(T, T + h, dtype=np.float64)
+    mean = intercept + slope * future
+    std = sigma * np.sqrt(1 + 1 / T + (future - t_mean) ** 2 / stt)
+    return mean, std
+
+
+def seasonal_naive(Y: np.ndarray, h: int, m: int):
+    """Repete a última estação; desvio das diferenças sazonais"""
+    n, T = Y.shape
+    if T <= m:
+        m = 1
+    last = Y[:, T - m:]
+    mean = last[:, np.arange(h) % m]
+    diffs = Y[:, m:] - Y[:, :-m]
+    sigma = np.sqrt((diffs ** 2).mean(axis=1, keepdims=True)) if diffs.shape[1] else np.zeros((n, 1))
+    k = np.arange(h) // m + 1
+    return mean, sigma * np.sqrt(k)
+
+
+def holt_winters(Y: np.ndarray, h: int, m: int):
+    """
+    Holt-Winters aditivo. Todas as combinações da grade são ajustadas em
+    paralelo (arrays combinações × séries); cada série fica com a de
+    menor erro quadrático um passo à frente. Sem duas estações
+    completas, vira Holt (tendência sem sazonalidade).
+    """
+    n, T = Y.shape
+    seasonal = T >= 2 * m
+    gammas = HW_GAMMAS if seasonal else (0.0,)
+    grid = np.array([(a, b, g) for a in HW_ALPHAS for b in HW_BETAS for g in gammas])
+    alpha, beta, gamma = (grid[:, i:i + 1] for i in range(3))   # combinações × 1
+    C = len(grid)
+
+    # Estado inicial no fim da primeira estação (t = m-1); a recursão
+    # começa em t = m. Sazonalidade inicial sem a tendência dentro da estação.
+    if seasonal:
+        first, second = Y[:, :m].mean(axis=1), Y[:, m:2 * m].mean(axis=1)
+        slope = (second - first) / m
+        offsets = np.arange(m) - (m - 1) / 2
+        level = np.broadcast_to(first + slope * (m - 1) / 2, (C, n)).copy()
+        trend = np.broadcast_to(slope, (C, n)).copy()
+        season = np.broadcast_to(Y[:, :m] - (first[:, None] + slope[:, None] * offsets),
+                                 (C, n, m)).copy()
+    else:
+        m = 1
+        level = np.broadcast_to(Y[:, 0], (C, n)).copy()
+        trend = np.broadcast_to(Y[:, 1] - Y[:, 0] if T > 1 else np.zeros(n), (C, n)).copy()
+        season = np.zeros((C, n, 1))
+    start = m if seasonal else 1
+
+    sse = np.zeros((C, n))
+    for t in range(start, T):
+        y = Y[:, t]
+        s = season[:, :, t % m]
+        err = y - (level + trend + s)
+        sse += err ** 2
+        new_level = alpha * (y - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        season[:, :, t % m] = gamma * (y - new_level) + (1 - gamma) * s
+        level = new_level
+
+    best = sse.argmin(axis=0)                      # combinação por série
+    rows = np.arange(n)
+    level, trend, season = level[best, rows], trend[best, rows], season[best, rows]
+    a, b, g = grid[best].T
+    sigma = np.sqrt(sse[best, rows] / max(T - start, 1))
+
+    k = np.arange(1, h + 1)
+    mean = level[:, None] + trend[:, None] * k + season[:, (T + k - 1) % m]
+    # Variância do erro em h passos (modelo aditivo): σ²(1 + Σ c_j²),
+    # c_j = α(1 + jβ) + γ·[j múltiplo de m]
+    j = np.arange(1, h)
+    c = a[:, None] * (1 + j * b[:, None]) + g[:, None] * (j % m == 0)
+    var = np.concatenate([np.zeros((n, 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+    std = sigma[:, None] * np.sqrt(1 + var)
+    return mean, std
+
+
+def _run(method: str, Y: np.ndarray, h: int, m: int):
+    if method == "holt_winters":
+        return holt_winters(Y, h, m)
+    if method == "seasonal_naive":
+        return seasonal_naive(Y, h, m)
+    return linear_trend(Y, h)
+
+
+def forecast_block(Y: np.ndarray, h: int, m: int) -> Dict[str, np.ndarray]:
+    """
+    Previsão de um bloco de séries. O método de cada série é o de menor
+    erro absoluto médio num backtest (últimos k períodos fora do ajuste).
+    """
+    n, T = Y.shape
+    k = min(h, max(1, T // 5))
+    mae = np.full((len(METHODS), n), np.inf)
+    if T - k >= 4:
+        train, test = Y[:, :-k], Y[:, -k:]
+        for i, method in enumerate(METHODS):
+            mean, _ = _run(method, train, k, m)
+            mae[i] = np.abs(mean - test).mean(axis=1)
+        choice = mae.argmin(axis=0)
+    else:
+        choice = np.full(n, METHODS.index("linear"))
+
+    mean = np.empty((n, h))
+    std = np.empty((n, h))
+    for i, method in enumerate(METHODS):
+        rows = choice == i
+        if rows.any():
+            mean[rows], std[rows] = _run(method, Y[rows], h, m)
+    return {"mean": mean, "std": std, "choice": choice, "mae": mae}
+
+
+def _forecast_block_args(args):
+    return forecast_block(*args)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=FORECAST_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    """Encerra o process pool (chamado no shutdown da aplicação)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def forecast_matrix(Y: np.ndarray, h: int, m: int) -> Dict[str, np.ndarray]:
+    """Muitas séries: blocos em paralelo no process pool"""
+    n = Y.shape[0]
+    if n < FORECAST_PARALLEL_MIN or FORECAST_WORKERS <= 1:
+        return forecast_block(Y, h, m)
+    blocks = np.array_split(Y, FORECAST_WORKERS)
+    parts = list(_get_executor().map(_forecast_block_args, [(b, h, m) for b in blocks]))
+    return {
+        key: np.concatenate([p[key] for p in parts], axis=-1 if key == "mae" else 0)
+        for key in parts[0]
+    }
+
+
+# ============================================
+# SÉRIES A PARTIR DE UMA TABELA
+# ============================================
+def _ident(name: str) -> str:
+    return quote_ident(name.strip().lower())
+
+
+def load_series(table: str, date_column: str, value_column: str, group_by: Optional[str] = None,
+                freq: str = "month", agg: str = "sum"):
+    """
+    (rótulos, períodos, Y): agregação por período no Postgres e matriz
+    séries × períodos, com períodos sem dados preenchidos.
+    """
+    pandas_freq, _ = FREQS[freq]
+    group_expr = _ident(group_by) if group_by else "'total'"
+    # Cargas CSV guardam datas como TEXT: converte antes do date_trunc
+    date_expr = f"{_ident(date_column)}::timestamp"
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {group_expr} AS g, date_trunc(%s, {date_expr}) AS bucket, "
+            f"{AGGREGATIONS[agg]}({_ident(value_column)}) AS y "
+            f"FROM {_ident(table)} WHERE {_ident(date_column)} IS NOT NULL GROUP BY 1, 2",
+            (freq,),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+
+    frame = pd.DataFrame(rows, columns=["g", "bucket", "y"])
+    if frame.empty:
+        return [], pd.PeriodIndex([], freq=pandas_freq), np.empty((0, 0))
+    frame["y"] = pd.to_numeric(frame["y"], errors="coerce")
+    frame["period"] = pd.to_datetime(frame["bucket"], utc=True).dt.tz_localize(None).dt.to_period(pandas_freq)
+    wide = frame.pivot_table(index="g", columns="period", values="y", aggfunc="sum")
+
+    # Séries mais relevantes primeiro (maior total)
+    wide = wide.loc[wide.sum(axis=1).sort_values(ascending=False).index[:FORECAST_MAX_SERIES]]
+    periods = pd.period_range(wide.columns.min(), wide.columns.max(), freq=pandas_freq)
+    wide = wide.reindex(columns=periods)
+    # Soma/contagem: período sem linhas vale 0; média: repete o último valor
+    wide = wide.ffill(axis=1).bfill(axis=1) if agg == "avg" else wide.fillna(0.0)
+    return [str(g) for g in wide.index], periods, wide.to_numpy(dtype=np.float64)
+
+
+def _cache_key(table: str, version: int, params: Dict) -> str:
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:24]
+    return f"analytica:forecast:{table}:{version}:{digest}"
+
+
+def max_horizon_for(freq: str) -> int:
+    """Até duas estações à frente: além disso o intervalo não diz nada"""
+    return 2 * FREQS[freq][1]
+
+
+def forecast_table(table: str, date_column: str, value_column: str, group_by: Optional[str] = None,
+                   horizon: int = 3, freq: str = "month", agg: str = "sum") -> dict:
+    """Previsão das séries da tabela (cacheada até a próxima ingestão)"""
+    if freq not in FREQS:
+        raise ValueError(f"Frequência inválida: {freq}")
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Agregação inválida: {agg}")
+    max_horizon = max_horizon_for(freq)
+    if not 1 <= horizon <= max_horizon:
+        raise ValueError(f"Horizonte inválido: {horizon} (entre 1 e {max_horizon} para freq={freq})")
+    table = table.strip().lower()
+    params = {"date": date_column, "value": value_column, "group_by": group_by,
+              "horizon": horizon, "freq": freq, "agg": agg}
+    version = get_table_version(table)
+    key = _cache_key(table, version, params)
+
+    result = _local.get(key)
+    if result is not None:
+        return result
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(key)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            r = raw = None
+        if raw is not None:
+            result = json.loads(raw)
+            _local.set(key, result)
+            return result
+
+    labels, periods, Y = load_series(table, date_column, value_column, group_by, freq, agg)
+    result = {"table": table, "version": version, **params, "periods": [str(p) for p in periods],
+              "future": [], "series": []}
+    if len(labels) and Y.shape[1] >= 2:
+        _, season = FREQS[freq]
+        fitted = forecast_matrix(Y, horizon, season)
+        mean, std = fitted["mean"], fitted["std"]
+        result["future"] = [str(p) for p in pd.period_range(periods[-1] + 1, periods=horizon)]
+        for i, label in enumerate(labels):
+            result["series"].append({
+                "key": label,
+                "history": Y[i].round(6).tolist(),
+                "method": METHODS[fitted["choice"][i]],
+                "forecast": mean[i].round(6).tolist(),
+                "lower": (mean[i] - Z_95 * std[i]).round(6).tolist(),
+                "upper": (mean[i] + Z_95 * std[i]).round(6).tolist(),
+                "backtest_mae": {
+                    method: (float(fitted["mae"][j, i]) if np.isfinite(fitted["mae"][j, i]) else None)
+                    for j, method in enumerate(METHODS)
+                },
+            })
+
+    _local.set(key, result)
+    if r is not None:
+        try:
+            r.set(key, json.dumps(result), ex=FORECAST_CACHE_TTL)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    return result
+
+
+def forecast_to_text(result: dict, max_series: int = 5, max_history: int = 12) -> str:
+    """Resumo compacto da previsão para a IA narrar"""
+    lines = [f"Previsão de {result['agg']}({result['value']}) da tabela {result['table']} "
+             f"por {result['freq']}, próximos {result['horizon']} períodos (intervalo de 95%):"]
+    for s in result["series"][:max_series]:
+        history = list(zip(result["periods"], s["history"]))[-max_history:]
+        lines.append(f"- {s['key']} (método {s['method']}): histórico recente " +
+                     ", ".join(f"{p} {v:,.2f}" for p, v in history))
+        lines.append("  previsão " + ", ".join(
+            f"{p} {f:,.2f} [{lo:,.2f}; {hi:,.2f}]"
+            for p, f, lo, hi in zip(result["future"], s["forecast"], s["lower"], s["upper"])
+        ))
+    if len(result["series"]) > max_series:
+        lines.append(f"(+{len(result['series']) - max_series} séries menores)")
+    return "\n".join(lines)
+
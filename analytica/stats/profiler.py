@@ -0,0 +1,372 @@
+# ============================================
+# ANALYSTIC.A — PERFIL ESTATÍSTICO DE TABELAS
+# Uma passada em blocos (cursor no servidor) com NumPy/pandas:
+# contagens, nulos, quantis, distintos, top-k, correlações e
+# tendência mensal. Cache pela versão dos dados da tabela.
+# ============================================
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Adiciona o diretório raiz de analytica ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache
+from db.data_version import get_table_version
+from db.database import db_connection, quote_ident
+from db.redis_client import REDIS_ERRORS, get_redis, redis_failed
+
+PROFILE_CHUNK_ROWS = int(os.getenv("PROFILE_CHUNK_ROWS", "100000"))
+# Amostra uniforme para quantis (exatos quando a tabela cabe nela)
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "200000"))
+PROFILE_CACHE_TTL = 24 * 3600
+
+TOP_K = 5
+TOP_K_CANDIDATES = 1000        # contagens mantidas por coluna entre blocos
+DISTINCT_SKETCH_SIZE = 4096    # KMV: menores hashes guardados por coluna
+MAX_CORRELATION_COLUMNS = 20
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+_local = LRUCache(max_entries=128, ttl=PROFILE_CACHE_TTL)
+
+
+# ============================================
+# ACUMULADORES
+# ============================================
+class _ColumnStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.kind = None            # "numeric" | "datetime" | "text"
+        self.count = 0
+        self.nulls = 0
+        self.sum = 0.0
+        # Média e M2 (soma dos quadrados dos desvios) combinados por bloco
+        # (Chan/Welford): estável mesmo com média grande e variância pequena
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.top: Dict = {}
+
+    def update(self, series: pd.Series):
+        mask = series.notna()
+        valid = series[mask]
+        self.count += len(series)
+        self.nulls += int(len(series) - len(valid))
+        if self.kind is None and len(valid):
+            if pd.api.types.is_numeric_dtype(valid) and not pd.api.types.is_bool_dtype(valid):
+                self.kind = "numeric"
+            elif pd.api.types.is_datetime64_any_dtype(valid):
+                self.kind = "datetime"
+            else:
+                self.kind = "text"
+        if not len(valid):
+            return
+
+        if self.kind == "numeric":
+            values = valid.to_numpy(dtype=np.float64)
+            self._merge_moments(values)
+            self.sum += float(values.sum())
+            lo, hi = float(values.min()), float(values.max())
+        else:
+            try:
+                lo, hi = valid.min(), valid.max()
+            except TypeError:       # tipos misturados numa coluna de texto
+                lo, hi = str(valid.astype(str).min()), str(valid.astype(str).max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+        # Distintos: k menores hashes (K-Minimum Values)
+        hashes = pd.util.hash_array(valid.to_numpy())
+        if len(self.hashes) == DISTINCT_SKETCH_SIZE:
+            hashes = hashes[hashes < self.hashes[-1]]   # só os que entram no sketch
+        merged = np.unique(np.concatenate([self.hashes, hashes]))
+        self.hashes = merged[:DISTINCT_SKETCH_SIZE]
+
+        # Top-k: texto, e numéricas enquanto têm poucos valores distintos
+        if self.kind == "text" or (self.kind == "numeric" and len(self.hashes) < DISTINCT_SKETCH_SIZE):
+            for value, n in valid.value_counts().items():
+                self.top[value] = self.top.get(value, 0) + int(n)
+            if len(self.top) > TOP_K_CANDIDATES:
+                keep = sorted(self.top.items(), key=lambda kv: kv[1], reverse=True)[:TOP_K_CANDIDATES]
+                self.top = dict(keep)
+
+    def _merge_moments(self, values: np.ndarray):
+        n_b = len(values)
+        mean_b = float(values.mean())
+        m2_b = float(np.dot(values - mean_b, values - mean_b))
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def std(self) -> float:
+        """Desvio padrão populacional (ddof=0)"""
+        return float(np.sqrt(self.m2 / self.n)) if self.n else 0.0
+
+    def distinct(self) -> tuple:
+        """(estimativa, exato?)"""
+        k = len(self.hashes)
+        if k < DISTINCT_SKETCH_SIZE:
+            return k, True
+        kth = float(self.hashes[-1]) / float(np.iinfo(np.uint64).max)
+        return int((k - 1) / kth), False
+
+
+class _Sample:
+    """Amostra uniforme: as linhas com as menores prioridades aleatórias"""
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.frame: Optional[pd.DataFrame] = None
+        self.priority = np.empty(0)
+
+    def update(self, frame: pd.DataFrame):
+        priority = self.rng.random(len(frame))
+        if self.frame is not None:
+            frame = pd.concat([self.frame, frame], ignore_index=True)
+            priority = np.concatenate([self.priority, priority])
+        if len(frame) > self.size:
+            keep = np.argpartition(priority, self.size)[:self.size]
+            frame, priority = frame.iloc[keep].reset_index(drop=True), priority[keep]
+        self.frame, self.priority = frame, priority
+
+
+class _Correlation:
+    """Co-momentos por pares com linhas completas no par (Pearson)"""
+
+    def __init__(self, columns: List[str]):
+        self.columns = columns
+        k = len(columns)
+        self.n = np.zeros((k, k))
+        self.sx = np.zeros((k, k))
+        self.sxx = np.zeros((k, k))
+        self.sxy = np.zeros((k, k))
+
+    def update(self, frame: pd.DataFrame):
+        values = frame[self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        x = np.where(present, values, 0.0)
+        m = present.astype(np.float64)
+        self.n += m.T @ m
+        self.sx += x.T @ m          # soma de x_i nas linhas onde x_j também existe
+        self.sxx += (x * x).T @ m
+        self.sxy += x.T @ x
+
+    def matrix(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            n = self.n
+            cov = self.sxy - self.sx * self.sx.T / n
+            var_i = self.sxx - self.sx ** 2 / n
+            var_j = var_i.T
+            return cov / np.sqrt(var_i * var_j)
+
+
+# ============================================
+# PERFIL
+# ============================================
+def _iter_chunks(table: str):
+    """Blocos de PROFILE_CHUNK_ROWS linhas por cursor nomeado (sem carregar tudo)"""
+    with db_connection() as conn:
+        cur = conn.cursor(name=f"profile_{os.getpid()}")
+        cur.itersize = PROFILE_CHUNK_ROWS
+        cur.execute(f"SELECT * FROM {quote_ident(table)}")
+        columns = None
+        while True:
+            rows = cur.fetchmany(PROFILE_CHUNK_ROWS)
+            if columns is None and cur.description:
+                columns = [d[0] for d in cur.description]
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+        cur.close()
+        conn.commit()
+
+
+def _coerce(frame: pd.DataFrame) -> pd.DataFrame:
+    # Decimal (NUMERIC) e datas chegam como object: converte para tipos nativos
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            sample = frame[col].dropna().head(1)
+            if len(sample) and hasattr(sample.iloc[0], "as_tuple"):
+                frame[col] = pd.to_numeric(frame[col], errors="coerce")
+            elif len(sample) and hasattr(sample.iloc[0], "isoformat"):
+                frame[col] = pd.to_datetime(frame[col], errors="coerce", utc=True).dt.tz_localize(None)
+    return frame
+
+
+def _json_value(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def profile_frames(chunks, date_column: Optional[str] = None) -> dict:
+    """Perfil de uma sequência de DataFrames (uma passada)"""
+    stats: Dict[str, _ColumnStats] = {}
+    sample = _Sample(PROFILE_SAMPLE_ROWS)
+    correlation: Optional[_Correlation] = None
+    monthly: Optional[pd.DataFrame] = None
+    rows = 0
+
+    for frame in chunks:
+        frame = _coerce(frame)
+        rows += len(frame)
+        for col in frame.columns:
+            stats.setdefault(col, _ColumnStats(col)).update(frame[col])
+
+        numeric = [c for c in frame.columns if stats[c].kind == "numeric"]
+        sample.update(frame[numeric])
+        if correlation is None and len(numeric) >= 2:
+            correlation = _Correlation(numeric[:MAX_CORRELATION_COLUMNS])
+        if correlation is not None:
+            correlation.update(frame)
+
+        if date_column is None:
+            date_column = next((c for c in frame.columns if stats[c].kind == "datetime"), None)
+        if date_column is not None and numeric and date_column in frame.columns:
+            dates = frame[date_column]
+            if not pd.api.types.is_datetime64_any_dtype(dates):
+                # Bloco com a coluna toda nula (ou texto) chega como object
+                dates = pd.to_datetime(dates, errors="coerce", utc=True).dt.tz_localize(None)
+            month = dates.dt.to_period("M")
+            grouped = frame[numeric].groupby(month).agg(["sum", "count"])
+            monthly = grouped if monthly is None else monthly.add(grouped, fill_value=0)
+
+    profile = {"rows": rows, "columns": {}}
+    for col, s in stats.items():
+        distinct, exact = s.distinct()
+        info = {
+            "type": s.kind or "empty",
+            "nulls": s.nulls,
+            "null_pct": round(100.0 * s.nulls / s.count, 2) if s.count else 0.0,
+            "distinct": distinct,
+            "distinct_exact": exact,
+            "min": _json_value(s.min),
+            "max": _json_value(s.max),
+        }
+        if s.kind == "numeric" and s.n:
+            info["sum"] = s.sum
+            info["mean"] = s.mean
+            info["std"] = s.std()
+            values = sample.frame[col].dropna().to_numpy() if sample.frame is not None else np.empty(0)
+            if len(values):
+                info["quantiles"] = dict(zip(
+                    (f"p{int(q * 100)}" for q in QUANTILES),
+                    np.quantile(values, QUANTILES).tolist(),
+                ))
+        # Numéricas de alta cardinalidade param de contar no meio: sem top-k
+        if s.top and (s.kind != "numeric" or exact):
+            top = sorted(s.top.items(), key=lambda kv: kv[1], reverse=True)[:TOP_K]
+            if top[0][1] > 1:
+                info["top"] = [[_json_value(v), n] for v, n in top]
+        profile["columns"][col] = info
+    profile["quantiles_exact"] = rows <= PROFILE_SAMPLE_ROWS
+
+    if correlation is not None:
+        matrix = correlation.matrix()
+        cols = correlation.columns
+        pairs = [
+            (cols[i], cols[j], float(matrix[i, j]))
+            for i in range(len(cols)) for j in range(i + 1, len(cols))
+            if np.isfinite(matrix[i, j])
+        ]
+        pairs.sort(key=lambda p: abs(p[2]), reverse=True)
+        profile["correlations"] = [[a, b, round(r, 4)] for a, b, r in pairs[:10]]
+
+    if monthly is not None:
+        trend = {}
+        for col in monthly.columns.get_level_values(0).unique():
+            sums = monthly[(col, "sum")].sort_index()
+            trend[col] = {str(period): float(v) for period, v in sums.items()}
+        profile["monthly"] = {"date_column": date_column, "sum": trend}
+    return profile
+
+
+def _cache_key(table: str, version: int, date_column: Optional[str]) -> str:
+    return f"analytica:profile:{table}:{version}:{date_column or ''}"
+
+
+def profile_table(table: str, date_column: Optional[str] = None) -> dict:
+    """Perfil da tabela armazenada (cacheado até a próxima ingestão)"""
+    table = table.strip().lower()
+    version = get_table_version(table)
+    key = _cache_key(table, version, date_column)
+
+    profile = _local.get(key)
+    if profile is not None:
+        return profile
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(key)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+            r = raw = None
+        if raw is not None:
+            profile = json.loads(raw)
+            _local.set(key, profile)
+            return profile
+
+    profile = profile_frames(_iter_chunks(table), date_column)
+    profile["table"] = table
+    profile["version"] = version
+    _local.set(key, profile)
+    if r is not None:
+        try:
+            r.set(key, json.dumps(profile, default=str), ex=PROFILE_CACHE_TTL)
+        except REDIS_ERRORS as e:
+            redis_failed(e)
+    return profile
+
+
+# ============================================
+# TEXTO COMPACTO PARA O PROMPT DA IA
+# ============================================
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.4g}" if abs(value) < 1e6 else f"{value:,.0f}"
+    return str(value)
+
+
+def profile_to_text(profile: dict, max_columns: int = 30, max_months: int = 12) -> str:
+    """Resumo em poucas linhas (algumas centenas de tokens) do perfil"""
+    lines = [f"Tabela {profile.get('table', '')}: {profile['rows']} linhas, {len(profile['columns'])} colunas"]
+    for col, info in list(profile["columns"].items())[:max_columns]:
+        parts = [f"- {col} ({info['type']}): nulos {info['null_pct']}%",
+                 f"distintos {'' if info['distinct_exact'] else '~'}{info['distinct']}"]
+        if info["type"] == "numeric" and "mean" in info:
+            parts.append(f"média {_fmt(info['mean'])}, desvio {_fmt(info['std'])}, "
+                         f"mín {_fmt(info['min'])}, máx {_fmt(info['max'])}")
+            q = info.get("quantiles")
+            if q:
+                parts.append(f"p25/p50/p75 {_fmt(q['p25'])}/{_fmt(q['p50'])}/{_fmt(q['p75'])}")
+        elif info["type"] == "datetime":
+            parts.append(f"de {info['min']} a {info['max']}")
+        if info.get("top") and info["type"] != "numeric":
+            parts.append("mais frequentes: " + ", ".join(f"{v} ({n})" for v, n in info["top"]))
+        lines.append("; ".join(parts))
+
+    if profile.get("correlations"):
+        lines.append("Correlações mais fortes: " + ", ".join(
+            f"{a}~{b} r={r:+.2f}" for a, b, r in profile["correlations"][:5]
+        ))
+    monthly = profile.get("monthly")
+    if monthly:
+        for col, series in list(monthly["sum"].items())[:5]:
+            recent = list(series.items())[-max_months:]
+            lines.append(f"Soma mensal de {col} por {monthly['date_column']}: " +
+                         ", ".join(f"{m} {_fmt(v)}" for m, v in recent))
+    return "\n".join(lines)
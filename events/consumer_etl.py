@@ -1,14 +1,37 @@
 import json
+import os
+import socket
 import redis
 
-from analytica.etl.etl_engine import run_etl
+from analytica.etl.jobs import run_etl, update_job, EVENTS_STREAM, UPLOAD_EVENT
 
-r = redis.Redis(host="redis", port=6379)
+r = redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", "6379")))
+
+# Consumer group: vários workers dividem os eventos, cada um processado uma vez
+GROUP = "etl_workers"
+CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+
+try:
+    r.xgroup_create(EVENTS_STREAM, GROUP, id="0", mkstream=True)
+except redis.exceptions.ResponseError:
+    pass  # grupo já existe
+
+# Primeiro reprocessa pendentes deste consumer ("0"), depois só mensagens novas (">")
+last_id = "0"
 
 while True:
-    messages = r.xread({"analystica_stream": "$"}, block=0)
-    for stream, msgs in messages:
+    messages = r.xreadgroup(GROUP, CONSUMER, {EVENTS_STREAM: last_id}, count=1, block=5000)
+    if last_id == "0" and not (messages and messages[0][1]):
+        last_id = ">"
+        continue
+
+    for stream, msgs in messages or []:
         for msg_id, msg_data in msgs:
             event = json.loads(msg_data[b"data"].decode())
-            if event["event"] == "UPLOAD_COMPLETED":
-                run_etl(event["payload"])
+            if event["event"] == UPLOAD_EVENT:
+                try:
+                    run_etl(event["payload"])
+                except Exception as e:
+                    print(f"❌ Erro no ETL {msg_id}: {e}")
+                    update_job(event["payload"]["job_id"], status="error", error=str(e))
+            r.xack(EVENTS_STREAM, GROUP, msg_id)
@@ -1,11 +1,15 @@
+import os
 import redis
 import json
 
-r = redis.Redis(host="redis", port=6379)
+r = redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=int(os.getenv("REDIS_PORT", "6379")))
+
+# Mesmo stream lido por events/consumer_etl.py
+STREAM = "analystic_a_stream"
 
 def publish(event_type, payload):
     data = {
         "event": event_type,
         "payload": payload
     }
-    r.xadd("analystic_a_stream", {"data": json.dumps(data)})
+    r.xadd(STREAM, {"data": json.dumps(data)})
@@ -1,21 +1,281 @@
+# ============================================
+# ANALYSTIC.A — SERVIDOR WEBSOCKET EM TEMPO REAL
+# Um único assinante Redis (asyncio) por processo distribui as mensagens
+# a um registro tópico → conexões em memória. Cada cliente tem fila de
+# envio limitada: mensagens com "key" são coalescidas (vale a mais nova),
+# as demais descartam as mais antigas quando o cliente não acompanha.
+#
+# Protocolo do cliente:
+#   ws://host:8765/?tables=vendas,estoque&dashboards=42
+#   {"action": "subscribe" | "unsubscribe", "tables": [...], "dashboards": [...]}
+# Sem filtro na conexão, recebe tudo (compatível com o cliente antigo).
+# ============================================
 import asyncio
-import redis
-import websockets
 import json
+import os
+import time
+from collections import OrderedDict
+from itertools import count
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+import redis.asyncio as aioredis
+import websockets
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REALTIME_CHANNEL = os.getenv("REALTIME_CHANNEL", "realtime_channel")
+
+WS_HOST = os.getenv("WS_HOST", "0.0.0.0")
+WS_PORT = int(os.getenv("WS_PORT", "8765"))
+
+# Mensagens pendentes por cliente antes de descartar/coalescer
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "64"))
+# Keepalive: cliente que não responde ao ping nesse prazo é desconectado
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+# Tamanho máximo das mensagens recebidas do cliente (só assinaturas)
+WS_MAX_INCOMING = 64 * 1024
+
+ALL_TOPIC = "*"
+
+
+# ============================================
+# CLIENTE: FILA LIMITADA + TAREFA DE ENVIO
+# ============================================
+class Client:
+    def __init__(self, websocket, queue_size: int = WS_QUEUE_SIZE):
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.topics: Set[str] = set()
+        self._pending: "OrderedDict[object, str]" = OrderedDict()
+        self._seq = count()
+        self._ready = asyncio.Event()
+        self.dropped = 0          # descartadas desde o último aviso
+        self.dropped_total = 0
+
+    def offer(self, text: str, key: Optional[str] = None):
+        """Enfileira sem bloquear; nunca espera pelo cliente"""
+        key = ("key", key) if key is not None else None
+        if key is not None and key in self._pending:
+            # Coalesce: substitui o valor pendente, mantendo a posição
+            self._pending[key] = text
+            return
+        if len(self._pending) >= self.queue_size:
+            self._pending.popitem(last=False)      # descarta a mais antiga
+            self.dropped += 1
+            self.dropped_total += 1
+        self._pending[key if key is not None else next(self._seq)] = text
+        self._ready.set()
+
+    async def sender(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending:
+                if self.dropped:
+                    # Avisa que perdeu mensagens: o dashboard pode recarregar
+                    notice = json.dumps({"type": "lagged", "dropped": self.dropped})
+                    self.dropped = 0
+                    await self._send(notice)
+                _, text = self._pending.popitem(last=False)
+                await self._send(text)
+
+    async def _send(self, text: str):
+        # Sem timeout por envio: um cliente travado para de responder aos
+        # pings e o próprio websockets fecha a conexão (ping_timeout)
+        await self.websocket.send(text)
+
+
+# ============================================
+# REGISTRO TÓPICO → CONEXÕES
+# ============================================
+class Registry:
+    def __init__(self):
+        self.topics: Dict[str, Set[Client]] = {}
+        self.clients: Set[Client] = set()
+        self.published = 0
+
+    def add(self, client: Client):
+        self.clients.add(client)
+
+    def remove(self, client: Client):
+        self.unsubscribe(client, set(client.topics))
+        self.clients.discard(client)
+
+    def subscribe(self, client: Client, topics: Set[str]):
+        for topic in topics - client.topics:
+            self.topics.setdefault(topic, set()).add(client)
+        client.topics |= topics
+
+    def unsubscribe(self, client: Client, topics: Set[str]):
+        for topic in topics & client.topics:
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.topics[topic]
+        client.topics -= topics
+
+    def dispatch(self, raw):
+        """Serializa uma vez e entrega a cada cliente inscrito (uma vez só)"""
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+
+        groups = [self.topics[t] for t in (ALL_TOPIC, *message_topics(data)) if t in self.topics]
+        if not groups:
+            return
+        # Um só grupo (caso comum): itera direto, sem copiar o conjunto
+        targets = groups[0] if len(groups) == 1 else set().union(*groups)
+
+        text = raw.decode() if isinstance(raw, bytes) else raw
+        key = data.get("key")
+        for client in tuple(targets):
+            client.offer(text, key)
+        self.published += 1
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "topics": len(self.topics),
+            "published": self.published,
+            "dropped": sum(c.dropped_total for c in self.clients),
+        }
 
-r = redis.Redis(host="redis", port=6379)
 
-async def handler(websocket):
-    pubsub = r.pubsub()
-    pubsub.subscribe("realtime_channel")
+def message_topics(data: dict) -> Set[str]:
+    topics = set()
+    if data.get("table"):
+        topics.add(f"table:{str(data['table']).lower()}")
+    if data.get("dashboard") is not None:
+        topics.add(f"dashboard:{data['dashboard']}")
+    return topics
+
+
+def requested_topics(tables=(), dashboards=()) -> Set[str]:
+    topics = {f"table:{t.strip().lower()}" for t in tables if str(t).strip()}
+    topics |= {f"dashboard:{str(d).strip()}" for d in dashboards if str(d).strip()}
+    return topics
+
+
+def _split(values) -> list:
+    if isinstance(values, str):
+        values = [values]
+    return [v for value in values or [] for v in str(value).split(",")]
+
+
+registry = Registry()
+
+
+# ============================================
+# ASSINANTE REDIS (UM POR PROCESSO)
+# ============================================
+def _redis_client():
+    if REDIS_URL:
+        return aioredis.Redis.from_url(REDIS_URL)
+    return aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+
+
+async def redis_subscriber():
+    """Reconecta com backoff; os clientes continuam conectados durante a queda"""
+    backoff = 1.0
+    while True:
+        client = _redis_client()
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(REALTIME_CHANNEL)
+            backoff = 1.0
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    registry.dispatch(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Erro no assinante Redis: {e} (nova tentativa em {backoff:.0f}s)")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            try:
+                await pubsub.aclose()
+                await client.aclose()
+            except Exception:
+                pass
+
+
+# ============================================
+# CONEXÕES WEBSOCKET
+# ============================================
+def _request_path(websocket) -> str:
+    # websockets >= 13 expõe request.path; versões antigas, websocket.path
+    request = getattr(websocket, "request", None)
+    return getattr(request, "path", None) or getattr(websocket, "path", "/") or "/"
+
+
+async def _read_subscriptions(websocket, client: Client):
+    async for raw in websocket:
+        try:
+            data = json.loads(raw)
+            action = data.get("action")
+            topics = requested_topics(_split(data.get("tables")), _split(data.get("dashboards")))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if action == "subscribe":
+            # Primeira assinatura explícita substitui o "tudo" do cliente antigo
+            registry.unsubscribe(client, {ALL_TOPIC})
+            registry.subscribe(client, topics)
+        elif action == "unsubscribe":
+            registry.unsubscribe(client, topics)
+        elif action == "ping":
+            client.offer(json.dumps({"type": "pong", "topics": sorted(client.topics)}))
+
+
+async def handler(websocket, path: Optional[str] = None):
+    query = parse_qs(urlparse(path or _request_path(websocket)).query)
+    topics = requested_topics(_split(query.get("tables", []) + query.get("table", [])),
+                              _split(query.get("dashboards", []) + query.get("dashboard", [])))
+
+    client = Client(websocket)
+    registry.add(client)
+    registry.subscribe(client, topics or {ALL_TOPIC})
+
+    sender = asyncio.create_task(client.sender())
+    reader = asyncio.create_task(_read_subscriptions(websocket, client))
+    try:
+        # Termina quando o cliente desconecta ou o envio falha
+        await asyncio.wait({sender, reader}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        registry.remove(client)
+        for task in (sender, reader):
+            task.cancel()
+        await asyncio.gather(sender, reader, return_exceptions=True)
+        await websocket.close()
+
+
+async def report_stats(interval: float = 60.0):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"[{time.strftime('%H:%M:%S')}] realtime: {registry.stats()}")
 
-    async for message in pubsub.listen():
-        if message["type"] == "message":
-            data = json.loads(message["data"].decode())
-            await websocket.send(json.dumps(data))
 
 async def main():
-    async with websockets.serve(handler, "0.0.0.0", 8765):
-        await asyncio.Future()
+    subscriber = asyncio.create_task(redis_subscriber())
+    reporter = asyncio.create_task(report_stats())
+    # Sem compressão por mensagem: com milhares de conexões o contexto
+    # zlib de cada uma custa mais memória/CPU do que economiza em banda
+    async with websockets.serve(handler, WS_HOST, WS_PORT, compression=None,
+                                max_size=WS_MAX_INCOMING, backlog=2048,
+                                ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT):
+        try:
+            await asyncio.Future()
+        finally:
+            subscriber.cancel()
+            reporter.cancel()
+
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())